@@ -0,0 +1,107 @@
+import os
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Dict, List
+
+from text_utils import lemmatize, tokenize
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+# 送給模型的候選單字數量上限
+DEFAULT_TOP_N = int(os.getenv('CANDIDATE_TOP_N', '30'))
+# 關鍵字與商務詞彙的分數加權
+KEYWORD_BOOST = 3.0
+
+
+@lru_cache(maxsize=None)
+def load_word_list(filename) -> frozenset:
+    """讀取 data/ 目錄下一行一個字的詞表，忽略空行與 # 註解"""
+    path = os.path.join(DATA_DIR, filename)
+    with open(path, encoding='utf-8') as f:
+        return frozenset(
+            line.strip().lower() for line in f
+            if line.strip() and not line.startswith('#')
+        )
+
+
+def select_candidates(transcript_text, keywords=None, top_n=None, context_snippets=2, context_radius=5) -> List[Dict]:
+    """
+    在本地先挑出值得交給模型的候選單字
+
+    分詞、還原原形後計數，略過常見字與口語填充詞，
+    關鍵字與商務詞彙加權，最後取分數最高的 top_n 個字並附上幾段上下文。
+    原形只用來合併同一個字的變化形式，送給模型的是該字在字幕中最常出現的寫法。
+
+    Args:
+        transcript_text: 字幕內容
+        keywords: 額外加權的關鍵字，例如 TOEICWordExtractor.toeic_keywords
+        top_n: 候選單字數量，預設讀取 CANDIDATE_TOP_N
+        context_snippets: 每個候選字附上的上下文片段數
+        context_radius: 上下文片段在該字前後各取幾個字
+
+    Returns:
+        [{'word': 最常出現的寫法, 'lemma': 原形, 'count': 出現次數, 'contexts': [上下文片段, ...]}, ...]，
+        依分數排序
+    """
+    top_n = top_n or DEFAULT_TOP_N
+    common = load_word_list('common_words.txt')
+    # 以原形比對，marketing 與 market 視為同一個字
+    boosted = {lemmatize(w) for w in load_word_list('business_words.txt') | set(keywords or [])}
+
+    counts = Counter()
+    forms = defaultdict(Counter)
+    for token in tokenize(transcript_text):
+        if len(token) < 3 or token in common or "'" in token:
+            continue
+        lemma = lemmatize(token)
+        if lemma in common:
+            continue
+        counts[lemma] += 1
+        forms[lemma][token] += 1
+
+    def score(item):
+        lemma, count = item
+        # 長字通常較有學習價值；重複出現的字代表和影片主題相關
+        value = count * (1 + min(len(lemma), 12) / 12)
+        if lemma in boosted:
+            value *= KEYWORD_BOOST
+        return value
+
+    ranked = sorted(counts.items(), key=score, reverse=True)[:top_n]
+    selected = {lemma for lemma, _ in ranked}
+
+    # 只掃描一次字幕，替每個候選字收集前幾次出現位置前後的短片段
+    contexts = defaultdict(list)
+    raw_words = transcript_text.split()
+    for i, raw in enumerate(raw_words):
+        tokens = tokenize(raw)
+        if not tokens:
+            continue
+        lemma = lemmatize(tokens[0])
+        if lemma in selected and len(contexts[lemma]) < context_snippets:
+            contexts[lemma].append(' '.join(raw_words[max(0, i - context_radius):i + context_radius + 1]))
+
+    return [
+        {'word': forms[lemma].most_common(1)[0][0], 'lemma': lemma, 'count': count, 'contexts': contexts[lemma]}
+        for lemma, count in ranked
+    ]
+
+
+def format_candidates(candidates, known=None) -> str:
+    """
+    將候選單字整理成精簡的提示詞文字，每行一個字與它的上下文
+
+    Args:
+        known: 單字庫中已有的字 {原形: 單字資料}；有例句的標記 [known]，沒有例句的標記 [example only]
+    """
+    known = known or {}
+
+    def marker(candidate):
+        entry = known.get(candidate.get('lemma') or lemmatize(candidate['word']))
+        if entry is None:
+            return ''
+        return ' [known]' if entry.get('example_sentence') else ' [example only]'
+
+    return '\n'.join(
+        f"- {c['word']}{marker(c)}: " + ' | '.join(c['contexts'])
+        for c in candidates
+    )
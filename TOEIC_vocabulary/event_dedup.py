@@ -0,0 +1,113 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+class EventDeduplicator:
+    """
+    記錄已處理的 LINE webhookEventId，讓重送的事件只被確認而不再重做一次
+
+    預設存在記憶體中（有時間窗與數量上限）；設定 db_path 時改用 SQLite，
+    可以讓多個 worker process 共用同一份紀錄。
+
+    Args:
+        window_seconds: 事件 ID 保留時間，預設讀取 EVENT_DEDUP_WINDOW（1 小時）
+        max_entries: 記憶體模式最多保留的事件數，預設讀取 EVENT_DEDUP_MAX_ENTRIES
+        db_path: SQLite 檔案路徑，預設讀取 EVENT_DEDUP_DB，未設定時使用記憶體
+    """
+
+    def __init__(self, window_seconds=None, max_entries=None, db_path=None):
+        self.window_seconds = window_seconds or int(os.getenv('EVENT_DEDUP_WINDOW', '3600'))
+        self.max_entries = max_entries or int(os.getenv('EVENT_DEDUP_MAX_ENTRIES', '10000'))
+        self.db_path = db_path or os.getenv('EVENT_DEDUP_DB')
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()
+        self._local = threading.local()
+        self._duplicates = metrics.counter('webhook_duplicate_events_total', '被略過的重送 webhook 事件數')
+        if self.db_path:
+            self._init_schema()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS processed_events (
+                    event_id TEXT PRIMARY KEY,
+                    processed_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_processed_events_at ON processed_events (processed_at)')
+
+    def seen_before(self, event_id):
+        """
+        檢查並登記事件 ID
+
+        Returns:
+            True 代表時間窗內已處理過此事件；False 代表第一次看到，並已登記
+        """
+        if not event_id:
+            return False
+        now = time.time()
+        if self.db_path:
+            duplicate = self._seen_before_sqlite(event_id, now)
+        else:
+            duplicate = self._seen_before_memory(event_id, now)
+        if duplicate:
+            self._duplicates.inc()
+        return duplicate
+
+    def _seen_before_memory(self, event_id, now):
+        with self._lock:
+            cutoff = now - self.window_seconds
+            while self._seen:
+                oldest_id, oldest_at = next(iter(self._seen.items()))
+                if oldest_at >= cutoff and len(self._seen) < self.max_entries:
+                    break
+                self._seen.popitem(last=False)
+            if event_id in self._seen:
+                return True
+            self._seen[event_id] = now
+            return False
+
+    def _seen_before_sqlite(self, event_id, now):
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute('DELETE FROM processed_events WHERE processed_at < ?', (now - self.window_seconds,))
+                cursor = conn.execute(
+                    'INSERT OR IGNORE INTO processed_events (event_id, processed_at) VALUES (?, ?)',
+                    (event_id, now)
+                )
+            return cursor.rowcount == 0
+        except Exception as e:
+            # 紀錄失敗時寧可重做一次，也不要漏掉使用者的請求
+            logging.error(f"讀寫事件去重紀錄時發生錯誤: {e}")
+            return False
+
+    def forget(self, event_id):
+        """移除事件登記，例如工作因佇列已滿被拒絕時，讓之後的重送可以再處理"""
+        if not event_id:
+            return
+        if self.db_path:
+            try:
+                conn = self._connect()
+                with conn:
+                    conn.execute('DELETE FROM processed_events WHERE event_id = ?', (event_id,))
+            except Exception as e:
+                logging.error(f"移除事件去重紀錄時發生錯誤: {e}")
+        else:
+            with self._lock:
+                self._seen.pop(event_id, None)
@@ -0,0 +1,226 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import metrics
+from text_utils import lemmatize
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# 常見詞性縮寫統一成完整名稱，避免同一個字因為寫法不同存成兩筆
+_POS_ALIASES = {
+    'n': 'noun', 'n.': 'noun',
+    'v': 'verb', 'v.': 'verb',
+    'adj': 'adjective', 'adj.': 'adjective', 'a.': 'adjective',
+    'adv': 'adverb', 'adv.': 'adverb',
+    'prep': 'preposition', 'prep.': 'preposition',
+    'conj': 'conjunction', 'conj.': 'conjunction',
+}
+
+
+def normalize_pos(part_of_speech) -> str:
+    pos = (part_of_speech or '').strip().lower()
+    return _POS_ALIASES.get(pos, pos)
+
+
+class Lexicon:
+    """
+    以 SQLite 儲存的單字庫，key 為 (原形, 詞性)
+
+    每次萃取成功的單字都會寫入，之後同一個字只需要模型挑選（必要時補例句），
+    定義與詞性直接由單字庫補上。資料表為空時可以先從內附的詞典檔匯入。
+
+    Args:
+        db_path: SQLite 檔案路徑，預設讀取 LEXICON_DB
+        seed_path: 內附詞典檔（TSV：原形、詞性、定義、例句可省略），預設讀取 LEXICON_SEED
+    """
+
+    def __init__(self, db_path=None, seed_path=None):
+        self.db_path = db_path or os.getenv('LEXICON_DB', 'lexicon.db')
+        self.seed_path = seed_path or os.getenv('LEXICON_SEED', os.path.join(DATA_DIR, 'lexicon_seed.tsv'))
+        self._local = threading.local()
+        self._hits = metrics.counter('lexicon_hits_total', '由單字庫補齊欄位的單字數')
+        self._misses = metrics.counter('lexicon_misses_total', '單字庫中沒有、需要模型產生的單字數')
+        self._init_schema()
+        if self.seed_path and os.path.exists(self.seed_path) and self.size() == 0:
+            self.seed_from_file(self.seed_path)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS lexicon (
+                    lemma TEXT NOT NULL,
+                    pos TEXT NOT NULL,
+                    word TEXT NOT NULL,
+                    definition TEXT NOT NULL,
+                    example_sentence TEXT,
+                    source TEXT NOT NULL,
+                    uses INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (lemma, pos)
+                )
+            ''')
+
+    def size(self) -> int:
+        return self._connect().execute('SELECT COUNT(*) FROM lexicon').fetchone()[0]
+
+    def seed_from_file(self, path) -> int:
+        """
+        匯入 TSV 詞典檔，已存在的 (原形, 詞性) 不會被覆寫
+
+        Returns:
+            匯入的筆數
+        """
+        rows = []
+        now = time.time()
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip() or line.startswith('#'):
+                    continue
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) < 3:
+                    continue
+                word, pos, definition = fields[0].strip(), normalize_pos(fields[1]), fields[2].strip()
+                example = fields[3].strip() if len(fields) > 3 and fields[3].strip() else None
+                rows.append((lemmatize(word), pos, word, definition, example, 'seed', now))
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO lexicon (lemma, pos, word, definition, example_sentence, source, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+        logging.info(f"已從 {path} 匯入 {len(rows)} 筆單字")
+        return len(rows)
+
+    def lookup(self, word, part_of_speech=None) -> Optional[Dict[str, str]]:
+        """
+        查詢單字；沒有指定詞性時回傳最常使用的那一筆
+
+        Returns:
+            {'word', 'definition', 'part_of_speech', 'example_sentence'}（例句可能為 None）；查無資料時回傳 None
+        """
+        lemma = lemmatize(word)
+        pos = normalize_pos(part_of_speech)
+        try:
+            conn = self._connect()
+            if pos:
+                row = conn.execute(
+                    'SELECT word, definition, pos, example_sentence FROM lexicon WHERE lemma = ? AND pos = ?',
+                    (lemma, pos)
+                ).fetchone()
+            else:
+                row = conn.execute(
+                    'SELECT word, definition, pos, example_sentence FROM lexicon WHERE lemma = ? '
+                    'ORDER BY uses DESC, updated_at DESC LIMIT 1',
+                    (lemma,)
+                ).fetchone()
+        except Exception as e:
+            logging.error(f"查詢單字庫時發生錯誤: {e}")
+            return None
+        if row is None:
+            return None
+        return {'word': row[0], 'definition': row[1], 'part_of_speech': row[2], 'example_sentence': row[3]}
+
+    def lookup_many(self, words) -> Dict[str, Dict[str, str]]:
+        """一次查詢多個字，回傳 {原形: 單字資料}，查無資料的字不會出現在結果中"""
+        found = {}
+        for word in words:
+            entry = self.lookup(word)
+            if entry is not None:
+                found[lemmatize(word)] = entry
+        return found
+
+    def words_by_pos(self, part_of_speech, limit=50) -> List[str]:
+        """取出同一詞性最常使用的字，用於本地出題的干擾選項"""
+        try:
+            rows = self._connect().execute(
+                'SELECT word FROM lexicon WHERE pos = ? ORDER BY uses DESC, lemma ASC LIMIT ?',
+                (normalize_pos(part_of_speech), limit)
+            ).fetchall()
+        except Exception as e:
+            logging.error(f"查詢單字庫時發生錯誤: {e}")
+            return []
+        return [row[0] for row in rows]
+
+    def fill(self, item):
+        """
+        以單字庫補上模型省略的欄位（definition / part_of_speech / example_sentence），直接修改 item
+
+        Returns:
+            是否有欄位由單字庫補上
+        """
+        if not isinstance(item, dict) or not isinstance(item.get('word'), str):
+            return False
+        missing = [key for key in ('definition', 'part_of_speech', 'example_sentence')
+                   if not (isinstance(item.get(key), str) and item[key].strip())]
+        if not missing:
+            return False
+        entry = self.lookup(item['word'], item.get('part_of_speech') if 'part_of_speech' not in missing else None)
+        if entry is None:
+            self._misses.inc()
+            return False
+        filled = False
+        for key in missing:
+            if entry.get(key):
+                item[key] = entry[key]
+                filled = True
+        if filled:
+            self._hits.inc()
+        return filled
+
+    def record(self, words: List[Dict[str, str]], source='llm'):
+        """
+        寫入萃取結果；已存在的字只增加使用次數、補上缺少的例句，不覆寫原本的定義
+        """
+        now = time.time()
+        rows = [
+            (lemmatize(w['word']), normalize_pos(w['part_of_speech']), w['word'], w['definition'],
+             w.get('example_sentence'), source, now)
+            for w in words
+            if w.get('word') and w.get('part_of_speech') and w.get('definition')
+        ]
+        if not rows:
+            return
+        try:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    'INSERT INTO lexicon (lemma, pos, word, definition, example_sentence, source, uses, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, 1, ?) '
+                    'ON CONFLICT (lemma, pos) DO UPDATE SET '
+                    'uses = uses + 1, '
+                    'example_sentence = COALESCE(lexicon.example_sentence, excluded.example_sentence), '
+                    'updated_at = excluded.updated_at',
+                    rows
+                )
+        except Exception as e:
+            logging.error(f"寫入單字庫時發生錯誤: {e}")
+
+
+_default_lexicon = None
+_default_lexicon_lock = threading.Lock()
+
+def get_lexicon():
+    """取得整個 process 共用的單字庫；LEXICON_ENABLED=0 時回傳 None"""
+    global _default_lexicon
+    if os.getenv('LEXICON_ENABLED', '1') != '1':
+        return None
+    if _default_lexicon is None:
+        with _default_lexicon_lock:
+            if _default_lexicon is None:
+                _default_lexicon = Lexicon()
+    return _default_lexicon
@@ -0,0 +1,236 @@
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import metrics
+from rate_limit import TokenBucket
+from renderer import LINE_MESSAGES_PER_CALL, batch_messages
+from tracing import current_request_id, request_context, span
+
+# 這些狀態碼代表暫時性錯誤，稍後重送通常會成功
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# 沒有狀態碼時只有連線錯誤與逾時會重試；linebot 底層使用 urllib3
+RETRYABLE_ERRORS = (ConnectionError, TimeoutError)
+try:
+    from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+    from urllib3.exceptions import TimeoutError as Urllib3TimeoutError
+    RETRYABLE_ERRORS += (MaxRetryError, NewConnectionError, ProtocolError, Urllib3TimeoutError)
+except ImportError:
+    pass
+try:
+    from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
+    RETRYABLE_ERRORS += (RequestsConnectionError, RequestsTimeout)
+except ImportError:
+    pass
+
+
+def _status_of(error):
+    """linebot 的 ApiException 帶有 HTTP 狀態碼；連線錯誤等其他例外沒有狀態碼"""
+    return getattr(error, 'status', None)
+
+
+def _is_retryable(error):
+    status = _status_of(error)
+    if status is None:
+        return isinstance(error, RETRYABLE_ERRORS)
+    return status in RETRYABLE_STATUSES
+
+
+def _retry_after(error):
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class LineSender:
+    """
+    LINE 訊息的發送元件：限流、合併批次、重試，以及 reply token 失效時改用 push
+
+    - 所有 reply/push 共用一個 token bucket，速率預設讀取 LINE_SEND_RATE（每秒請求數）
+    - send() 只把訊息放進該使用者的待送清單；同一位使用者尚未送出的訊息會合併成每批 5 則，
+      減少 API 呼叫次數；同一位使用者的訊息依序送出，不同使用者由多個執行緒並行發送
+    - 429 與 5xx、連線錯誤與逾時以指數退避重試，其他錯誤直接拋出，重試時帶上同一個 X-Line-Retry-Key 避免重複推播；
+      收到 429 時整個 bucket 一起暫停
+    - reply token 只有一次、而且約一分鐘內有效：超過 reply_token_ttl 或 reply 失敗時改用 push
+
+    Args:
+        api: linebot.v3.messaging.MessagingApi
+        rate: 每秒最多幾個 API 請求，預設讀取 LINE_SEND_RATE
+        burst: 最多累積的突發請求數，預設讀取 LINE_SEND_BURST
+        max_retries: 暫時性錯誤最多重試次數，預設讀取 LINE_SEND_RETRIES
+        backoff: 第一次重試前等待的秒數，之後每次加倍，預設讀取 LINE_SEND_BACKOFF
+        num_workers: 發送執行緒數量，預設讀取 LINE_SENDER_THREADS
+        reply_token_ttl: reply token 視為有效的秒數，預設讀取 LINE_REPLY_TOKEN_TTL
+        request_factory: (reply_request, push_request) 兩個建立請求物件的函式，預設使用 linebot 的 model
+    """
+
+    def __init__(self, api, rate=None, burst=None, max_retries=None, backoff=None, num_workers=None,
+                 reply_token_ttl=None, request_factory=None):
+        self.api = api
+        rate = rate or float(os.getenv('LINE_SEND_RATE', '2000'))
+        self.bucket = TokenBucket(rate, burst or float(os.getenv('LINE_SEND_BURST', str(rate))))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('LINE_SEND_RETRIES', '4'))
+        self.backoff = backoff if backoff is not None else float(os.getenv('LINE_SEND_BACKOFF', '0.5'))
+        self.num_workers = num_workers or int(os.getenv('LINE_SENDER_THREADS', '4'))
+        self.reply_token_ttl = reply_token_ttl or float(os.getenv('LINE_REPLY_TOKEN_TTL', '50'))
+        if request_factory is None:
+            from linebot.v3.messaging import ReplyMessageRequest, PushMessageRequest
+            request_factory = (
+                lambda token, messages: ReplyMessageRequest(reply_token=token, messages=messages),
+                lambda to, messages: PushMessageRequest(to=to, messages=messages),
+            )
+        self._reply_request, self._push_request = request_factory
+
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()
+        self._active = set()
+        self._threads = []
+        self._started = False
+
+        self._calls = {method: metrics.counter('line_api_calls_total', 'LINE API 呼叫次數', {'method': method})
+                       for method in ('reply', 'push')}
+        self._batch_size = metrics.histogram('line_batch_messages', '每次 LINE API 呼叫送出的訊息數',
+                                             buckets=tuple(range(1, LINE_MESSAGES_PER_CALL + 1)))
+        self._retries = metrics.counter('line_send_retries_total', 'LINE API 暫時性錯誤的重試次數')
+        self._fallbacks = metrics.counter('line_reply_fallbacks_total', 'reply token 失效改用 push 的次數')
+        self._failed = metrics.counter('line_send_failed_total', '重試後仍然送不出去的訊息批次')
+        self._pending_gauge = metrics.gauge('line_pending_users', '有待送訊息的使用者數')
+
+    def start(self):
+        with self._cond:
+            if self._started:
+                return
+            for i in range(self.num_workers):
+                thread = threading.Thread(target=self._worker_loop, name=f'line-sender-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+
+    def send(self, user_id, messages, reply_token=None):
+        """
+        排入待送訊息後立即返回；同一位使用者尚未送出的訊息會和這次的合併發送
+        """
+        if not messages:
+            return
+        self.start()
+        with self._cond:
+            entry = self._pending.get(user_id)
+            if entry is None:
+                entry = self._pending[user_id] = {'messages': [], 'reply_token': None, 'reply_at': None,
+                                                  'request_id': current_request_id()}
+            entry['messages'].extend(messages)
+            if reply_token and entry['reply_token'] is None:
+                entry['reply_token'] = reply_token
+                entry['reply_at'] = time.monotonic()
+            self._pending_gauge.set(len(self._pending))
+            self._cond.notify()
+
+    def flush(self, timeout=None) -> bool:
+        """等待所有待送訊息送出（或放棄）；逾時回傳 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._active:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _next_user(self):
+        for user_id in self._pending:
+            if user_id not in self._active:
+                return user_id
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                user_id = self._next_user()
+                while user_id is None:
+                    self._cond.wait()
+                    user_id = self._next_user()
+                entry = self._pending.pop(user_id)
+                self._active.add(user_id)
+                self._pending_gauge.set(len(self._pending))
+            try:
+                reply_token = entry['reply_token']
+                if reply_token and time.monotonic() - entry['reply_at'] > self.reply_token_ttl:
+                    reply_token = None
+                # 合併的訊息沿用第一個排入的 request ID
+                with request_context(entry['request_id']):
+                    self.deliver(user_id, entry['messages'], reply_token)
+            except Exception as e:
+                logging.error(f"發送 LINE 訊息給 {user_id} 失敗: {e}")
+            finally:
+                with self._cond:
+                    self._active.discard(user_id)
+                    self._cond.notify_all()
+
+    def deliver(self, user_id, messages, reply_token=None):
+        """
+        在目前的執行緒同步送出訊息：有 reply token 時第一批用 reply，其餘每 5 則一批 push
+
+        重試後仍然失敗時拋出例外，已經送出的批次不會重送
+        """
+        batches = batch_messages(messages)
+        if reply_token and batches:
+            first = batches.pop(0)
+            try:
+                self._call('reply', lambda: self.api.reply_message(self._reply_request(reply_token, first)), len(first))
+            except Exception as e:
+                if _status_of(e) != 400:
+                    self._failed.inc()
+                    raise
+                # reply token 已經用過或過期，改用 push 送出同一批
+                logging.info(f"reply token 已失效，改用 push 送給 {user_id}")
+                self._fallbacks.inc()
+                batches.insert(0, first)
+
+        for batch in batches:
+            retry_key = str(uuid.uuid4())
+            try:
+                self._call('push', lambda: self.api.push_message(self._push_request(user_id, batch),
+                                                                 x_line_retry_key=retry_key), len(batch))
+            except Exception:
+                self._failed.inc()
+                raise
+
+    def _call(self, method, request, size):
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                with span('line_delivery'):
+                    result = request()
+            except Exception as e:
+                status = _status_of(e)
+                if not _is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = _retry_after(e) or self.backoff * (2 ** attempt) * (1 + random.random() * 0.25)
+                attempt += 1
+                self._retries.inc()
+                logging.warning(f"LINE {method} 失敗（{status or e}），{delay:.1f} 秒後第 {attempt} 次重試")
+                if status == 429:
+                    # 被限流時所有執行緒一起暫停，下一次 acquire() 會等到暫停結束
+                    self.bucket.pause(delay)
+                else:
+                    time.sleep(delay)
+                continue
+            self._calls[method].inc()
+            self._batch_size.observe(size)
+            return result
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending_users': len(self._pending),
+                'pending_messages': sum(len(entry['messages']) for entry in self._pending.values()),
+                'active_users': len(self._active),
+            }
@@ -0,0 +1,445 @@
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import metrics
+from llm_scheduler import INTERACTIVE, LLMScheduler
+from text_utils import estimate_message_tokens
+from tracing import span
+
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 40, 80, 160, 320)
+
+
+class LLMBackend:
+    """
+    模型後端的共同介面
+
+    子類別只需要實作 _chat()（以及選用的 _chat_stream()），
+    這裡統一處理每個後端的並行上限與優先權排程（LLMScheduler）、
+    重試（指數退避加隨機抖動）與延遲指標。
+
+    Args:
+        name: 後端名稱，也用於指標標籤
+        default_model: 呼叫時沒有指定模型就使用這個
+        max_concurrency: 同時送出的請求數上限
+        timeout: 單次請求逾時秒數
+        max_retries: 暫時性錯誤的重試次數
+    """
+
+    name = 'base'
+
+    def __init__(self, default_model=None, max_concurrency=2, timeout=None, max_retries=2):
+        self.default_model = default_model
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.scheduler = LLMScheduler(max_concurrency, name=self.name)
+        # 最近一次對話請求的時間，ModelLifecycleManager 用來判斷是否仍有流量
+        self.last_request_at = None
+        labels = {'backend': self.name}
+        self._latency = metrics.histogram('llm_request_seconds', 'LLM 請求耗時', labels)
+        self._errors = metrics.counter('llm_request_errors_total', 'LLM 請求失敗次數', labels)
+        self._retries = metrics.counter('llm_request_retries_total', 'LLM 請求重試次數', labels)
+        self._in_flight = metrics.gauge('llm_requests_in_flight', '進行中的 LLM 請求數', labels)
+
+    def chat(self, messages: List[Dict[str, str]], model=None, options=None, format=None, keep_alive=None,
+             priority=INTERACTIVE) -> Dict[str, Any]:
+        """
+        送出一次對話請求；priority 為 'interactive' 或 'batch'，決定排隊時的優先順序
+
+        Returns:
+            {'content': 回應文字, 'model': 實際使用的模型, 'raw': 後端原始回應,
+             'usage': 後端有回報時的 token 統計（見 _record_usage），否則為 None,
+             'elapsed': 不含排隊時間的請求耗時}
+        """
+        model = model or self.default_model
+        self.last_request_at = time.time()
+        with span('llm_call'):
+            attempt = 0
+            while True:
+                try:
+                    with self.scheduler.slot(priority):
+                        self._in_flight.inc()
+                        start = time.perf_counter()
+                        try:
+                            result = self._chat(model, messages, options or {}, format, keep_alive)
+                            # 不含排隊時間的服務時間，供 ModelRouter 評估模型延遲
+                            result['elapsed'] = time.perf_counter() - start
+                            return result
+                        finally:
+                            self._latency.observe(time.perf_counter() - start)
+                            self._in_flight.dec()
+                except Exception as e:
+                    self._errors.inc()
+                    if attempt >= self.max_retries or not self.is_retryable(e):
+                        raise
+                    attempt += 1
+                    self._retries.inc()
+                    delay = min(8.0, 0.5 * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+                    logging.warning(f"{self.name} 請求失敗（{e}），{delay:.1f} 秒後第 {attempt} 次重試")
+                    time.sleep(delay)
+
+    def chat_stream(self, messages: List[Dict[str, str]], model=None, options=None, format=None, keep_alive=None,
+                    priority=INTERACTIVE) -> Iterator[str]:
+        """
+        以串流方式送出對話請求，逐段 yield 回應文字；串流期間會一直佔用一個並行名額
+        """
+        model = model or self.default_model
+        self.last_request_at = time.time()
+        with self.scheduler.slot(priority):
+            self._in_flight.inc()
+            start = time.perf_counter()
+            try:
+                yield from self._chat_stream(model, messages, options or {}, format, keep_alive)
+            except Exception:
+                self._errors.inc()
+                raise
+            finally:
+                self._latency.observe(time.perf_counter() - start)
+                self._in_flight.dec()
+
+    def _record_usage(self, model, usage):
+        """
+        記錄單次請求的 token 統計
+
+        Args:
+            usage: {'prompt_tokens', 'completion_tokens', 'prompt_eval_seconds', 'eval_seconds',
+                    'tokens_per_second', 'load_seconds'}，缺少的欄位為 None
+        """
+        labels = {'backend': self.name, 'model': model}
+        if usage.get('prompt_tokens') is not None:
+            metrics.histogram('llm_prompt_tokens', '每次請求的提示詞 token 數', labels,
+                              buckets=TOKEN_BUCKETS).observe(usage['prompt_tokens'])
+        if usage.get('completion_tokens') is not None:
+            metrics.histogram('llm_completion_tokens', '每次請求生成的 token 數', labels,
+                              buckets=TOKEN_BUCKETS).observe(usage['completion_tokens'])
+        if usage.get('prompt_eval_seconds') is not None:
+            metrics.histogram('llm_prompt_eval_seconds', '處理提示詞的耗時', labels).observe(usage['prompt_eval_seconds'])
+        if usage.get('tokens_per_second') is not None:
+            metrics.histogram('llm_generation_tokens_per_second', '生成速度（token/秒）', labels,
+                              buckets=TOKENS_PER_SECOND_BUCKETS).observe(usage['tokens_per_second'])
+
+    def is_retryable(self, error) -> bool:
+        """預設把連線錯誤與逾時視為暫時性錯誤"""
+        return isinstance(error, (ConnectionError, TimeoutError)) or type(error).__name__ in (
+            'ConnectError', 'ReadTimeout', 'ConnectTimeout', 'RemoteProtocolError', 'ReadError')
+
+    def _chat(self, model, messages, options, format, keep_alive) -> Dict[str, Any]:
+        # 回傳 {'content', 'model', 'raw', 'usage'}
+        raise NotImplementedError
+
+    def _chat_stream(self, model, messages, options, format, keep_alive) -> Iterator[str]:
+        # 不支援串流的後端一次回傳完整內容
+        yield self._chat(model, messages, options, format, keep_alive)['content']
+
+
+class OllamaBackend(LLMBackend):
+    """
+    本地 Ollama 伺服器
+
+    使用自己的 ollama.Client（OLLAMA_HOST，未設定時為套件預設位址），底層是保持連線的 httpx 連線池；
+    每次請求的逾時預設讀取 OLLAMA_TIMEOUT（300 秒），避免伺服器卡住時工作執行緒一直等下去。
+    每次請求都帶上 keep_alive（預設 OLLAMA_KEEP_ALIVE），讓模型在閒置時仍常駐記憶體；
+    回應中的 load_duration 用來區分冷啟動（需要載入模型）與熱請求的延遲，
+    prompt_eval_count / eval_count 等欄位記錄成 token 統計。
+
+    呼叫端沒有指定 num_ctx 時依提示詞估計長度加上輸出預算自動決定，
+    並取 2 的次方（OLLAMA_MIN_CTX 到 OLLAMA_MAX_CTX）：num_ctx 改變會讓 Ollama 重新載入模型，
+    只用少數幾種大小可以避免每次請求都重新載入。
+    """
+
+    name = 'ollama'
+
+    def __init__(self, default_model=None, max_concurrency=None, timeout=None, max_retries=None, host=None,
+                 keep_alive=None):
+        super().__init__(
+            default_model=default_model or os.getenv('OLLAMA_MODEL_NAME', 'gemma3'),
+            max_concurrency=max_concurrency or int(os.getenv('OLLAMA_MAX_CONCURRENCY', '2')),
+            timeout=timeout or float(os.getenv('OLLAMA_TIMEOUT', '300')),
+            max_retries=max_retries if max_retries is not None else int(os.getenv('OLLAMA_MAX_RETRIES', '2')),
+        )
+        self.host = host or os.getenv('OLLAMA_HOST')
+        self.keep_alive = keep_alive or os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+        # load_duration 超過這個秒數就視為冷啟動
+        self.cold_load_threshold = float(os.getenv('OLLAMA_COLD_LOAD_THRESHOLD', '1.0'))
+        self.auto_num_ctx = os.getenv('OLLAMA_AUTO_NUM_CTX', '1') == '1'
+        self.min_ctx = int(os.getenv('OLLAMA_MIN_CTX', '2048'))
+        self.max_ctx = int(os.getenv('OLLAMA_MAX_CTX', '16384'))
+        # 呼叫端沒有設定 num_predict 時預留給輸出的 token 數
+        self.output_token_budget = int(os.getenv('OLLAMA_OUTPUT_TOKENS', '1024'))
+        # 每個模型最近一次請求使用的 num_ctx；預先載入與刷新 keep_alive 時沿用，避免 Ollama 因設定不同而重新載入
+        self._last_num_ctx = {}
+        import ollama
+        self._client = ollama.Client(host=self.host, timeout=self.timeout)
+
+    def _api(self):
+        return self._client
+
+    def num_ctx_for(self, messages, options=None) -> int:
+        """
+        依提示詞估計長度與輸出預算決定 num_ctx
+
+        Returns:
+            min_ctx 起跳的 2 的次方，最多 max_ctx；放不下時記錄 llm_context_overflow_total
+        """
+        options = options or {}
+        output_tokens = options.get('num_predict') or self.output_token_budget
+        if output_tokens < 0:
+            output_tokens = self.output_token_budget
+        needed = estimate_message_tokens(messages) + output_tokens
+        num_ctx = self.min_ctx
+        while num_ctx < needed and num_ctx < self.max_ctx:
+            num_ctx *= 2
+        num_ctx = min(num_ctx, self.max_ctx)
+        if needed > num_ctx:
+            metrics.counter('llm_context_overflow_total', '提示詞加輸出預算超過 num_ctx 上限的次數',
+                            {'backend': self.name}).inc()
+            logging.warning(f"提示詞約 {needed} tokens（含輸出預算），超過 num_ctx 上限 {num_ctx}，前段內容可能被截斷")
+        return num_ctx
+
+    def _request_kwargs(self, model, messages, options, format, keep_alive):
+        if self.auto_num_ctx and 'num_ctx' not in options:
+            options = {**options, 'num_ctx': self.num_ctx_for(messages, options)}
+        if 'num_ctx' in options:
+            self._last_num_ctx[model] = options['num_ctx']
+        kwargs = {'model': model, 'messages': messages, 'options': options,
+                  'keep_alive': keep_alive if keep_alive is not None else self.keep_alive}
+        if format is not None:
+            kwargs['format'] = format
+        return kwargs
+
+    def _chat(self, model, messages, options, format, keep_alive):
+        start = time.perf_counter()
+        response = self._api().chat(**self._request_kwargs(model, messages, options, format, keep_alive))
+        usage = self._record_response(model, response, time.perf_counter() - start)
+        return {'content': response['message']['content'], 'model': model, 'raw': response, 'usage': usage}
+
+    def _chat_stream(self, model, messages, options, format, keep_alive):
+        kwargs = self._request_kwargs(model, messages, options, format, keep_alive)
+        start = time.perf_counter()
+        last_chunk = None
+        for chunk in self._api().chat(stream=True, **kwargs):
+            last_chunk = chunk
+            yield chunk['message']['content']
+        # 最後一段（done=True）才帶有 load_duration 等統計
+        if last_chunk is not None:
+            self._record_response(model, last_chunk, time.perf_counter() - start)
+
+    @staticmethod
+    def usage_from_response(response) -> Dict[str, Any]:
+        """
+        從 Ollama 回應取出 token 統計（時間欄位單位為奈秒）
+
+        Returns:
+            {'prompt_tokens', 'completion_tokens', 'prompt_eval_seconds', 'eval_seconds',
+             'tokens_per_second', 'load_seconds'}，缺少的欄位為 None
+        """
+        def field(name):
+            return response.get(name) if hasattr(response, 'get') else None
+
+        def seconds(name):
+            value = field(name)
+            return value / 1e9 if value is not None else None
+
+        usage = {
+            'prompt_tokens': field('prompt_eval_count'),
+            'completion_tokens': field('eval_count'),
+            'prompt_eval_seconds': seconds('prompt_eval_duration'),
+            'eval_seconds': seconds('eval_duration'),
+            'load_seconds': seconds('load_duration'),
+            'tokens_per_second': None,
+        }
+        if usage['completion_tokens'] and usage['eval_seconds']:
+            usage['tokens_per_second'] = usage['completion_tokens'] / usage['eval_seconds']
+        return usage
+
+    def _record_response(self, model, response, elapsed):
+        """記錄 token 統計，並依 load_duration 把這次請求記為冷啟動或熱請求"""
+        usage = self.usage_from_response(response)
+        self._record_usage(model, usage)
+        load_seconds = usage['load_seconds'] or 0
+        state = 'cold' if load_seconds >= self.cold_load_threshold else 'warm'
+        labels = {'backend': self.name, 'model': model}
+        metrics.histogram('llm_model_request_seconds', '依模型冷熱狀態區分的 LLM 請求耗時',
+                          {**labels, 'load': state}).observe(elapsed)
+        if state == 'cold':
+            metrics.histogram('llm_model_load_seconds', '模型載入耗時', labels).observe(load_seconds)
+            metrics.counter('llm_model_cold_starts_total', '需要載入模型的請求數', labels).inc()
+            logging.warning(f"{model} 冷啟動，載入模型花費 {load_seconds:.1f} 秒")
+        return usage
+
+    def preload(self, model=None, keep_alive=None) -> float:
+        """
+        預先把模型載入記憶體（送出空的 generate 請求），不計入使用者流量
+
+        num_ctx 和最近一次對話請求相同（還沒有請求時為 OLLAMA_MIN_CTX）：
+        Ollama 在 num_ctx 改變時會重新載入模型，刷新 keep_alive 不應該讓下一個請求變成冷啟動。
+
+        Returns:
+            這次載入花費的秒數；模型已經常駐時接近 0
+        """
+        model = model or self.default_model
+        kwargs = {'model': model, 'prompt': '',
+                  'keep_alive': keep_alive if keep_alive is not None else self.keep_alive}
+        num_ctx = self._last_num_ctx.get(model) or (self.min_ctx if self.auto_num_ctx else None)
+        if num_ctx:
+            kwargs['options'] = {'num_ctx': num_ctx}
+        response = self._api().generate(**kwargs)
+        load_ns = response.get('load_duration') if hasattr(response, 'get') else None
+        return (load_ns or 0) / 1e9
+
+    def running_models(self) -> Dict[str, Any]:
+        """
+        目前常駐在記憶體中的模型
+
+        Returns:
+            {模型名稱: 到期時間}
+        """
+        return {model['model']: model.get('expires_at') for model in self._api().ps()['models']}
+
+    def is_retryable(self, error):
+        status = getattr(error, 'status_code', None)
+        if status is not None:
+            return status == 429 or status >= 500
+        return super().is_retryable(error)
+
+
+class GeminiBackend(LLMBackend):
+    """
+    Google Gemini API；可以直接傳入既有的 GenerativeModel 物件，
+    否則依 GEMINI_API_KEY / GEMINI_MODEL_NAME 建立
+    """
+
+    name = 'gemini'
+
+    def __init__(self, model_object=None, default_model=None, max_concurrency=None, timeout=None, max_retries=None):
+        super().__init__(
+            default_model=default_model or getattr(model_object, 'model_name', None)
+            or os.getenv('GEMINI_MODEL_NAME', 'gemini-2.5-flash'),
+            max_concurrency=max_concurrency or int(os.getenv('GEMINI_MAX_CONCURRENCY', '4')),
+            timeout=timeout or float(os.getenv('GEMINI_TIMEOUT', '120')),
+            max_retries=max_retries if max_retries is not None else int(os.getenv('GEMINI_MAX_RETRIES', '2')),
+        )
+        self._models = {}
+        self._models_lock = threading.Lock()
+        if model_object is not None:
+            self._models[self.default_model] = model_object
+
+    def _model(self, model):
+        with self._models_lock:
+            if model not in self._models:
+                import google.generativeai as genai
+                genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+                self._models[model] = genai.GenerativeModel(model)
+            return self._models[model]
+
+    def _chat(self, model, messages, options, format, keep_alive):
+        prompt = '\n\n'.join(message['content'] for message in messages)
+        kwargs = {}
+        generation_config = {}
+        if 'temperature' in options:
+            generation_config['temperature'] = options['temperature']
+        if options.get('num_predict', 0) > 0:
+            generation_config['max_output_tokens'] = options['num_predict']
+        if generation_config:
+            kwargs['generation_config'] = generation_config
+        if self.timeout:
+            kwargs['request_options'] = {'timeout': self.timeout}
+        response = self._model(model).generate_content(prompt, **kwargs)
+        metadata = getattr(response, 'usage_metadata', None)
+        usage = None
+        if metadata is not None:
+            usage = {
+                'prompt_tokens': getattr(metadata, 'prompt_token_count', None),
+                'completion_tokens': getattr(metadata, 'candidates_token_count', None),
+                'prompt_eval_seconds': None, 'eval_seconds': None, 'tokens_per_second': None, 'load_seconds': None,
+            }
+            self._record_usage(model, usage)
+        return {'content': response.text, 'model': model, 'raw': response, 'usage': usage}
+
+    def is_retryable(self, error):
+        return type(error).__name__ in ('ServiceUnavailable', 'ResourceExhausted', 'DeadlineExceeded',
+                                        'InternalServerError', 'TooManyRequests') or super().is_retryable(error)
+
+
+class StubBackend(LLMBackend):
+    """
+    不呼叫任何模型的本地後端，用於壓測與測試
+
+    Args:
+        responder: 接收 messages 並回傳回應文字的函式；預設回傳空 JSON 陣列
+        latency: 模擬的回應時間（秒），預設讀取 STUB_LLM_LATENCY
+    """
+
+    name = 'stub'
+
+    def __init__(self, responder=None, latency=None, max_concurrency=None):
+        super().__init__(default_model='stub', max_concurrency=max_concurrency or 64, max_retries=0)
+        self.responder = responder or (lambda messages: '[]')
+        self.latency = latency if latency is not None else float(os.getenv('STUB_LLM_LATENCY', '0'))
+
+    def _chat(self, model, messages, options, format, keep_alive):
+        if self.latency:
+            time.sleep(self.latency)
+        return {'content': self.responder(messages), 'model': model, 'raw': None, 'usage': None}
+
+
+def account_call(purpose, messages, response=None):
+    """
+    依用途（extraction、quiz ...）記錄單次呼叫的提示詞大小與實際 token 用量，方便找出推論時間花在哪裡
+
+    Args:
+        purpose: 呼叫用途，作為指標標籤
+        messages: 送出的對話訊息
+        response: chat() 的回傳值；只估算提示詞大小時可省略
+    """
+    labels = {'purpose': purpose}
+    estimated = estimate_message_tokens(messages)
+    metrics.histogram('llm_prompt_estimated_tokens', '送出前估計的提示詞 token 數', labels,
+                      buckets=TOKEN_BUCKETS).observe(estimated)
+    usage = (response or {}).get('usage') or {}
+    if usage.get('prompt_tokens') is not None:
+        metrics.counter('llm_prompt_tokens_total', '各用途累計的提示詞 token 數', labels).inc(usage['prompt_tokens'])
+    if usage.get('completion_tokens') is not None:
+        metrics.counter('llm_completion_tokens_total', '各用途累計的生成 token 數', labels).inc(usage['completion_tokens'])
+    if usage:
+        tps = usage.get('tokens_per_second')
+        logging.info(
+            f"LLM 呼叫 [{purpose}] 提示詞 {usage.get('prompt_tokens')} tokens（估計 {estimated}）、"
+            f"生成 {usage.get('completion_tokens')} tokens"
+            + (f"、提示詞處理 {usage['prompt_eval_seconds']:.2f} 秒" if usage.get('prompt_eval_seconds') is not None else '')
+            + (f"、{tps:.1f} tokens/秒" if tps else '')
+        )
+
+
+_BACKEND_CLASSES = {
+    'ollama': OllamaBackend,
+    'gemini': GeminiBackend,
+    'stub': StubBackend,
+}
+_backends: Dict[str, LLMBackend] = {}
+_backends_lock = threading.Lock()
+
+def get_backend(name: Optional[str] = None) -> LLMBackend:
+    """
+    取得整個 process 共用的後端實例（每種後端只建立一次，共用連線池與並行上限）
+
+    Args:
+        name: 'ollama'、'gemini' 或 'stub'；預設讀取 LLM_BACKEND（ollama）
+    """
+    name = (name or os.getenv('LLM_BACKEND', 'ollama')).lower()
+    with _backends_lock:
+        if name not in _backends:
+            if name not in _BACKEND_CLASSES:
+                raise ValueError(f"未知的 LLM 後端: {name}")
+            _backends[name] = _BACKEND_CLASSES[name]()
+        return _backends[name]
+
+def register_backend(name, backend: LLMBackend):
+    """以自訂實例取代某個名稱的後端，例如在壓測時換成設定過延遲的 StubBackend"""
+    with _backends_lock:
+        _backends[name.lower()] = backend
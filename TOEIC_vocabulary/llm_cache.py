@@ -0,0 +1,147 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+def make_cache_key(model, messages, options=None, **extra):
+    """
+    以模型名稱、參數與訊息內容計算快取 key（SHA-256），內容相同的呼叫會得到相同的 key
+    """
+    payload = {
+        'model': model,
+        'messages': messages,
+        'options': options or {},
+        'extra': extra,
+    }
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    決定性（temperature 0）模型呼叫的回應快取，同時保存原始回應與解析後的結果
+
+    預設存在記憶體中，超過 max_entries 時淘汰最久未使用的項目；
+    設定 db_path 時改存 SQLite，重新啟動或測試重跑時也能命中。
+
+    Args:
+        max_entries: 最多保留的項目數，預設讀取 LLM_CACHE_MAX_ENTRIES
+        db_path: SQLite 檔案路徑，預設讀取 LLM_CACHE_DB，未設定時只用記憶體
+    """
+
+    def __init__(self, max_entries=None, db_path=None):
+        self.max_entries = max_entries or int(os.getenv('LLM_CACHE_MAX_ENTRIES', '2000'))
+        self.db_path = db_path or os.getenv('LLM_CACHE_DB')
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._local = threading.local()
+        if self.db_path:
+            self._init_schema()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    raw TEXT NOT NULL,
+                    parsed TEXT,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)')
+
+    def get(self, key, namespace='default'):
+        """
+        Returns:
+            {'raw': 原始回應文字, 'parsed': 解析後的結果}；未命中時回傳 None
+        """
+        entry = None
+        if self.db_path:
+            try:
+                conn = self._connect()
+                row = conn.execute('SELECT raw, parsed FROM llm_cache WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    with conn:
+                        conn.execute('UPDATE llm_cache SET last_access = ? WHERE key = ?', (time.time(), key))
+                    entry = {'raw': row[0], 'parsed': json.loads(row[1]) if row[1] is not None else None}
+            except Exception as e:
+                logging.error(f"讀取 LLM 回應快取時發生錯誤: {e}")
+        else:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    # 呼叫端會修改解析後的結果，回傳副本以免改到快取內容（SQLite 模式每次都重新解析）
+                    entry = copy.deepcopy(entry)
+
+        if entry is None:
+            metrics.counter('llm_cache_misses_total', 'LLM 回應快取未命中次數', {'namespace': namespace}).inc()
+        else:
+            metrics.counter('llm_cache_hits_total', 'LLM 回應快取命中次數', {'namespace': namespace}).inc()
+        return entry
+
+    def set(self, key, raw, parsed=None):
+        if self.db_path:
+            try:
+                conn = self._connect()
+                with conn:
+                    conn.execute(
+                        'INSERT OR REPLACE INTO llm_cache (key, raw, parsed, last_access) VALUES (?, ?, ?, ?)',
+                        (key, raw, json.dumps(parsed, ensure_ascii=False) if parsed is not None else None, time.time())
+                    )
+                    count = conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+                    if count > self.max_entries:
+                        conn.execute(
+                            'DELETE FROM llm_cache WHERE key IN '
+                            '(SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)',
+                            (count - self.max_entries,)
+                        )
+            except Exception as e:
+                logging.error(f"寫入 LLM 回應快取時發生錯誤: {e}")
+            return
+
+        with self._lock:
+            self._entries[key] = {'raw': raw, 'parsed': copy.deepcopy(parsed)}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.db_path:
+            conn = self._connect()
+            with conn:
+                conn.execute('DELETE FROM llm_cache')
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_llm_cache():
+    """取得整個 process 共用的 LLM 回應快取；LLM_CACHE_ENABLED=0 時回傳 None"""
+    global _default_cache
+    if os.getenv('LLM_CACHE_ENABLED', '1') != '1':
+        return None
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = LLMResponseCache()
+    return _default_cache
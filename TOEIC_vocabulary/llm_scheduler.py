@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+PRIORITIES = (INTERACTIVE, BATCH)
+
+
+class LLMScheduler:
+    """
+    LLM 請求的優先權排程：互動請求（LINE 使用者）優先於批次工作（每日單字、50 題考題）
+
+    - 總並行數不超過 capacity
+    - 每個類別另有並行上限；批次上限應小於 capacity，讓互動請求永遠保有名額
+    - 只有在沒有互動請求等待、也沒有互動請求執行中時才放行批次工作
+    - 已經開始的批次請求不會被中斷
+
+    Args:
+        capacity: 總並行數
+        class_limits: {類別: 並行上限}，預設互動為 capacity、批次讀取 LLM_BATCH_MAX_CONCURRENCY（未設定時為 capacity - 1）
+        name: 指標標籤，通常是後端名稱
+    """
+
+    def __init__(self, capacity, class_limits=None, name='default'):
+        self.capacity = capacity
+        # 預設保留一個名額給互動請求，其餘都可以給批次工作（例如同時生成多個考題分片）
+        configured = os.getenv('LLM_BATCH_MAX_CONCURRENCY')
+        default_batch = capacity - 1 if configured is None else int(configured)
+        default_batch = max(1, min(capacity - 1, default_batch)) if capacity > 1 else 1
+        self.class_limits = {INTERACTIVE: capacity, BATCH: default_batch}
+        self.class_limits.update(class_limits or {})
+        self._cond = threading.Condition()
+        self._running = {p: 0 for p in PRIORITIES}
+        self._waiting = {p: 0 for p in PRIORITIES}
+
+        self._wait_time = {p: metrics.histogram('llm_scheduler_wait_seconds', 'LLM 請求等待名額的時間',
+                                                {'scheduler': name, 'priority': p}) for p in PRIORITIES}
+        self._waiting_gauge = {p: metrics.gauge('llm_scheduler_waiting', '等待名額的 LLM 請求數',
+                                                {'scheduler': name, 'priority': p}) for p in PRIORITIES}
+        self._running_gauge = {p: metrics.gauge('llm_scheduler_running', '執行中的 LLM 請求數',
+                                                {'scheduler': name, 'priority': p}) for p in PRIORITIES}
+
+    def _can_admit(self, priority):
+        if sum(self._running.values()) >= self.capacity:
+            return False
+        if self._running[priority] >= self.class_limits[priority]:
+            return False
+        if priority == BATCH and (self._waiting[INTERACTIVE] or self._running[INTERACTIVE]):
+            return False
+        return True
+
+    def acquire(self, priority=INTERACTIVE, timeout=None):
+        """
+        取得一個執行名額；timeout 秒內取不到時回傳 False
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"未知的優先權類別: {priority}")
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        with self._cond:
+            self._waiting[priority] += 1
+            self._waiting_gauge[priority].set(self._waiting[priority])
+            try:
+                while not self._can_admit(priority):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                self._running[priority] += 1
+                self._running_gauge[priority].set(self._running[priority])
+            finally:
+                self._waiting[priority] -= 1
+                self._waiting_gauge[priority].set(self._waiting[priority])
+                if priority == INTERACTIVE:
+                    # 互動請求離開等待狀態可能讓批次工作可以開始
+                    self._cond.notify_all()
+        self._wait_time[priority].observe(time.monotonic() - start)
+        return True
+
+    def release(self, priority=INTERACTIVE):
+        with self._cond:
+            self._running[priority] -= 1
+            self._running_gauge[priority].set(self._running[priority])
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority=INTERACTIVE):
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    def stats(self):
+        with self._cond:
+            return {
+                p: {
+                    'running': self._running[p],
+                    'waiting': self._waiting[p],
+                    'limit': self.class_limits[p],
+                    'wait_seconds': self._wait_time[p].snapshot(),
+                }
+                for p in PRIORITIES
+            }
@@ -1,17 +1,25 @@
 import os
 from toeic_extractor import TOEICWordExtractor
 from dotenv import load_dotenv
-from flask import Flask, request, abort
-import threading
+from flask import Flask, request, abort, jsonify
+from task_queue import FairWorkerPool, REJECTED_QUEUE_FULL, REJECTED_USER_QUEUE_FULL
+from event_dedup import EventDeduplicator
+from youtube_utils import get_youtube_client
+from model_lifecycle import get_model_lifecycle
+from review_scheduler import get_review_scheduler, format_review_message
+from renderer import flex_carousels
+from line_sender import LineSender
+from tracing import configure_logging, current_request_id, log_event, log_trace, request_context, span
+import metrics
 
 # v3 imports for sending messages
 from linebot.v3.messaging import (
     Configuration,
     ApiClient,
     MessagingApi,
-    ReplyMessageRequest,
-    PushMessageRequest,
-    TextMessage
+    TextMessage,
+    FlexMessage,
+    FlexContainer
 )
 # v2 imports for handling webhooks
 from linebot import WebhookHandler
@@ -23,6 +31,7 @@ import json
 
 # 加載環境變數
 load_dotenv()
+configure_logging()
 
 # 檢查必要的環境變數
 required_env_vars = [
@@ -40,6 +49,17 @@ line_secret = os.getenv('LINE_SECRET')
 configuration = Configuration(access_token=line_token)
 api_client = ApiClient(configuration)
 messaging_api = MessagingApi(api_client)
+# 所有送給使用者的訊息都經過這裡：限流、合併成每次 5 則、暫時性錯誤重試、reply token 失效改用 push
+line_sender = LineSender(messaging_api)
+
+# 啟動時先建立共用的 YouTube 客戶端，避免第一個請求負擔建立成本
+get_youtube_client()
+
+# 啟動時在背景預先載入 Ollama 模型，之後定期刷新 keep_alive，避免部署或閒置後的第一個請求等模型載入；
+# 單字萃取改用其他後端時不會建立，/health 也就不檢查 Ollama
+model_lifecycle = get_model_lifecycle()
+if model_lifecycle is not None:
+    model_lifecycle.start()
 
 # 初始化 Webhook Handler (v2)
 handler = WebhookHandler(line_secret)
@@ -48,81 +68,178 @@ handler = WebhookHandler(line_secret)
 app = Flask(__name__)
 app.logger.setLevel(logging.DEBUG)
 
-def handle_long_task(user_id, reply_token, user_message):
+# 背景工作池：固定數量的執行緒 + 有上限的佇列，避免一波訊息開出上百個執行緒；
+# 每位使用者各自排隊並輪流執行，一位使用者一次丟很多連結也不會佔滿所有執行緒
+worker_pool = FairWorkerPool(name='line')
+# 佇列深度達到此值時先回覆使用者目前排隊位置
+QUEUE_NOTICE_THRESHOLD = int(os.getenv('JOB_QUEUE_NOTICE_THRESHOLD', '5'))
+# 串流萃取時先推送前幾個單字給使用者；設為 0 則等全部完成才回覆
+STREAM_PREVIEW_WORDS = int(os.getenv('STREAM_PREVIEW_WORDS', '3'))
+# 單字列表的呈現方式：text 為純文字，flex 為每個單字一張卡片的 carousel
+LINE_MESSAGE_FORMAT = os.getenv('LINE_MESSAGE_FORMAT', 'text')
+# LINE 在 webhook 回應太慢時會重送事件，以 webhookEventId 去重
+event_dedup = EventDeduplicator()
+
+def send_messages(user_id, reply_token, messages):
+    """
+    排入待送訊息；有 reply token 時第一批用 reply，其餘改用 push，每次最多 5 則
+    """
+    line_sender.send(user_id, messages, reply_token)
+
+def push_review(user_id, words):
+    # 在排程執行緒同步送出，失敗時拋出例外讓複習排程稍後重試
+    line_sender.deliver(user_id, [TextMessage(text=format_review_message(words))])
+
+# 間隔複習：萃取過的單字依 SM-2 排程，到期時在背景推播給使用者
+review_scheduler = get_review_scheduler()
+if review_scheduler is not None:
+    review_scheduler.start(push_review)
+
+def handle_forgotten_words(user_id, reply_token, user_message):
+    """
+    處理「忘了 單字…」的回覆：把這些字的複習間隔重設
+
+    Returns:
+        是否為忘記單字的回覆
+    """
+    if review_scheduler is None or not user_message.startswith('忘了'):
+        return False
+    words = user_message[len('忘了'):].replace('，', ' ').replace(',', ' ').split()
+    graded = [word for word in words if review_scheduler.grade(user_id, word, 1)]
+    text = (f"已安排明天再複習：{', '.join(graded)}" if graded
+            else "複習清單中找不到這些單字，請確認拼字。")
+    send_messages(user_id, reply_token, [TextMessage(text=text)])
+    return True
+
+def format_preview(words):
+    preview = "搶先看（完整列表整理中）：\n"
+    for i, word in enumerate(words, 1):
+        preview += f"\n{i}. {word.get('word')} ({word.get('part_of_speech')}) - {word.get('definition')}\n"
+    return preview
+
+def handle_long_task(user_id, reply_token, user_message, request_id=None):
     """
     將所有耗時的任務放在這裡，在背景執行緒中運行。
+    reply_token 為 None 代表已經回覆過排隊通知，結果改用 push 送出。
+    request_id 沿用 webhook 的 request ID，背景執行緒的記錄與各階段耗時都掛在同一個 request 底下。
     """
+    with request_context(request_id) as trace:
+        try:
+            process_video_request(user_id, reply_token, user_message)
+        finally:
+            log_trace(trace, event='job_completed', user_id=user_id)
+
+def process_video_request(user_id, reply_token, user_message):
+    # reply token 只能用一次，先送出搶先看之後，完整結果改用 push
+    state = {'reply_token': reply_token, 'preview_sent': False}
+
+    def on_partial_words(words):
+        # 串流可能一次多出好幾個字而跳過門檻，用 >= 加上旗標只送一次
+        if state['preview_sent'] or len(words) < STREAM_PREVIEW_WORDS:
+            return
+        state['preview_sent'] = True
+        # 這裡在串流執行緒中執行（仍佔用模型的並行名額），LineSender.send() 只排入待送訊息，不等待送出
+        line_sender.send(user_id, [TextMessage(text=format_preview(words[:STREAM_PREVIEW_WORDS]))],
+                         state['reply_token'])
+        state['reply_token'] = None
+
     try:
         extractor = TOEICWordExtractor()
         extractor.url = user_message
-        result = extractor.word_extraction_specific_video()
+        result = extractor.word_extraction_specific_video(
+            on_partial_words=on_partial_words if STREAM_PREVIEW_WORDS > 0 else None
+        )
         
         if result['success']:
-            message = result['message']
-            
-            message_chunks = [message[i:i+2000] for i in range(0, len(message), 2000)]
-            send_messages = [TextMessage(text=chunk) for chunk in message_chunks]
-
-            messaging_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=reply_token,
-                    messages=send_messages[:5]
-                )
-            )
-
-            if len(send_messages) > 5:
-                for i in range(5, len(send_messages), 5):
-                    messaging_api.push_message(
-                        PushMessageRequest(
-                            to=user_id,
-                            messages=send_messages[i:i+5]
-                        )
-                    )
+            words = result.get('words') or []
+            if review_scheduler is not None and words:
+                review_scheduler.add_words(user_id, words)
+
+            if LINE_MESSAGE_FORMAT == 'flex' and words:
+                messages = [
+                    FlexMessage(alt_text=f"TOEIC 單字列表（{len(words)} 個）", contents=FlexContainer.from_dict(carousel))
+                    for carousel in flex_carousels(words)
+                ]
+            else:
+                messages = [TextMessage(text=text) for text in result.get('messages') or [result['message']]]
+            send_messages(user_id, state['reply_token'], messages)
         else:
-            messaging_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=reply_token,
-                    messages=[TextMessage(text=result['message'])]
-                )
-            )
+            send_messages(user_id, state['reply_token'], [TextMessage(text=result['message'])])
     except Exception as e:
         app.logger.error(f"背景任務處理時發生錯誤: {str(e)}")
         # 可以在這裡決定是否要推播錯誤訊息給使用者
-        messaging_api.push_message(
-            PushMessageRequest(
-                to=user_id,
-                messages=[TextMessage(text=f"處理您的請求時發生錯誤，請稍後再試。")]
-            )
-        )
+        send_messages(user_id, state['reply_token'], [TextMessage(text="處理您的請求時發生錯誤，請稍後再試。")])
 
 @app.route("/", methods=['POST'])
 def callback():
     signature = request.headers['X-Line-Signature']
     body = request.get_data(as_text=True)
-    app.logger.info(f"Request body: {body}")
-
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
-        abort(400)
 
-    return 'OK'
+    with request_context(request.headers.get('X-Request-Id')) as trace:
+        try:
+            with span('webhook_parse'):
+                handler.handle(body, signature)
+        except InvalidSignatureError:
+            log_event('webhook_invalid_signature', level=logging.WARNING, body_bytes=len(body))
+            abort(400)
+        # 只抽樣記錄大小與耗時，不把整個 body 寫進 log
+        log_trace(trace, event='webhook_handled', body_bytes=len(body))
+
+    return 'OK', 200, {'X-Request-Id': trace['request_id']}
+
+@app.route("/metrics", methods=['GET'])
+def prometheus_metrics():
+    return metrics.render_prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route("/stats", methods=['GET'])
+def stats():
+    return jsonify({
+        'worker_pool': worker_pool.stats(),
+        'line_sender': line_sender.stats(),
+        'metrics': metrics.snapshot()
+    })
+
+@app.route("/health", methods=['GET'])
+def health():
+    if model_lifecycle is None:
+        return jsonify({'healthy': True})
+    status = model_lifecycle.health()
+    return jsonify(status), (200 if status['healthy'] else 503)
 
 @handler.add(MessageEvent, message=LegacyTextMessage)
 def handle_message(event):
     """
-    這個函式現在只做一件事：啟動一個背景執行緒，然後立即結束。
+    這個函式現在只做一件事：把工作丟進背景工作池，然後立即結束。
+    佇列太深時先回覆排隊位置，佇列已滿則直接拒絕。
     """
     user_id = event.source.user_id
     reply_token = event.reply_token
     user_message = event.message.text
-    
-    # 創建並啟動背景執行緒
-    task_thread = threading.Thread(
-        target=handle_long_task, 
-        args=(user_id, reply_token, user_message)
-    )
-    task_thread.start()
+
+    event_id = getattr(event, 'webhook_event_id', None)
+    if event_dedup.seen_before(event_id):
+        app.logger.info(f"略過重送的事件: {event_id}")
+        return
+
+    if handle_forgotten_words(user_id, reply_token, user_message):
+        return
+
+    # 需要先回覆排隊通知時，reply token 由這裡使用，背景工作改用 push
+    notify_position = worker_pool.queue_depth() >= QUEUE_NOTICE_THRESHOLD
+    task_reply_token = None if notify_position else reply_token
+
+    position, rejected = worker_pool.submit(user_id, handle_long_task, user_id, task_reply_token, user_message,
+                                            current_request_id())
+    if rejected == REJECTED_QUEUE_FULL:
+        event_dedup.forget(event_id)
+        send_messages(user_id, reply_token, [TextMessage(text="目前請求過多，請稍後再試。")])
+    elif rejected == REJECTED_USER_QUEUE_FULL:
+        send_messages(user_id, reply_token, [TextMessage(
+            text=f"您已經有 {worker_pool.max_queued_per_user} 個影片在排隊處理中，請等目前的結果送出後再傳新的連結。")])
+    elif rejected is not None:
+        send_messages(user_id, reply_token, [TextMessage(text="您傳送的速度有點快，請稍等一分鐘再傳新的連結。")])
+    elif notify_position:
+        send_messages(user_id, reply_token, [TextMessage(text=f"已收到您的請求，目前排隊中，第 {position} 位。")])
 
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5001)
\ No newline at end of file
@@ -0,0 +1,212 @@
+import threading
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+# 預設的延遲分桶（秒），涵蓋從快取命中到完整 LLM 推論的範圍
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_registry_lock = threading.Lock()
+_registry: Dict[str, Dict] = {}
+
+
+def _label_key(labels: Optional[Dict[str, str]]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((labels or {}).items()))
+
+
+class Counter:
+    """只增不減的計數器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def snapshot(self):
+        return self._value
+
+
+class Gauge:
+    """可增可減的即時數值，例如佇列深度"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0.0
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def snapshot(self):
+        return self._value
+
+
+class Histogram:
+    """
+    分桶直方圖，同時保留最近的樣本以計算百分位數
+
+    Args:
+        buckets: 分桶上界（遞增）
+        window: 保留最近幾筆樣本用於百分位數計算
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=1024):
+        self._lock = threading.Lock()
+        self.buckets = tuple(buckets)
+        self._bucket_counts = [0] * len(self.buckets)
+        self._count = 0
+        self._sum = 0.0
+        self._recent = deque(maxlen=window)
+
+    def observe(self, value):
+        with self._lock:
+            self._count += 1
+            self._sum += value
+            self._recent.append(value)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._bucket_counts[i] += 1
+                    break
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def sum(self):
+        return self._sum
+
+    def cumulative_buckets(self):
+        """回傳 (上界, 累積次數) 列表，最後一項為 +Inf"""
+        with self._lock:
+            result = []
+            running = 0
+            for bound, count in zip(self.buckets, self._bucket_counts):
+                running += count
+                result.append((bound, running))
+            result.append((float('inf'), self._count))
+            return result
+
+    def percentile(self, q):
+        """以最近的樣本計算百分位數，q 介於 0 到 100；沒有樣本時回傳 None"""
+        with self._lock:
+            samples = sorted(self._recent)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, int(round(q / 100 * (len(samples) - 1)))))
+        return samples[index]
+
+    def snapshot(self):
+        return {
+            'count': self._count,
+            'sum': round(self._sum, 6),
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+        }
+
+
+def _get_or_create(kind, cls, name, description, labels, **kwargs):
+    with _registry_lock:
+        family = _registry.get(name)
+        if family is None:
+            family = {'type': kind, 'description': description, 'children': {}}
+            _registry[name] = family
+        elif family['type'] != kind:
+            raise ValueError(f"指標 {name} 已註冊為 {family['type']}")
+        key = _label_key(labels)
+        metric = family['children'].get(key)
+        if metric is None:
+            metric = cls(**kwargs)
+            family['children'][key] = metric
+        return metric
+
+
+def counter(name, description='', labels=None) -> Counter:
+    return _get_or_create('counter', Counter, name, description, labels)
+
+
+def gauge(name, description='', labels=None) -> Gauge:
+    return _get_or_create('gauge', Gauge, name, description, labels)
+
+
+def histogram(name, description='', labels=None, buckets=DEFAULT_BUCKETS) -> Histogram:
+    return _get_or_create('histogram', Histogram, name, description, labels, buckets=buckets)
+
+
+def snapshot():
+    """
+    將所有已註冊指標匯出成可 JSON 序列化的字典
+
+    Returns:
+        {指標名稱: {標籤字串: 數值或直方圖摘要}}
+    """
+    with _registry_lock:
+        families = {name: dict(family['children']) for name, family in _registry.items()}
+    result = {}
+    for name, children in families.items():
+        result[name] = {
+            ','.join(f'{k}={v}' for k, v in key) or '': metric.snapshot()
+            for key, metric in children.items()
+        }
+    return result
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        f'{k}="' + str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') + '"'
+        for k, v in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def render_prometheus() -> str:
+    """
+    將所有已註冊指標輸出成 Prometheus text exposition format（0.0.4）
+
+    Returns:
+        可以直接回應給 Prometheus scrape 的文字
+    """
+    with _registry_lock:
+        families = sorted((name, family['type'], family['description'], dict(family['children']))
+                          for name, family in _registry.items())
+    lines = []
+    for name, kind, description, children in families:
+        if description:
+            lines.append(f'# HELP {name} ' + description.replace('\\', '\\\\').replace('\n', '\\n'))
+        lines.append(f'# TYPE {name} {kind}')
+        for key, metric in sorted(children.items()):
+            if kind == 'histogram':
+                for bound, count in metric.cumulative_buckets():
+                    lines.append(f'{name}_bucket{_format_labels(key, [("le", _format_value(bound))])} {count}')
+                lines.append(f'{name}_sum{_format_labels(key)} {_format_value(metric.sum)}')
+                lines.append(f'{name}_count{_format_labels(key)} {metric.count}')
+            else:
+                lines.append(f'{name}{_format_labels(key)} {_format_value(metric.value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,186 @@
+import logging
+import os
+import threading
+import time
+
+import metrics
+from llm_backends import get_backend
+from model_router import load_routes
+
+
+def _normalize_model(name):
+    """ollama ps 回傳的名稱帶有 tag，沒寫 tag 的模型名稱視為 :latest"""
+    return name if ':' in name else f"{name}:latest"
+
+
+class ModelLifecycleManager:
+    """
+    Ollama 模型的生命週期管理：啟動時預先載入、有流量時定期刷新 keep_alive、健康檢查
+
+    - 啟動後在背景執行緒預先載入模型，第一位使用者不必等模型載入
+    - 每 refresh_interval 秒檢查一次 ollama ps；最近 active_window 秒內有請求時重新送出 keep_alive，
+      模型被卸載（Ollama 重啟、閒置到期、被其他模型擠掉）且 reload_when_idle 開啟時重新載入
+    - 預先載入的耗時記在 llm_model_preload_seconds，請求的冷熱延遲由 OllamaBackend 記錄
+
+    Args:
+        backend: OllamaBackend，預設為共用的 ollama 後端
+        models: 要常駐的模型，預設讀取 OLLAMA_PRELOAD_MODELS（逗號分隔），未設定時使用 MODEL_ROUTES 中的模型
+        keep_alive: 模型閒置後保留的時間，預設沿用後端的 OLLAMA_KEEP_ALIVE
+        refresh_interval: 檢查與刷新間隔秒數，預設讀取 OLLAMA_KEEPALIVE_REFRESH
+        active_window: 最近多少秒內有請求就視為仍有流量，預設讀取 OLLAMA_ACTIVE_WINDOW
+        reload_when_idle: 沒有流量時是否也重新載入被卸載的模型，預設讀取 OLLAMA_RELOAD_WHEN_IDLE
+    """
+
+    def __init__(self, backend=None, models=None, keep_alive=None, refresh_interval=None, active_window=None,
+                 reload_when_idle=None):
+        self.backend = backend or get_backend('ollama')
+        if models is None:
+            configured = os.getenv('OLLAMA_PRELOAD_MODELS', '')
+            models = ([m.strip() for m in configured.split(',') if m.strip()]
+                      or [route.model for route in load_routes(self.backend.default_model)])
+        self.models = list(models)
+        self.keep_alive = keep_alive or getattr(self.backend, 'keep_alive', None)
+        self.refresh_interval = refresh_interval or float(os.getenv('OLLAMA_KEEPALIVE_REFRESH', '300'))
+        self.active_window = active_window or float(os.getenv('OLLAMA_ACTIVE_WINDOW', '1800'))
+        if reload_when_idle is None:
+            reload_when_idle = os.getenv('OLLAMA_RELOAD_WHEN_IDLE', '1') == '1'
+        self.reload_when_idle = reload_when_idle
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._healthy = False
+        self._last_probe_at = None
+        self._last_error = None
+        self._status = {
+            model: {'resident': False, 'expires_at': None, 'last_preload_at': None, 'last_load_seconds': None}
+            for model in self.models
+        }
+
+    def start(self):
+        """在背景執行緒預先載入模型並開始定期刷新；重複呼叫不會開出第二個執行緒"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='model-lifecycle', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        self.preload_all()
+        self.probe()
+        while not self._stop.wait(self.refresh_interval):
+            self.refresh()
+
+    def preload_all(self):
+        for model in self.models:
+            self.preload(model)
+
+    def preload(self, model):
+        """
+        載入（或刷新 keep_alive）單一模型
+
+        Returns:
+            載入耗時秒數；失敗時回傳 None
+        """
+        start = time.perf_counter()
+        try:
+            load_seconds = self.backend.preload(model, keep_alive=self.keep_alive)
+        except Exception as e:
+            logging.error(f"預先載入模型 {model} 失敗: {e}")
+            metrics.counter('llm_model_preload_errors_total', '預先載入模型失敗次數', {'model': model}).inc()
+            with self._lock:
+                self._last_error = str(e)
+            return None
+        elapsed = time.perf_counter() - start
+        metrics.histogram('llm_model_preload_seconds', '預先載入模型的耗時', {'model': model}).observe(elapsed)
+        if load_seconds:
+            logging.info(f"已預先載入模型 {model}，載入花費 {load_seconds:.1f} 秒")
+        with self._lock:
+            status = self._status.setdefault(model, {})
+            status['last_preload_at'] = time.time()
+            status['last_load_seconds'] = load_seconds
+            status['resident'] = True
+        return load_seconds
+
+    def probe(self):
+        """
+        健康檢查：向 Ollama 查詢目前常駐的模型
+
+        Returns:
+            與 health() 相同格式的結果
+        """
+        try:
+            running = {_normalize_model(name): expires for name, expires in self.backend.running_models().items()}
+            error = None
+        except Exception as e:
+            logging.error(f"Ollama 健康檢查失敗: {e}")
+            running = None
+            error = str(e)
+
+        with self._lock:
+            self._last_probe_at = time.time()
+            self._healthy = running is not None
+            self._last_error = error
+            for model in self.models:
+                status = self._status[model]
+                resident = running is not None and _normalize_model(model) in running
+                status['resident'] = resident
+                status['expires_at'] = str(running.get(_normalize_model(model))) if resident else None
+                metrics.gauge('llm_model_resident', '模型是否常駐記憶體', {'model': model}).set(1 if resident else 0)
+        return self.health()
+
+    def traffic_active(self):
+        last = getattr(self.backend, 'last_request_at', None)
+        return last is not None and time.time() - last < self.active_window
+
+    def refresh(self):
+        """定期工作：有流量時刷新所有模型的 keep_alive，沒有流量時只補載被卸載的模型"""
+        health = self.probe()
+        if not health['healthy']:
+            return
+        active = self.traffic_active()
+        for model, status in health['models'].items():
+            if active or (self.reload_when_idle and not status['resident']):
+                self.preload(model)
+
+    def health(self):
+        """
+        Returns:
+            {'healthy': Ollama 是否可連線, 'models': {模型: 狀態}, 'keep_alive', 'last_probe_at', 'error'}；
+            第一次檢查完成前（last_probe_at 為 None）視為健康，避免剛啟動就被判定失敗
+        """
+        with self._lock:
+            return {
+                'healthy': self._healthy or self._last_probe_at is None,
+                'backend': self.backend.name,
+                'keep_alive': self.keep_alive,
+                'last_probe_at': self._last_probe_at,
+                'error': self._last_error,
+                'models': {model: dict(status) for model, status in self._status.items()},
+            }
+
+
+_default_manager = None
+_default_manager_lock = threading.Lock()
+
+def get_model_lifecycle():
+    """
+    取得整個 process 共用的模型生命週期管理器；OLLAMA_PRELOAD=0，
+    或單字萃取沒有使用 Ollama（EXTRACTION_LLM_BACKEND / LLM_BACKEND 不是 ollama）時回傳 None
+    """
+    global _default_manager
+    if os.getenv('OLLAMA_PRELOAD', '1') != '1':
+        return None
+    extraction_backend = os.getenv('EXTRACTION_LLM_BACKEND') or os.getenv('LLM_BACKEND', 'ollama')
+    if extraction_backend.lower() != 'ollama':
+        return None
+    if _default_manager is None:
+        with _default_manager_lock:
+            if _default_manager is None:
+                _default_manager = ModelLifecycleManager()
+    return _default_manager
@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import List, Optional
+
+import metrics
+
+
+class ModelRoute:
+    """
+    一個可供選擇的模型
+
+    Args:
+        model: 模型名稱，例如 gemma3:1b
+        max_input_tokens: 適用的提示詞 token 上限（估計值），None 代表不限
+        p95_budget: 最近請求 p95 延遲的預算秒數，超過就暫時改用其他模型；None 代表不檢查
+    """
+
+    def __init__(self, model, max_input_tokens=None, p95_budget=None):
+        self.model = model
+        self.max_input_tokens = max_input_tokens
+        self.p95_budget = p95_budget
+
+    def fits(self, input_tokens):
+        return self.max_input_tokens is None or input_tokens <= self.max_input_tokens
+
+
+def load_routes(default_model=None) -> List[ModelRoute]:
+    """
+    從 MODEL_ROUTES 讀取路由設定（JSON 陣列），例如:
+        [{"model": "gemma3:1b", "max_input_tokens": 800, "p95_budget": 15},
+         {"model": "gemma3:4b", "max_input_tokens": 4000, "p95_budget": 40},
+         {"model": "gemma3:12b"}]
+    沒有設定或格式錯誤時只使用 default_model
+    """
+    configured = os.getenv('MODEL_ROUTES')
+    if configured:
+        try:
+            return [
+                ModelRoute(item['model'], item.get('max_input_tokens'), item.get('p95_budget'))
+                for item in json.loads(configured)
+            ]
+        except (ValueError, KeyError, TypeError) as e:
+            logging.error(f"MODEL_ROUTES 格式錯誤，改用預設模型: {e}")
+    return [ModelRoute(default_model)] if default_model else []
+
+
+class ModelRouter:
+    """
+    依輸入大小與延遲紀錄挑選模型
+
+    - 短的輸入交給能處理它的最小模型，只有輸入超過小模型的上限時才用大模型
+    - 每個模型保留最近 window 筆延遲，樣本數達 min_samples 且 p95 超過預算時，
+      在 cooldown 秒內改用下一個適用的模型；冷卻結束後清空紀錄重新評估
+    - 所有適用的模型都超過預算時，選 p95 最低的那個
+
+    Args:
+        routes: ModelRoute 列表，依模型大小由小到大排列
+        window: 計算 p95 使用的最近樣本數，預設讀取 MODEL_ROUTER_WINDOW
+        min_samples: 開始檢查預算前需要的樣本數，預設讀取 MODEL_ROUTER_MIN_SAMPLES
+        cooldown: 超過預算後暫停使用的秒數，預設讀取 MODEL_ROUTER_COOLDOWN
+        name: 指標標籤
+    """
+
+    def __init__(self, routes, window=None, min_samples=None, cooldown=None, name='extraction'):
+        self.routes = list(routes)
+        self.window = window or int(os.getenv('MODEL_ROUTER_WINDOW', '50'))
+        self.min_samples = min_samples or int(os.getenv('MODEL_ROUTER_MIN_SAMPLES', '5'))
+        self.cooldown = cooldown or float(os.getenv('MODEL_ROUTER_COOLDOWN', '300'))
+        self.name = name
+        self._lock = threading.Lock()
+        self._latency = {route.model: metrics.Histogram(window=self.window) for route in self.routes}
+        self._demoted_until = {}
+
+    def signature(self) -> str:
+        """路由設定的摘要，用於快取版本字串"""
+        return '|'.join(route.model for route in self.routes)
+
+    def p95(self, model) -> Optional[float]:
+        histogram = self._latency.get(model)
+        if histogram is None or histogram.count < self.min_samples:
+            return None
+        return histogram.percentile(95)
+
+    def _over_budget(self, route, now):
+        if route.p95_budget is None:
+            return False
+        if self._demoted_until.get(route.model, 0) > now:
+            return True
+        p95 = self.p95(route.model)
+        if p95 is not None and p95 > route.p95_budget:
+            self._demoted_until[route.model] = now + self.cooldown
+            logging.warning(f"模型 {route.model} 最近 p95 延遲 {p95:.1f} 秒超過預算 {route.p95_budget} 秒，暫時改用其他模型")
+            metrics.counter('model_router_demotions_total', '模型因延遲超過預算被暫時停用的次數',
+                            {'router': self.name, 'model': route.model}).inc()
+            return True
+        return False
+
+    def candidates(self, input_tokens) -> List[str]:
+        """
+        依偏好順序回傳這次請求可以使用的模型；第一個是首選，其餘作為失敗時的備援
+
+        Args:
+            input_tokens: 提示詞估計的 token 數
+        """
+        now = time.time()
+        with self._lock:
+            for model, until in list(self._demoted_until.items()):
+                if until <= now:
+                    # 冷卻結束：丟掉舊的延遲紀錄，讓模型重新累積樣本
+                    del self._demoted_until[model]
+                    self._latency[model] = metrics.Histogram(window=self.window)
+            eligible = [route for route in self.routes if route.fits(input_tokens)]
+            if not eligible:
+                # 輸入比所有模型的上限都大，交給最大的模型
+                eligible = self.routes[-1:]
+            within = [route for route in eligible if not self._over_budget(route, now)]
+            if not within:
+                within = sorted(eligible, key=lambda route: self.p95(route.model) or 0)
+            ordered = within + [route for route in eligible if route not in within]
+        return [route.model for route in ordered]
+
+    def choose(self, input_tokens) -> Optional[str]:
+        models = self.candidates(input_tokens)
+        return models[0] if models else None
+
+    def record(self, model, seconds, ok=True):
+        """記錄一次請求的延遲；失敗的請求以實際耗時計入，讓反覆逾時的模型被降級"""
+        with self._lock:
+            histogram = self._latency.setdefault(model, metrics.Histogram(window=self.window))
+        histogram.observe(seconds)
+        metrics.counter('model_router_requests_total', '經由路由送到各模型的請求數',
+                        {'router': self.name, 'model': model}).inc()
+        if not ok:
+            metrics.counter('model_router_errors_total', '經由路由送出後失敗的請求數',
+                            {'router': self.name, 'model': model}).inc()
+
+    def stats(self):
+        with self._lock:
+            demoted = dict(self._demoted_until)
+        return {
+            route.model: {
+                'max_input_tokens': route.max_input_tokens,
+                'p95_budget': route.p95_budget,
+                'p95': self.p95(route.model),
+                'samples': self._latency[route.model].count,
+                'demoted': route.model in demoted,
+            }
+            for route in self.routes
+        }
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+def get_model_router(backend):
+    """
+    取得某個後端共用的模型路由器；沒有設定 MODEL_ROUTES 時只會選擇後端的預設模型
+    """
+    with _routers_lock:
+        router = _routers.get(backend.name)
+        if router is None:
+            router = ModelRouter(load_routes(backend.default_model))
+            _routers[backend.name] = router
+        return router
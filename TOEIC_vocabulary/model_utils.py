@@ -1,20 +1,72 @@
 import json
 import logging
 import os
-import requests
-import ollama
+import re
+import time
+from typing import TypedDict
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from text_utils import chunk_text, estimate_message_tokens, estimate_tokens, lemmatize, tokenize
+from candidate_filter import select_candidates, format_candidates
+from llm_cache import get_llm_cache, make_cache_key
+from llm_backends import account_call, get_backend
+from llm_scheduler import INTERACTIVE
+from model_router import get_model_router
+from lexicon import get_lexicon
+from stream_parser import IncrementalJSONArrayParser
+from tracing import span
+import metrics
 
-def extract_toeic_words_with_ollama(transcript_text):
-    """
-    使用 Ollama 本地 LLM 進行單字萃取
-    transcript_text: 字幕內容
-    video_title: 影片標題
-    """
-    if not transcript_text:
-        logging.error("字幕內容為空，無法提取單字")
-        return []
+# 單字萃取使用的 LLM 後端（ollama / gemini / stub），預設讀取 LLM_BACKEND
+EXTRACTION_BACKEND = os.getenv('EXTRACTION_LLM_BACKEND')
+# 提示詞版本；修改提示詞時請一併更新 PROMPT_VERSION，讓舊的快取結果失效
+PROMPT_VERSION = 'v4'
+# 是否先在本地挑出候選單字，只把候選單字與上下文交給模型
+PREFILTER_ENABLED = os.getenv('OLLAMA_PREFILTER', '1') == '1'
+
+# 超過此 token 數（估計值）的字幕改用分段萃取
+CHUNK_TOKENS = int(os.getenv('OLLAMA_CHUNK_TOKENS', '1500'))
+# 分段萃取時同時送給 Ollama 的請求數上限（整個 process 共用）
+CHUNK_CONCURRENCY = int(os.getenv('OLLAMA_CHUNK_CONCURRENCY', '2'))
+_chunk_executor = ThreadPoolExecutor(max_workers=CHUNK_CONCURRENCY, thread_name_prefix='ollama-chunk')
+
+WORD_FIELDS = ('word', 'definition', 'part_of_speech', 'example_sentence')
+
+class WordRecord(TypedDict):
+    word: str
+    definition: str
+    part_of_speech: str
+    example_sentence: str
+
+# 傳給 Ollama structured output (format) 的 JSON schema，限制模型只能輸出單字物件陣列
+WORDS_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {field: {"type": "string"} for field in WORD_FIELDS},
+        "required": list(WORD_FIELDS),
+    },
+}
+
+# 候選單字模式下單字庫已有的字只需要回傳 word（必要時加上 example_sentence），其餘欄位由單字庫補上
+CANDIDATE_WORDS_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {field: {"type": "string"} for field in WORD_FIELDS},
+        "required": ["word"],
+    },
+}
+
+_TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
 
-    system_prompt = f"""You are a professional English teacher. From the text '{transcript_text}', provide 10 distinct vocabulary words.
+def extraction_cache_version():
+    """萃取結果快取使用的版本字串"""
+    backend = get_backend(EXTRACTION_BACKEND)
+    return f"{backend.name}:{get_model_router(backend).signature()}:{PROMPT_VERSION}"
+
+def _build_extraction_prompt(transcript_text, num_words=10):
+    system_prompt = f"""You are a professional English teacher. From the text '{transcript_text}', provide {num_words} distinct vocabulary words.
         For each word, you must provide:
         1.  The word itself.
         2.  Its English definition.
@@ -29,7 +81,7 @@ def extract_toeic_words_with_ollama(transcript_text):
         {{
             "word": "serene",
             "definition": "calm, peaceful, and untroubled; tranquil.",
-            ""part_of_speech": "adjective",
+            "part_of_speech": "adjective",
             "example_sentence": "The lake was serene in the early morning, reflecting the clear sky."
         }},
         {{
@@ -41,8 +93,32 @@ def extract_toeic_words_with_ollama(transcript_text):
         ]
         """
 
+    return system_prompt
+
+def _build_candidate_prompt(candidate_text, num_words=10, has_known=False):
+    system_prompt = f"""You are a professional English teacher preparing TOEIC vocabulary. Below is a list of candidate words taken from a video transcript, each followed by short snippets showing how it was used:
+{candidate_text}
+
+        From these candidates, choose the {num_words} words most useful for a TOEIC learner.
+        For each word, you must provide:
+        1.  The word itself.
+        2.  Its English definition.
+        3.  Its part of speech (e.g., noun, verb, adjective, adverb).
+        4.  An example sentence using the word.
+
+        Output your response ONLY as a JSON array of objects. Each object should have the keys: "word", "definition", "part_of_speech", and "example_sentence".
+        Do NOT include any other text, explanations, or summaries outside the JSON.
+        """
+    if has_known:
+        system_prompt += """
+        Some candidates are marked [known] or [example only] because their details are already stored.
+        For a [known] word return only the key "word". For an [example only] word return only "word" and "example_sentence".
+        Return all four keys for every other word.
+        """
+    return system_prompt
+
+def _build_messages(system_prompt):
     # OLLAMA_CHAT_API_URL = os.getenv('OLLAMA_CHAT_API_URL', 'http://localhost:11434/api/generate')
-    # MODEL_NAME = os.getenv('OLLAMA_MODEL_NAME', 'gemma')
     messages = [
         {"role": "system", "content": system_prompt},
         # {"role": "user", "content": user_prompt}
@@ -52,100 +128,377 @@ def extract_toeic_words_with_ollama(transcript_text):
         "temperature": 0,
         # "top_p": 0.95,
     }
+    return messages, options
 
-    try:
-        response = ollama.chat(model='gemma3', messages=messages, options=options)
-        print(response['message']['content'])
-        response_message = response['message']['content']
-
-        # response 預處理，避免模型產出除了 json 以外的內容造成無法成功轉換成 json 格式
-        response_message = response_message.strip() # 先用 strip() 移除可能的空白符
-        if response_message.startswith("```json"):
-            response_message = response_message[len("```json"):].lstrip('\n') # 移除開頭標記和可能的換行符
-        if response_message.endswith("```"):
-            response_message = response_message[:-len("```")].rstrip('\n') # 移除結尾標記和可能的換行符
-        
-        # 嘗試解析 JSON
+def _route_models(backend, messages):
+    """依提示詞大小向模型路由器取得這次請求的模型順序（首選在前）"""
+    router = get_model_router(backend)
+    return router, router.candidates(estimate_message_tokens(messages)) or [backend.default_model]
+
+def _routed_chat(backend, router, models, messages, options, priority, schema=WORDS_SCHEMA):
+    """依序嘗試路由器給的模型，首選模型失敗時改用下一個；全部失敗時拋出最後的錯誤"""
+    last_error = None
+    for model in models:
+        start = time.perf_counter()
         try:
-            print(response_message)
-            words_data = json.loads(response_message)
-            logging.info(f"成功提取 {len(words_data[0])} 個單字 (Ollama)")
-            # print(words_data['words'])
-            return words_data
+            response = backend.chat(messages, model=model, options=options, format=schema, priority=priority)
         except Exception as e:
-            logging.error(f"Ollama 回傳內容無法解析為 JSON: {e}")
-            return []
+            router.record(model, time.perf_counter() - start, ok=False)
+            logging.warning(f"模型 {model} 請求失敗: {e}")
+            last_error = e
+            continue
+        router.record(model, response.get('elapsed', time.perf_counter() - start))
+        return response
+    raise last_error
+
+def _request_words(transcript_text, num_words=10, candidate_mode=False, priority=INTERACTIVE, known=None):
+    """
+    對一段文字呼叫一次 Ollama 並解析回傳的單字列表，失敗時回傳空列表
+    candidate_mode 為 True 時 transcript_text 是 format_candidates() 產生的候選單字清單
+    priority 為排程優先權（interactive / batch）
+    known 為候選單字中單字庫已有的字；模型對這些字只需回傳 word，其餘欄位由單字庫補上
+    """
+    lexicon = get_lexicon()
+    fill = lexicon.fill if known and lexicon is not None else None
+    schema = CANDIDATE_WORDS_SCHEMA if fill else WORDS_SCHEMA
+    if candidate_mode:
+        system_prompt = _build_candidate_prompt(transcript_text, num_words, has_known=fill is not None)
+    else:
+        system_prompt = _build_extraction_prompt(transcript_text, num_words)
+    messages, options = _build_messages(system_prompt)
+
+    # temperature 為 0 時同樣的輸入會得到同樣的輸出，直接重用先前的結果
+    backend = get_backend(EXTRACTION_BACKEND)
+    router, models = _route_models(backend, messages)
+    cache = get_llm_cache()
+    cache_key = make_cache_key(models[0], messages, options, format=schema)
+    if cache is not None:
+        cached = cache.get(cache_key, namespace='extraction')
+        if cached is not None:
+            logging.info("使用 LLM 回應快取 (Ollama)")
+            return cached['parsed']
+
+    try:
+        response = _routed_chat(backend, router, models, messages, options, priority, schema)
+        account_call('candidates' if candidate_mode else 'extraction', messages, response)
+        raw_message = response['content']
+        logging.debug(raw_message)
     except Exception as e:
         logging.error(f"使用 Ollama 提取單字時發生錯誤: {e}")
         return []
 
-def generate_toeic_quiz(gemini_model, words):
+    with span('json_parse'):
+        words_data, error, repaired = parse_words_response(raw_message, fill=fill)
+    outcome = 'repaired' if repaired else 'ok'
+
+    # 仍有缺漏時最多再問一次，只要求補齊缺少的單字
+    if error and len(words_data) < num_words:
+        missing = num_words - len(words_data)
+        retry_messages = messages + [
+            {"role": "assistant", "content": raw_message},
+            {"role": "user", "content": (
+                f"Your previous output could not be used ({error}). "
+                f"Return ONLY a valid JSON array with {missing} more word objects, "
+                f"each with the string keys \"word\", \"definition\", \"part_of_speech\" and \"example_sentence\". "
+                f"Do not repeat these words: {', '.join(w['word'] for w in words_data) or 'none'}."
+            )},
+        ]
+        try:
+            retry = backend.chat(retry_messages, model=response['model'], options=options, format=schema,
+                                 priority=priority)
+            account_call('reask', retry_messages, retry)
+            with span('json_parse'):
+                retry_words, retry_error, _ = parse_words_response(retry['content'], fill=fill)
+            known = {w['word'].lower() for w in words_data}
+            words_data += [w for w in retry_words if w['word'].lower() not in known][:missing]
+            outcome = 'reasked'
+            if retry_error:
+                logging.warning(f"重新詢問後仍有無法解析的內容: {retry_error}")
+        except Exception as e:
+            logging.error(f"重新詢問 Ollama 時發生錯誤: {e}")
+
+    if not words_data:
+        outcome = 'failed'
+    metrics.counter('llm_parse_total', '單字萃取回應的解析結果', {'result': outcome}).inc()
+    if not words_data:
+        logging.error(f"Ollama 回傳內容無法解析為單字列表: {error}")
+        return []
+
+    logging.info(f"成功提取 {len(words_data)} 個單字 (Ollama)")
+    if cache is not None:
+        # 回應可能來自備用模型，以實際回答的模型建立快取鍵，不要當成首選模型的結果
+        cache.set(make_cache_key(response['model'], messages, options, format=schema), raw_message, words_data)
+    if lexicon is not None:
+        lexicon.record(words_data)
+    return words_data
+
+def validate_words(data, fill=None):
+    """
+    將模型輸出驗證成 WordRecord 列表，接受陣列或 {"words": [...]}
+    fill 為選用的函式，會在檢查欄位前補上模型省略的欄位（例如 Lexicon.fill）
+
+    Returns:
+        (有效的單字列表, 被略過的項目數)
+    """
+    if isinstance(data, dict):
+        data = data.get('words', [data] if 'word' in data else [])
+    if not isinstance(data, list):
+        return [], 1
+
+    records = []
+    invalid = 0
+    for item in data:
+        if not isinstance(item, dict):
+            invalid += 1
+            continue
+        if fill is not None:
+            fill(item)
+        values = {key: item.get(key) for key in WORD_FIELDS}
+        if not all(isinstance(value, str) and value.strip() for value in values.values()):
+            invalid += 1
+            continue
+        record: WordRecord = {
+            'word': values['word'].strip(),
+            'definition': values['definition'].strip(),
+            'part_of_speech': values['part_of_speech'].strip().lower(),
+            'example_sentence': values['example_sentence'].strip(),
+        }
+        records.append(record)
+    return records, invalid
+
+def parse_words_response(text, fill=None):
     """
-    根據提取的單字生成 TOEIC 考題
-    
+    解析模型回傳的單字 JSON，失敗時先在本地修復
+
+    依序嘗試：去掉前言與 ``` 標記後直接解析 → 移除多餘逗號後解析 →
+    以串流解析器撈出所有完整的物件（例如輸出被截斷時）。
+
     Args:
-        gemini_model: Gemini 模型實例
-        words: 單字列表，每個單字包含 word, chinese, part_of_speech, example
-        
+        fill: 傳給 validate_words() 的欄位補齊函式
+
     Returns:
-        包含50題考題的列表
+        (單字列表, 錯誤描述, 是否經過修復)；錯誤描述不為 None 代表仍有部分內容無法使用
     """
-    if not words:
-        logging.error("沒有單字可以生成考題")
+    text = (text or '').strip()
+    start = min([i for i in (text.find('['), text.find('{')) if i >= 0], default=-1)
+    if start < 0:
+        return [], "回應中找不到 JSON", False
+    end = max(text.rfind(']'), text.rfind('}'))
+    candidate = text[start:end + 1] if end > start else text[start:]
+
+    error = None
+    for repaired, attempt in ((False, candidate), (True, _TRAILING_COMMA_RE.sub(r'\1', candidate))):
+        try:
+            records, invalid = validate_words(json.loads(attempt), fill=fill)
+        except json.JSONDecodeError as e:
+            error = f"JSON 格式錯誤: {e}"
+            continue
+        return records, (f"{invalid} 個項目缺少必要欄位" if invalid else None), repaired
+
+    # 最後手段：撈出所有已經完整結束的物件
+    parser = IncrementalJSONArrayParser()
+    parser.feed(text[start:] if text[start] == '[' else '[' + text[start:])
+    records, _ = validate_words(parser.items, fill=fill)
+    return records, error, True
+
+def _known_candidates(candidates):
+    """查出候選單字中單字庫已有的字，回傳 {原形: 單字資料}"""
+    lexicon = get_lexicon()
+    if lexicon is None:
+        return {}
+    return lexicon.lookup_many(c['word'] for c in candidates)
+
+def extract_toeic_words_with_ollama(transcript_text, num_words=10, chunked=None, keywords=None, prefilter=None,
+                                    priority=INTERACTIVE):
+    """
+    使用 Ollama 本地 LLM 進行單字萃取
+    transcript_text: 字幕內容
+    num_words: 要萃取的單字數量
+    chunked: 是否使用分段模式；None 代表字幕超過 OLLAMA_CHUNK_TOKENS 時自動切換
+    keywords: 候選單字預先過濾時加權的關鍵字
+    prefilter: 是否先在本地挑出候選單字；None 代表依 OLLAMA_PREFILTER 設定；分段模式下每一段各自預先過濾
+    priority: 排程優先權，LINE 請求用 interactive，每日批次用 batch
+    """
+    if not transcript_text:
+        logging.error("字幕內容為空，無法提取單字")
         return []
-        
-    prompt = f"""
-    請根據以下單字列表生成50題 TOEIC 考試風格的選擇題。
-    每個題目應該包含：
-    1. 題目（使用單字或其變化形式）
-    2. 4個選項（A, B, C, D）
-    3. 正確答案
-    4. 解釋
-    
-    單字列表：
-    {json.dumps(words, ensure_ascii=False, indent=2)}
-    
-    請用以下JSON格式回傳：
-    {{
-        "questions": [
-            {{
-                "question": "The company's management team has decided to _____ the project due to budget constraints.",
-                "options": {{
-                    "A": "terminate",
-                    "B": "initiate",
-                    "C": "celebrate",
-                    "D": "decorate"
-                }},
-                "correct_answer": "A",
-                "explanation": "terminate 意為終止，符合句意。其他選項：initiate（開始）、celebrate（慶祝）、decorate（裝飾）都不符合上下文。"
-            }}
-        ]
-    }}
-    要求：
-    1. 題目要符合 TOEIC 考試的難度和風格
-    2. 選項要合理且具有迷惑性
-    3. 解釋要清楚說明為什麼是正確答案
-    4. 確保生成恰好50題
+
+    if prefilter is None:
+        prefilter = PREFILTER_ENABLED
+    if chunked is None:
+        chunked = estimate_tokens(transcript_text) > CHUNK_TOKENS
+    if chunked:
+        return extract_toeic_words_chunked(transcript_text, num_words, priority=priority, keywords=keywords,
+                                           prefilter=prefilter)
+    if prefilter:
+        candidates = select_candidates(transcript_text, keywords=keywords)
+        if candidates:
+            known = _known_candidates(candidates)
+            candidate_text = format_candidates(candidates, known)
+            logging.info(f"候選單字 {len(candidates)} 個（單字庫已有 {len(known)} 個），"
+                         f"提示詞約 {estimate_tokens(candidate_text)} tokens"
+                         f"（原字幕約 {estimate_tokens(transcript_text)} tokens）")
+            return _request_words(candidate_text, num_words, candidate_mode=True, priority=priority, known=known)
+    return _request_words(transcript_text, num_words, priority=priority)
+
+class StreamIncompleteError(Exception):
+    """串流萃取在 JSON 陣列結束前中斷，已經 yield 的單字只是部分結果"""
+
+
+def stream_toeic_words_with_ollama(transcript_text, num_words=10, keywords=None, prefilter=None, priority=INTERACTIVE):
     """
-    
-    try:
-        response = gemini_model.generate_content(prompt)
-        result_text = response.text
-        if "```json" in result_text:
-            json_start = result_text.find("```json") + 7
-            json_end = result_text.find("```", json_start)
-            result_text = result_text[json_start:json_end]
-        elif "```" in result_text:
-            json_start = result_text.find("```") + 3
-            json_end = result_text.rfind("```")
-            result_text = result_text[json_start:json_end]
-        quiz_data = json.loads(result_text.strip())
-        logging.info(f"成功生成 {len(quiz_data['questions'])} 題考題")
-        return quiz_data['questions']
-    except Exception as e:
-        logging.error(f"使用 Gemini 生成考題時發生錯誤: {e}")
-        return [] 
-    
+    串流版本的單字萃取：模型每產生完一個單字物件就立即 yield，不必等整個 JSON 陣列完成
+
+    字幕超過 OLLAMA_CHUNK_TOKENS 時改用分段萃取，完成後一次 yield 所有結果。
+
+    Args:
+        transcript_text: 字幕內容
+        num_words: 要萃取的單字數量
+        keywords: 候選單字預先過濾時加權的關鍵字
+        prefilter: 是否先在本地挑出候選單字；None 代表依 OLLAMA_PREFILTER 設定
+        priority: 排程優先權
+
+    首選模型在送出任何單字前失敗時改用路由器給的下一個模型；已經送出部分單字後才中斷，
+    或串流在 JSON 陣列結束前就停止時拋出 StreamIncompleteError，部分結果不會寫入快取。
+
+    Yields:
+        單字字典，包含 word, definition, part_of_speech, example_sentence
+
+    Raises:
+        StreamIncompleteError: 串流沒有完整結束
+    """
+    if not transcript_text:
+        logging.error("字幕內容為空，無法提取單字")
+        return
+
+    if estimate_tokens(transcript_text) > CHUNK_TOKENS:
+        yield from extract_toeic_words_with_ollama(transcript_text, num_words, chunked=True, keywords=keywords,
+                                                   prefilter=prefilter, priority=priority)
+        return
+
+    if prefilter is None:
+        prefilter = PREFILTER_ENABLED
+    candidates = select_candidates(transcript_text, keywords=keywords) if prefilter else []
+    known = _known_candidates(candidates) if candidates else {}
+    lexicon = get_lexicon()
+    fill = lexicon.fill if known and lexicon is not None else None
+    schema = CANDIDATE_WORDS_SCHEMA if fill else WORDS_SCHEMA
+    if candidates:
+        system_prompt = _build_candidate_prompt(format_candidates(candidates, known), num_words, has_known=fill is not None)
+    else:
+        system_prompt = _build_extraction_prompt(transcript_text, num_words)
+    messages, options = _build_messages(system_prompt)
+
+    backend = get_backend(EXTRACTION_BACKEND)
+    router, models = _route_models(backend, messages)
+    cache = get_llm_cache()
+    cache_key = make_cache_key(models[0], messages, options, format=schema)
+    if cache is not None:
+        cached = cache.get(cache_key, namespace='extraction')
+        if cached is not None:
+            yield from cached['parsed']
+            return
+
+    # 串流可能在陣列結束時提早中斷，拿不到最後一段的統計，這裡只記錄提示詞大小
+    account_call('stream', messages)
+    words_data = []
+    for index, model in enumerate(models):
+        parser = IncrementalJSONArrayParser()
+        raw_parts = []
+        start = time.perf_counter()
+        try:
+            for content in backend.chat_stream(messages, model=model, options=options, format=schema,
+                                               priority=priority):
+                raw_parts.append(content)
+                for word in validate_words(parser.feed(content), fill=fill)[0]:
+                    words_data.append(word)
+                    yield word
+                if parser.finished:
+                    break
+        except Exception as e:
+            router.record(model, time.perf_counter() - start, ok=False)
+            logging.error(f"使用模型 {model} 串流提取單字時發生錯誤: {e}")
+            # 還沒送出任何單字時才能換下一個模型重來；已經送出部分結果就交給呼叫端處理
+            if not words_data and index + 1 < len(models):
+                continue
+            metrics.counter('llm_parse_total', '單字萃取回應的解析結果', {'result': 'failed'}).inc()
+            raise StreamIncompleteError(f"串流中斷，只收到 {len(words_data)} 個單字: {e}") from e
+        # 串流的耗時包含排隊時間，仍足以反映模型是否明顯變慢
+        router.record(model, time.perf_counter() - start)
+        break
+
+    if not parser.finished:
+        metrics.counter('llm_parse_total', '單字萃取回應的解析結果', {'result': 'failed'}).inc()
+        raise StreamIncompleteError(f"串流在 JSON 陣列結束前中斷，只收到 {len(words_data)} 個單字")
+
+    logging.info(f"串流提取完成，共 {len(words_data)} 個單字 (Ollama)")
+    metrics.counter('llm_parse_total', '單字萃取回應的解析結果', {'result': 'ok'}).inc()
+    # 快取與單字庫存的是實際送出的（已由單字庫補齊欄位的）單字
+    if cache is not None:
+        cache.set(make_cache_key(model, messages, options, format=schema), ''.join(raw_parts), words_data)
+    if lexicon is not None:
+        lexicon.record(words_data)
+
+def extract_toeic_words_chunked(transcript_text, num_words=10, chunk_tokens=None, priority=INTERACTIVE, keywords=None,
+                                prefilter=False):
+    """
+    長字幕的 map-reduce 萃取：切成多段各自交給模型（同時執行的數量受 OLLAMA_CHUNK_CONCURRENCY 限制），
+    再以原形合併重複的單字並重新排序
+
+    Args:
+        transcript_text: 字幕內容
+        num_words: 最後回傳的單字數量
+        chunk_tokens: 每段的 token 上限，預設為 OLLAMA_CHUNK_TOKENS
+        priority: 排程優先權
+        keywords: 候選單字預先過濾時加權的關鍵字
+        prefilter: 是否在每一段先挑出候選單字，只把候選單字與上下文交給模型
+
+    Returns:
+        單字列表
+    """
+    chunks = chunk_text(transcript_text, chunk_tokens or CHUNK_TOKENS)
+    logging.info(f"字幕切成 {len(chunks)} 段進行萃取")
+    futures = []
+    for chunk in chunks:
+        candidates = select_candidates(chunk, keywords=keywords) if prefilter else []
+        if candidates:
+            known = _known_candidates(candidates)
+            futures.append(_chunk_executor.submit(_request_words, format_candidates(candidates, known), num_words,
+                                                  True, priority, known))
+        else:
+            futures.append(_chunk_executor.submit(_request_words, chunk, num_words, False, priority))
+    candidate_lists = []
+    for future in futures:
+        try:
+            candidate_lists.append(future.result())
+        except Exception as e:
+            logging.error(f"分段萃取時發生錯誤: {e}")
+    return _merge_candidates(candidate_lists, transcript_text, num_words)
+
+def _merge_candidates(candidate_lists, transcript_text, limit):
+    """
+    依原形合併各段的候選單字：被越多段選中的字排越前面，其次是在整份字幕中出現的次數
+    """
+    frequency = Counter(lemmatize(token) for token in tokenize(transcript_text))
+    merged = {}
+    order = 0
+    for candidates in candidate_lists:
+        for record in candidates:
+            if not isinstance(record, dict) or not record.get('word'):
+                continue
+            lemma = lemmatize(record['word'])
+            if lemma in merged:
+                merged[lemma]['votes'] += 1
+                continue
+            merged[lemma] = {'record': record, 'votes': 1, 'order': order}
+            order += 1
+
+    ranked = sorted(
+        merged.items(),
+        key=lambda item: (-item[1]['votes'], -frequency.get(item[0], 0), item[1]['order'])
+    )
+    return [entry['record'] for _, entry in ranked[:limit]]
+
 if __name__ == '__main__':
     script = """I was able to customize my cloud code into a cloud designer which allows me to iterate UI 10 times faster in cursor and wings serve directly forking and generating five to even 10 different UIs at the same time and all this are made possible with some hidden clock code feature like parallel task commands and new SDK that they just introduced. I'll break it down for you so you can replicate on your end. So one thing I think people didn't realize is that you can actually spin up multiple sub agents within cloud code by simply prompiting. For example, I can give a simple prompt. Start a three parallel agent to implement variations of the to-do app UI. And then you will see that it start three different task that is happening at the same time. One agent will be doing minimalist to-do UI. Another will be doing modern to-do and third will be cambban UI. And boom, you just got three totally different style at the same time. So it'll be much faster for you to iterate. And you can imagine we can actually package this to be some really interesting UI iteration process with this parallel task capability. There was actually pretty heated debate last week on Twitter where dev team published a blog post called don't build multi- aent system. One of the key insights they got is that for task like coding where each action you take actually imply specific set of decisions you make and when you do parallel task it is very likely leads to things like merge conflicts because each sub agent has no context about what the other agent is working on and the best approach they found is actually just don't do parallel task at all and putting everything into one single thread. However, a few days later, Entropy released their own blog post about how do they apply multi- aent in their own research system where they build this group of agents and each sub agent can actually have parallel task to do things like research and I think both had pretty valid points because most of the time you do want to making sure the agent has a full context when execute task but there are scenario that makes sense like research it is going to be faster if you spin up five research topics and summarize everything in the end and same thing for the UI design paralas is actually perfect use case because When we do design in Figma, what we often do is that we'll just fork and do a few different variations and compare them kind of side by side and eventually we get like final version. So have that capability of have parallel task on design has been a pretty good pattern and what I want to show you is how I utilize the parallel task capability in cloud code to have some really interesting UI workflow. But before I dive into that, I know many of you are building AI applications or AI agents that needs access to internet data from research about business to get latest news and a smart and reliable way to turn any website data into large language model friendly format is critical. That's why I want to introduce you to FRO. They were the first open- source project. They offer effective way to turn any website into clean format that is optimized for large language model to consume. You can browse through all the subpage of a website and it handle PDF, word doc or even Excel file that are attached from URL and has capability like smart weight d content loading so that you can guess website with more strict anti-bos setup and for the past few months they just launched a whole bunch of new feature that is going to make web scraping 10x easier. For example, they introduced this new search endpoint that's going to give you back the most random websites as well as extract markdown content of those website directly in just one API call. This is going to make your AI application way faster because you don't need scarfolding the whole pipeline of search and scrape from different service. And they also introduced this new extract endpoint where it can handle things like pageionation and page interaction with their own fire one agent that is capable to interact with website like e-commerce to clicks through buttons get a full content and it can even similar complex action like login and authentication as well. All you need is just give a URL, the prompt, the data structure you want and this agent will open up the browser, navigate through the website to multiple different pages until they find information you want. And most importantly, those abilities can be called from API endpoint directly. So you can give your own agents internet and research capability with just few lines code or integrate to automation platform like Zapier and relevance AI by calling firecore API directly. So if you're looking for a smart way to script internet data, I highly recommend you go and check out firecro. Now let's get back how can you customize cloud code into cloud designer. So to understand the workflow I'm going to show you there are four core concepts. We already covered the sub aents part and second one is cloud.md. If you're pretty familiar with cursor is basically cursor rules but for cloud code with this one we can customize how cloud code should work and give it knowledge about what type of task you should do in parallel what type of task you shouldn't. And I will show you a quick example. For example, if you open cloud in any folder and just create a file called cloud.md and you can just put whatever instruction here like you always respond in all caps. Now if you try to run cloud and say hi, it will respond back in all caps. But you can imagine we can also put some very specialized prompt for this as well. For example, this is a prompt that I have been playing with internal UI design where it includes things like the color, font, layout, stuff like that. So I can put in this and also adding maybe some special rules that when you were asked to build UI iterations, you always just create one single HTML file. So I can give a simple prompt like build me a modern to-do app UI. It will basically following my rules. It won't create some complicated project. And this will just create a one single HTML file that contain a nice kind of modern UI. So this is cloud MD the custom rules for cloud code. The next thing which is very powerful called commands. So you can basically predefine list of common workflow that you want cloud to follow. So you can create a folder called cloud. Inside you can have another folder called commands. This is where we're going to create some cool stuff. Let's say you want to create a joke generated command. So you create a joke.md and we can just say make a joke about arguments. So arguments is a special thing that pass to clock in the command so that you almost create a prompt template that can be used for many different scenarios and I can give it some custom instruction always and a joke with a man eating chips and now if I do slash you will see that there's a slash joke option and I will just type in joke then what are you putting down after is what's going to be passed to arguments so I here can say AI coding and then you will see that I generate a prompt about AI coding and with the specific instruction that we give inside here if from cloud code's official doc. It can even do something like you can literally just natural language putting some commands that you wanted to run. It will actually execute those command line before I do the task. For example, you can actually create a command like this where it will do those command line to check get status first before you execute a task. So if I try this and do the joke now it is actually running those command line to check the get status because I didn't set up yet. It's just a not a get repository. But if I initiate the git here and run cloud again, it will give you a different joke about main branch because now I set up the git. So to me this is like a mystery but super super powerful feature. And what I want to show you is how do I use this to create some sort of UI flow. So I'll create another folder inside let's say UI and create a one called extracted system and putting this prompt. Basically it will have the task of the UI it should analyze which we're passing through a image URL and the goal here is to extract like color pattern typography stuff like that and also save the design system JSON into a folder called prd. So this will allow us to give cloud code a kind of UI mock and it will just generate the design system from that. I found that this works much better than you just give the UI reference ask to do right away. And second command I also use is this iterate design MD. So this is the one that I want cloud to spin up three or five sub aents to concurrently implement the same UI in different style. So I will ask it to analyze a design system JSON file we created and then build one single HTML page and output the HTML in the UI iteration folder called UI 1 UI2 UI3. So with these two things I'm going to show you a very interesting workflow. First I will go to website like moen or dribble to just get some UI inspiration. And let's say I quite like this one. I can save this image zui/ extract design system and I will drag this image here and then it will create this design system.json this prd folder as I instructed which have those kind of more detailed style. Next I can call second command iterate design give a prompt a modern phone to-do app using this design style as reference which I'm referring to this design system file we created earlier. Then it will set up three different tasks. You can see for each task it actually has a very detailed task about UI reference design directions like that. By the way, you can use control R to expand and then Ctrl E to see those details. And of course, you can like always toggle between. But honestly, there's still some bugs. So, I'm just going to let it run like this. And now it output three different UI in the UI iterations. If I open them, they all looks somewhat different in terms of style and animations. And what's really cool is that let's assume I like this UI2 version. But I want to iterate a bit further based on this version because I want to build a kind of dark mode and then I can do the same thing again. This iterate UI2 HTML version which is best one so far and try dark mode. Then you will see this time it will analyze the current UI2 design and try to spin up three parallel tasks. And the more I use it, I realized that the way this command line works, it's basically sending a prompt template to the cloud and along with this prompt you put in here. And this is really interesting, right? Because traditionally, if you design software, you probably were uh designing a way that you have to define what type of arguments are and user have to give those arguments. But they basically keep it super free. Uh you just give a free text agent just magically figure out. This is just such interesting kind of design pattern I found. So after 200 seconds, I got three versions of different UI based on the previous version two I like, but some sort of variation between each one of them. Like this one has some kind of glowy uh style, which is pretty cool. But this is kind of the workflow. I can choose the version I like and then ask to iterate a few different versions. I can even probably grab the glowy style from this version as well as a pure dark background from this style. Ask it to iterate. I'm pretty sure it can figure out. And once you done, you can get a HTML that has a style you want. then just start prompting cursor to actually break down into components and build a proper UI in nextJS project. But this workflow of iterating UI is something that I've been trying a lot and it has been really really helpful. But this workflow can only allow you to build like single HTML page. What if you want to set up parallel agent to work on different UI iteration on your actual production NexJS app and this is where the fourth concept comes in Git work tree. So if you're familiar with g most of the time you can only have one branch running on your computer at the same time and g work tree is a feature they have that allow you to set up multiple different sandbox environment of your specific report. So you can get a multiple cloud code each working on a individual work tree without impact each other's work and in the end you can just pick up the version you like and merge them together and all you need to do just run this command get work tree add-b with a branch name and then pass where do you want to copy and create a sandbox of your current rip for example here I have a basic to-do app that I built with nextjs and chass in it has multiple different components it is much more complicated than a single HTML page what I can do is open terminal and do get work tree add b which is branch name and I'll call it like demo branch. Then I'll remove that into a specific folder. Um what I going to do is I will just create a trees folder with the same branch name so it's easier for us to identify and understand what that is about. If I do this you can see a new folder called trees created. Inside it has another folder called demo branch which has everything we have at root branch. So this is how you can set up a work tree. And now I can do cd trees demo branch. And once I get inside, I can do PNPM install and PMP dev. And you will see the same application is running here in a different portal. And the easiest way will be we can just set up a new cloud here and ask it to iterate UI. And once you get one version you're pretty happy with, you can set it up and do get merge demo branch. So this how the work tree works. Theoretically, you can already have a workflow to firstly create multiple different work trees and then set up parallel agents to work on each individual work tree folders. But what I really experimented is I actually created one command called execute parallel agents and this is one command with the prompt template that I have. It will have two steps. First step will be set up multiple different g trees based on the user's request. If a user asks for three different variations then create three different work trees and each one of them follow the naming convention we have and then do pmppm install setup. Then step two is set up parallel sub agents. This is where the master cloud code agent will spin up multiple different sub agents. Each one work on a different branch and this command will basically do the whole workflow for us. Whenever I want multiple different agents to iterate this UI on existing production projects. For the second prompt here, I actually got some inspiration from another content creator called indie dam den who also talk about this parallel agent workflow. So I highly recommend you check out if you want to learn more. But let me quickly show you how does this work. So I have this command that I showed you earlier and just do cloud then I can just slash to use execute parallel agent command and I'll just give a command try three versions of UI one nerdy style one kid style and one gaming style. There we say I will help you create three parallel agents work on different things with three different to-dos. Firstly it will create three work trees for nerdy kit and gaming UI style. Install dependencies in each work tree and then launch three parallel agents to work on each one of them. And now if I open trees you can see there are three different branch and work tree has been created and after that it will start setting up the project. And after setup it's going to launch three parallel agent to implement different UI stuff. And you can see three parallel task has been created. Each one of them going to be assigned to a individual sub agent. And if we do control R you can see the detail of each task that sub agent is receiving. It has the task the prompt the key files to modify and requirements and each task is slightly different to reflect style we want. And this process is going to take some time. I've actually found this is slower than I just call let's say three entropic call in parallel. I assume entropy actually do some kind of re limiting management. So it does take some time but the cool thing is that you get all those UI in one go. So you don't have to follow that specific linear flow and each version will be inside its own folder. So in the end I got three different versions. Each one of the version does look quite different based on the kind of style of prompt it explore like this nerdy dad version this kind of kids version and we also have this kind of gaming style as well. And you can imagine I can even further doing this. Assuming I like this nerdy version, then I can give another parallel task to set up three more new branches to iterate based on this. So this is kind of the workflow I feel like going to be really developed for next few months especially for UI iteration tasks. But in the end just making sure remember to delete the trees that you don't want because each branch actually can be pretty big because you need to install all the packages inside. Meanwhile, I was imagined what if we have this kind of parallel task execution experience plus some sort of easy way for you to set up sandbox, view the results, iterate based on certain design and also delete the work tree when it's not needed. Especially now cloud code has its SDK where we can integrate a coding assistant very easily with custom prompt tools. So during the weekend, my friend Jack and I have been trying this weekend purchase. We basically integrate to cloud AI SDK and build a cursor extension that you can inside your existing pure right away and ask it to start experimenting different UI. You will have Canva on the right side to preview the UI generated. Then select certain version you like and ask it iterated further. So you can visit superdesign.dev and click on install for free button. This will allow you to just one click installing cursor when you serve or any other ID you're using. It will open the superdesign extension and after install you can do command shiftp and this one option called configure entropy API key. So you put your entropy API key here because we are using cloud code SDK behind the scenes and once that part is done click on super design. This will open a chat on the left side and a camera view on the right side and you can give a prompt design me some wireframe of a calculator. Then you will see the agents start working and trigger multiple tasks. Each task with a slightly different uh brief about what type of design it is. You're basically creating design inside the super design design iteration folder. And at this point each design takes roughly 1 minute to generate. They're very clear path for us to optimize and make it way faster. Uh but we just want to ship it as the first version for now. And all the design generated will be showing up on the right side. And now you can see generate a few different kind of wireframe options for the calculator. And once I find the version I prefer, I can click on this which will have a few different options either create a variations or iterate feedback as well as copy prompt for cursor we insert direct with. So I can click on this iterator with feedback button. Then give a prompt. This looks great. Now build a hi-fi mo based on this layout. Then you will see here it generate a few high fidelity mockups based on that specific layout. And you can imagine we can keep iterating giving feedback and once I'm happy I can click on this copy prompt button. This will copy the full style. So you can pass to cursor or cloud code to do the actual implementation of the web app. So this is the first version we spin up going to do a lot of improvements but super keen to just hear feedback. Is this something you find useful? If so, please give it a try. This will be open source project you can just download and try out yourself. So I will put the link in the description below so you can go and try out. Meanwhile, I will put all the problems I shared in AI builder club, which is a community I'm building that has top AI builders who are launching AI products. Myself and other people will share also tips and workflows that we found really useful for both AI coding and build large modelic software. So, I've also put a link in the description below for you to join as well if you want to learn more. I'm really excited about this project and what kind of feedback you guys have. This is just a v 0.01 version that only created one single HTML page. The next version, we're going to add the default work tree support so you can iterate UI of your existing production application. I'll keep you updated. Thank you and I see you next time."""
     extract_toeic_words_with_ollama(script)
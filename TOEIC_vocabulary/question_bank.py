@@ -0,0 +1,180 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Set
+
+import metrics
+from lexicon import normalize_pos
+from text_utils import lemmatize
+
+
+def question_hash(question) -> str:
+    """以題目文字與選項計算內容雜湊，空白與大小寫不同的相同題目視為同一題"""
+    options = question.get('options') or {}
+    payload = {
+        'question': ' '.join(str(question.get('question', '')).lower().split()),
+        'options': sorted(' '.join(str(value).lower().split()) for value in options.values()),
+    }
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class QuestionBank:
+    """
+    以 SQLite 儲存的題庫，依 (原形, 詞性) 建立索引
+
+    生成過的考題都存進題庫並以內容雜湊去重；組卷時先從題庫取題，
+    並記錄每位使用者看過哪些題目，避免同一位使用者重複拿到同一題。
+
+    Args:
+        db_path: SQLite 檔案路徑，預設讀取 QUESTION_BANK_DB
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.getenv('QUESTION_BANK_DB', 'question_bank.db')
+        self._local = threading.local()
+        self._init_schema()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS questions (
+                    hash TEXT PRIMARY KEY,
+                    lemma TEXT NOT NULL,
+                    pos TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    served INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_questions_word ON questions (lemma, pos)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS question_usage (
+                    user_id TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    served_at REAL NOT NULL,
+                    PRIMARY KEY (user_id, hash)
+                )
+            ''')
+
+    def add(self, questions: List[Dict[str, Any]], source='llm') -> int:
+        """
+        存入題目；每題需帶有 'word' 與 'part_of_speech'，內容重複的題目會略過
+
+        Returns:
+            新增的題數
+        """
+        now = time.time()
+        rows = [
+            (question_hash(q), lemmatize(q['word']), normalize_pos(q.get('part_of_speech')),
+             json.dumps(q, ensure_ascii=False), q.get('type', source), now)
+            for q in questions if q.get('word')
+        ]
+        if not rows:
+            return 0
+        try:
+            conn = self._connect()
+            with conn:
+                before = conn.total_changes
+                conn.executemany(
+                    'INSERT OR IGNORE INTO questions (hash, lemma, pos, question, source, created_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    rows
+                )
+                added = conn.total_changes - before
+        except Exception as e:
+            logging.error(f"寫入題庫時發生錯誤: {e}")
+            return 0
+        metrics.counter('question_bank_added_total', '新增到題庫的題數').inc(added)
+        return added
+
+    def draw(self, word, part_of_speech=None, limit=5, user_id=None) -> List[Dict[str, Any]]:
+        """
+        取出某個字的題目，優先選擇較少被使用的題目；指定 user_id 時排除該使用者看過的題目
+        """
+        lemma = lemmatize(word)
+        pos = normalize_pos(part_of_speech)
+        sql = 'SELECT question FROM questions q WHERE lemma = ?'
+        params = [lemma]
+        if pos:
+            sql += ' AND pos = ?'
+            params.append(pos)
+        if user_id is not None:
+            sql += ' AND NOT EXISTS (SELECT 1 FROM question_usage u WHERE u.user_id = ? AND u.hash = q.hash)'
+            params.append(user_id)
+        sql += ' ORDER BY served ASC, created_at ASC LIMIT ?'
+        params.append(limit)
+        try:
+            rows = self._connect().execute(sql, params).fetchall()
+        except Exception as e:
+            logging.error(f"讀取題庫時發生錯誤: {e}")
+            return []
+        return [json.loads(row[0]) for row in rows]
+
+    def mark_served(self, questions: List[Dict[str, Any]], user_id=None):
+        """累計題目的使用次數，並記錄使用者已經看過這些題目"""
+        hashes = [question_hash(q) for q in questions]
+        if not hashes:
+            return
+        now = time.time()
+        try:
+            conn = self._connect()
+            with conn:
+                conn.executemany('UPDATE questions SET served = served + 1 WHERE hash = ?', [(h,) for h in hashes])
+                if user_id is not None:
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO question_usage (user_id, hash, served_at) VALUES (?, ?, ?)',
+                        [(user_id, h, now) for h in hashes]
+                    )
+        except Exception as e:
+            logging.error(f"更新題庫使用紀錄時發生錯誤: {e}")
+
+    def seen_hashes(self, user_id, questions: List[Dict[str, Any]]) -> Set[str]:
+        """回傳這些題目中使用者已經看過的題目雜湊"""
+        hashes = [question_hash(q) for q in questions]
+        if user_id is None or not hashes:
+            return set()
+        try:
+            conn = self._connect()
+            placeholders = ','.join('?' * len(hashes))
+            rows = conn.execute(
+                f'SELECT hash FROM question_usage WHERE user_id = ? AND hash IN ({placeholders})',
+                [user_id] + hashes
+            ).fetchall()
+        except Exception as e:
+            logging.error(f"讀取題庫使用紀錄時發生錯誤: {e}")
+            return set()
+        return {row[0] for row in rows}
+
+    def size(self) -> int:
+        return self._connect().execute('SELECT COUNT(*) FROM questions').fetchone()[0]
+
+
+_default_bank = None
+_default_bank_lock = threading.Lock()
+
+def get_question_bank():
+    """取得整個 process 共用的題庫；QUESTION_BANK_ENABLED=0 時回傳 None"""
+    global _default_bank
+    if os.getenv('QUESTION_BANK_ENABLED', '1') != '1':
+        return None
+    if _default_bank is None:
+        with _default_bank_lock:
+            if _default_bank is None:
+                _default_bank = QuestionBank()
+    return _default_bank
@@ -1,24 +1,172 @@
+import hashlib
 import json
 import logging
+import os
+import random
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
+from llm_cache import get_llm_cache, make_cache_key
+from llm_backends import LLMBackend, GeminiBackend, account_call, get_backend
+from llm_scheduler import BATCH
+from stream_parser import IncrementalJSONArrayParser
+from text_utils import compact_json, lemmatize
+from lexicon import get_lexicon, normalize_pos
+from question_bank import get_question_bank, question_hash
+from renderer import iter_quiz_html, render
+from tracing import span
+import metrics
 
-def generate_toeic_quiz(gemini_model, words: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+# 生成考題使用的 LLM 後端，預設讀取 LLM_BACKEND
+QUIZ_BACKEND = os.getenv('QUIZ_LLM_BACKEND')
+# 每題考題（題目、四個選項、解釋）大約需要的輸出 token 數，用來設定 num_predict
+QUIZ_TOKENS_PER_QUESTION = int(os.getenv('QUIZ_TOKENS_PER_QUESTION', '160'))
+QUIZ_NUM_QUESTIONS = int(os.getenv('QUIZ_NUM_QUESTIONS', '50'))
+# 考題拆成幾個分片同時生成；實際並行數仍受後端的批次名額（LLM_BATCH_MAX_CONCURRENCY）限制
+QUIZ_SHARDS = int(os.getenv('QUIZ_SHARDS', '5'))
+# 失敗的分片最多重試幾次
+QUIZ_SHARD_RETRIES = int(os.getenv('QUIZ_SHARD_RETRIES', '1'))
+_quiz_executor = ThreadPoolExecutor(max_workers=QUIZ_SHARDS, thread_name_prefix='quiz-shard')
+
+OPTION_KEYS = ('A', 'B', 'C', 'D')
+# 出題方式：local 只用本地填空題；hybrid 每個有例句的字都在本地出填空題，模型只替本地出不了題的字出其他題型；
+# llm 全部交給模型
+QUIZ_MODE = os.getenv('QUIZ_MODE', 'hybrid')
+_SENTENCE_WORD_RE = re.compile(r"[A-Za-z]+(?:['’-][A-Za-z]+)*")
+# 每個 Gemini 模型物件只包一個 GeminiBackend，共用同一個並行上限；backend 持有模型物件，id 不會被重複使用
+_gemini_backends: Dict[int, GeminiBackend] = {}
+_gemini_backends_lock = threading.Lock()
+
+def _resolve_backend(model) -> LLMBackend:
+    """接受 LLMBackend、既有的 Gemini 模型物件或 None（使用 QUIZ_LLM_BACKEND 設定的後端）"""
+    if model is None:
+        return get_backend(QUIZ_BACKEND)
+    if isinstance(model, LLMBackend):
+        return model
+    with _gemini_backends_lock:
+        backend = _gemini_backends.get(id(model))
+        if backend is None:
+            backend = _gemini_backends[id(model)] = GeminiBackend(model_object=model)
+        return backend
+
+def _inflect_like(base, surface, answer_base):
     """
-    根據提取的單字生成 TOEIC 考題
-    
+    把干擾選項變成和答案相同的字形（複數、過去式、進行式），避免從字尾就看出答案
+
+    Returns:
+        變化後的字；需要重複字尾子音等無法可靠判斷的情況回傳 None
+    """
+    surface, answer_base, base = surface.lower(), answer_base.lower(), base.lower()
+    if surface == answer_base:
+        return base
+    cvc = len(base) >= 3 and base[-1] not in 'aeiouwxy' and base[-2] in 'aeiou' and base[-3] not in 'aeiou'
+    consonant_y = len(base) > 1 and base.endswith('y') and base[-2] not in 'aeiou'
+    if surface.endswith(('ing', 'ed')) and cvc:
+        return None
+    if surface.endswith('ing'):
+        return (base[:-1] if base.endswith('e') and not base.endswith('ee') else base) + 'ing'
+    if surface.endswith('ed'):
+        if base.endswith('e'):
+            return base + 'd'
+        return base[:-1] + 'ied' if consonant_y else base + 'ed'
+    if surface.endswith('s'):
+        if base.endswith(('s', 'sh', 'ch', 'x', 'z')):
+            return base + 'es'
+        return base[:-1] + 'ies' if consonant_y else base + 's'
+    return base
+
+def _find_target(sentence, word):
+    """在例句中找出目標字（含變化形）的位置，回傳 (開始, 結束, 原文字形)；找不到時回傳 None"""
+    lemma = lemmatize(word)
+    for match in _SENTENCE_WORD_RE.finditer(sentence):
+        token = match.group(0)
+        if token.lower() == word.lower() or lemmatize(token) == lemma:
+            return match.start(), match.end(), token
+    return None
+
+def _question_from_sentence(record, sentence, pool, rng):
+    target = _find_target(sentence, record['word'])
+    if target is None:
+        return None
+    start, end, surface = target
+    lemma = lemmatize(record['word'])
+    answer = surface.lower() if surface[0].isupper() and start == 0 else surface
+    distractors = []
+    for candidate in pool:
+        if lemmatize(candidate) == lemma:
+            continue
+        inflected = _inflect_like(candidate, surface, record['word'])
+        if inflected and inflected != answer.lower() and inflected not in distractors:
+            distractors.append(inflected)
+    if len(distractors) < 3:
+        return None
+    chosen = rng.sample(distractors, 3)
+    options = chosen + [answer]
+    rng.shuffle(options)
+    correct = OPTION_KEYS[options.index(answer)]
+    return {
+        'question': sentence[:start] + '_____' + sentence[end:],
+        'options': dict(zip(OPTION_KEYS, options)),
+        'correct_answer': correct,
+        'explanation': f"{record['word']}（{record['part_of_speech']}）：{record['definition']}。"
+                       f"其他選項詞性相同但不符合句意。",
+        'type': 'cloze',
+        'word': record['word'],
+        'part_of_speech': record['part_of_speech'],
+    }
+
+def generate_cloze_questions(words: List[Dict[str, Any]], max_questions=None, lexicon=None) -> List[Dict[str, Any]]:
+    """
+    不呼叫模型，直接由單字資料產生 TOEIC Part 5 填空題
+
+    把例句中的目標字挖空，從同詞性的其他單字（本次單字列表與單字庫）挑三個干擾選項。
+    同一組單字每次產生相同的題目；例句中找不到目標字或干擾選項不足的單字會略過。
+
     Args:
-        gemini_model: Gemini 模型實例
-        words: 單字列表，每個單字包含 word, chinese, part_of_speech, example
-        
+        words: 單字列表，每個單字包含 word, definition, part_of_speech, example_sentence
+        max_questions: 題數上限
+        lexicon: 干擾選項與額外例句的來源，預設為共用的單字庫
+
     Returns:
-        包含50題考題的列表
+        與 generate_toeic_quiz() 相同格式的題目列表，另有 'type': 'cloze' 與出題的 'word'、'part_of_speech'
     """
-    if not words:
-        logging.error("沒有單字可以生成考題")
-        return []
-        
-    prompt = f"""
-    請根據以下單字列表生成50題 TOEIC 考試風格的選擇題。
+    if lexicon is None:
+        lexicon = get_lexicon()
+    by_pos = {}
+    for record in words:
+        by_pos.setdefault(normalize_pos(record.get('part_of_speech')), []).append(record['word'])
+
+    questions = []
+    for record in words:
+        if not all(isinstance(record.get(key), str) and record[key] for key in ('word', 'part_of_speech', 'definition')):
+            continue
+        pos = normalize_pos(record['part_of_speech'])
+        pool = list(by_pos.get(pos, []))
+        sentences = [record.get('example_sentence')]
+        if lexicon is not None:
+            pool += lexicon.words_by_pos(pos)
+            stored = lexicon.lookup(record['word'], pos)
+            if stored and stored.get('example_sentence'):
+                sentences.append(stored['example_sentence'])
+        seen = set()
+        for sentence in sentences:
+            if not sentence or sentence.lower() in seen:
+                continue
+            seen.add(sentence.lower())
+            # 以單字與例句決定亂數種子，同樣的輸入得到同樣的題目
+            rng = random.Random(hashlib.sha256(f"{record['word']}|{sentence}".encode('utf-8')).hexdigest())
+            question = _question_from_sentence(record, sentence, pool, rng)
+            if question is not None:
+                questions.append(question)
+            if max_questions and len(questions) >= max_questions:
+                return questions
+    return questions
+
+def _build_quiz_prompt(words, num_questions, skip_cloze=False):
+    extra = "\n    5. 例句填空題已另外產生，請出其他題型（同義字、詞性變化、文意理解等）" if skip_cloze else ""
+    return f"""
+    請根據以下單字列表生成{num_questions}題 TOEIC 考試風格的選擇題。
     每個題目應該包含：
     1. 題目（使用單字或其變化形式）
     2. 4個選項（A, B, C, D）
@@ -26,7 +174,7 @@ def generate_toeic_quiz(gemini_model, words: List[Dict[str, Any]]) -> List[Dict[
     4. 解釋
     
     單字列表：
-    {json.dumps(words, ensure_ascii=False, indent=2)}
+    {compact_json(words)}
     
     請用以下JSON格式回傳：
     {{
@@ -40,6 +188,7 @@ def generate_toeic_quiz(gemini_model, words: List[Dict[str, Any]]) -> List[Dict[
                     "D": "decorate"
                 }},
                 "correct_answer": "A",
+                "word": "terminate",
                 "explanation": "terminate 意為終止，符合句意。其他選項：initiate（開始）、celebrate（慶祝）、decorate（裝飾）都不符合上下文。"
             }}
         ]
@@ -49,26 +198,240 @@ def generate_toeic_quiz(gemini_model, words: List[Dict[str, Any]]) -> List[Dict[
     1. 題目要符合 TOEIC 考試的難度和風格
     2. 選項要合理且具有迷惑性
     3. 解釋要清楚說明為什麼是正確答案
-    4. 確保生成恰好50題
+    4. 確保生成恰好{num_questions}題{extra}
     """
-    
+
+def validate_question(item) -> bool:
+    """檢查一題考題是否包含題目、A-D 四個選項、存在於選項中的正確答案與解釋"""
+    if not isinstance(item, dict):
+        return False
+    options = item.get('options')
+    if not isinstance(item.get('question'), str) or not item['question'].strip():
+        return False
+    if not isinstance(options, dict) or not all(isinstance(options.get(key), str) for key in OPTION_KEYS):
+        return False
+    return item.get('correct_answer') in OPTION_KEYS and isinstance(item.get('explanation'), str)
+
+def parse_quiz_response(text):
+    """
+    解析模型回傳的考題 JSON；整體無法解析時以串流解析器撈出已經完整的題目
+
+    Returns:
+        通過 validate_question() 的題目列表
+    """
+    text = (text or '').strip()
+    if "```json" in text:
+        json_start = text.find("```json") + 7
+        json_end = text.find("```", json_start)
+        text = text[json_start:json_end if json_end >= 0 else None]
+    elif "```" in text:
+        json_start = text.find("```") + 3
+        json_end = text.rfind("```")
+        text = text[json_start:json_end if json_end > json_start else None]
     try:
-        response = gemini_model.generate_content(prompt)
-        result_text = response.text
-        if "```json" in result_text:
-            json_start = result_text.find("```json") + 7
-            json_end = result_text.find("```", json_start)
-            result_text = result_text[json_start:json_end]
-        elif "```" in result_text:
-            json_start = result_text.find("```") + 3
-            json_end = result_text.rfind("```")
-            result_text = result_text[json_start:json_end]
-        quiz_data = json.loads(result_text.strip())
-        logging.info(f"成功生成 {len(quiz_data['questions'])} 題考題")
-        return quiz_data['questions']
-    except Exception as e:
-        logging.error(f"使用 Gemini 生成考題時發生錯誤: {e}")
+        data = json.loads(text.strip())
+        items = data.get('questions', []) if isinstance(data, dict) else data
+    except json.JSONDecodeError as e:
+        logging.warning(f"考題 JSON 格式錯誤，改為撈出完整的題目: {e}")
+        parser = IncrementalJSONArrayParser()
+        parser.feed(text)
+        items = parser.items
+    if not isinstance(items, list):
         return []
+    return [item for item in items if validate_question(item)]
+
+def _split_shards(words, num_questions, shards):
+    """
+    將單字輪流分配到各分片，題數平均分配
+
+    Returns:
+        [(單字列表, 題數), ...]，不會產生沒有單字或沒有題目的分片
+    """
+    shards = max(1, min(shards, len(words), num_questions))
+    result = []
+    for i in range(shards):
+        count = num_questions // shards + (1 if i < num_questions % shards else 0)
+        result.append((words[i::shards], count))
+    return result
+
+def _attach_word(question, shard_words):
+    """
+    找出模型出的題目是在考哪個字，補上 'word' 與 'part_of_speech' 以便存進題庫
+
+    依序比對：模型回傳的 word 欄位 → 正確答案的原形 → 題目中出現的字
+    """
+    by_lemma = {lemmatize(w['word']): w for w in shard_words}
+    candidates = [question.get('word'), question['options'].get(question['correct_answer'])]
+    candidates += _SENTENCE_WORD_RE.findall(question['question'])
+    for candidate in candidates:
+        if isinstance(candidate, str) and lemmatize(candidate.strip()) in by_lemma:
+            record = by_lemma[lemmatize(candidate.strip())]
+            question['word'] = record['word']
+            question['part_of_speech'] = record.get('part_of_speech', '')
+            return question
+    return question
+
+def _generate_shard(backend, shard_words, num_questions, priority, skip_cloze=False, use_cache=True):
+    """
+    生成一個分片的考題；use_cache 為 False 時不讀取快取（快取的題目使用者都看過時重新生成）
+
+    Returns:
+        有效題目列表；呼叫失敗或沒有任何有效題目時拋出例外，交給呼叫端決定是否重試
+    """
+    messages = [{"role": "user", "content": _build_quiz_prompt(shard_words, num_questions, skip_cloze)}]
+    # 限制輸出長度，Ollama 也依此決定 num_ctx
+    options = {'num_predict': num_questions * QUIZ_TOKENS_PER_QUESTION}
+    cache = get_llm_cache()
+    cache_key = make_cache_key(backend.default_model, messages, options)
+    if cache is not None and use_cache:
+        cached = cache.get(cache_key, namespace='quiz')
+        if cached is not None:
+            return cached['parsed']
+
+    response = backend.chat(messages, options=options, priority=priority)
+    account_call('quiz', messages, response)
+    with span('json_parse'):
+        questions = [_attach_word(q, shard_words) for q in parse_quiz_response(response['content'])]
+    if not questions:
+        raise ValueError("回應中沒有可用的考題")
+    if cache is not None and len(questions) >= num_questions:
+        cache.set(cache_key, response['content'], questions)
+    return questions[:num_questions]
+
+def _generate_with_llm(backend, words, num_questions, priority, shards, skip_cloze, use_cache=True):
+    """
+    把 num_questions 題分成數個分片交給模型同時生成，只重試失敗的分片
+
+    Returns:
+        各分片的題目依分片順序串接（尚未去重）
+    """
+    pending = _split_shards(list(words), num_questions, shards)
+    results = {}
+    for attempt in range(QUIZ_SHARD_RETRIES + 1):
+        futures = {
+            index: _quiz_executor.submit(_generate_shard, backend, shard_words, count, priority, skip_cloze, use_cache)
+            for index, (shard_words, count) in enumerate(pending) if index not in results
+        }
+        for index, future in futures.items():
+            try:
+                results[index] = future.result()
+                metrics.counter('quiz_shards_total', '考題分片的生成結果', {'result': 'ok'}).inc()
+            except Exception as e:
+                metrics.counter('quiz_shards_total', '考題分片的生成結果', {'result': 'failed'}).inc()
+                logging.error(f"使用 {backend.name} 生成第 {index + 1} 個考題分片時發生錯誤"
+                              f"（第 {attempt + 1} 次）: {e}")
+        if len(results) == len(pending):
+            break
+    if len(results) < len(pending):
+        logging.warning(f"{len(pending) - len(results)}/{len(pending)} 個考題分片失敗，回傳部分考題")
+    return [question for index in sorted(results) for question in results[index]]
+
+def _question_key(question):
+    return ' '.join(question['question'].lower().split())
+
+def generate_toeic_quiz(model, words: List[Dict[str, Any]], priority=BATCH, num_questions=None,
+                        shards=None, mode=None, user_id=None) -> List[Dict[str, Any]]:
+    """
+    根據提取的單字生成 TOEIC 考題
+
+    組卷順序：
+    1. 題庫中已有的題目（排除 user_id 看過的題目）
+    2. 每個有例句的單字在本地產生例句填空題（generate_cloze_questions），排除使用者看過的題目後才計入題數
+    3. 交給模型：hybrid 只替前兩步都沒有題目的單字出其他題型，大部分情況完全不需要呼叫模型；
+       llm 則由模型補足剩下的題數。依單字分成數個分片同時生成（總耗時約等於最慢的分片），
+       只有失敗的分片會重試，仍失敗時回傳其他分片的部分結果
+    新產生的題目都會存回題庫，合併時以題目文字去重。
+    指定 user_id 時，本地填空題與模型（包含快取）的題目同樣排除使用者已經看過的題目。
+
+    Args:
+        model: LLMBackend、Gemini 模型實例，或 None 使用預設後端
+        words: 單字列表，每個單字包含 word, definition, part_of_speech, example_sentence
+        priority: 排程優先權，考題屬於批次工作，預設讓位給 LINE 使用者的請求
+        num_questions: 總題數，預設讀取 QUIZ_NUM_QUESTIONS（50）
+        shards: 分片數，預設讀取 QUIZ_SHARDS
+        mode: 'local'、'hybrid' 或 'llm'，預設讀取 QUIZ_MODE
+        user_id: 收到這份考題的使用者，用於避免重複出題
+
+    Returns:
+        考題列表；hybrid / local 模式下本地題目不足，或部分分片失敗時，題數會少於 num_questions
+    """
+    if not words:
+        logging.error("沒有單字可以生成考題")
+        return []
+
+    num_questions = num_questions or QUIZ_NUM_QUESTIONS
+    mode = mode or QUIZ_MODE
+    bank = get_question_bank()
+    # 每個字平均分到的題數，題庫中某個字的題目不足這個數量就視為尚未涵蓋
+    per_word = -(-num_questions // len(words))
+
+    questions = []
+    seen = set()
+    covered = set()
+    counts = {'bank': 0, 'local': 0, 'llm': 0}
+
+    def take(candidates, source):
+        added = 0
+        for question in candidates:
+            key = _question_key(question)
+            if key not in seen and len(questions) < num_questions:
+                seen.add(key)
+                questions.append(question)
+                if isinstance(question.get('word'), str):
+                    covered.add(lemmatize(question['word']))
+                added += 1
+        counts[source] += added
+        metrics.counter('quiz_questions_total', '各來源產生的考題數', {'source': source}).inc(added)
+        return added
+
+    def unseen(candidates):
+        # 本地填空題與快取的模型題目每次都相同，要排除這位使用者已經看過的題目
+        if bank is None or user_id is None:
+            return candidates
+        served = bank.seen_hashes(user_id, candidates)
+        return [q for q in candidates if question_hash(q) not in served]
+
+    uncovered = []
+    for record in words:
+        banked = bank.draw(record['word'], record.get('part_of_speech'), per_word, user_id) if bank is not None else []
+        if take(banked, 'bank') < per_word:
+            uncovered.append(record)
+
+    if len(questions) < num_questions and mode != 'llm':
+        # 不限制產生的題數：先排除使用者看過的題目，題數上限由 take() 控制
+        local = generate_cloze_questions(words)
+        if bank is not None:
+            bank.add(local, source='cloze')
+        take(unseen(local), 'local')
+
+    if mode == 'llm':
+        llm_words = uncovered or words
+        target = num_questions
+    elif mode == 'hybrid':
+        # 只替題庫和本地都沒有題目的字呼叫模型，不拿模型補滿題數
+        llm_words = [record for record in words if lemmatize(record['word']) not in covered]
+        target = min(num_questions, len(questions) + per_word * len(llm_words))
+    else:
+        llm_words, target = [], 0
+
+    if llm_words and len(questions) < target:
+        backend = _resolve_backend(model)
+        for use_cache in (True, False):
+            generated = _generate_with_llm(backend, llm_words, target - len(questions), priority,
+                                           shards or QUIZ_SHARDS, mode != 'llm', use_cache)
+            if bank is not None:
+                bank.add(generated, source='llm')
+            fresh = unseen(generated)
+            take(fresh[:target - len(questions)], 'llm')
+            # 只有快取的題目被使用者看過而不足時，才略過快取重新生成一次
+            if len(questions) >= target or len(fresh) == len(generated):
+                break
+
+    if bank is not None:
+        bank.mark_served(questions, user_id)
+    logging.info(f"成功生成 {len(questions)} 題考題（題庫 {counts['bank']} 題、本地填空題 {counts['local']} 題、"
+                 f"模型 {counts['llm']} 題）")
+    return questions
 
 def format_quiz_for_email(quiz_questions: List[Dict[str, Any]]) -> str:
     """
@@ -80,29 +443,4 @@ def format_quiz_for_email(quiz_questions: List[Dict[str, Any]]) -> str:
     Returns:
         HTML 格式的郵件內容
     """
-    if not quiz_questions:
-        return ""
-        
-    email_content = """
-    <h3>練習題：</h3>
-    <ol>
-    """
-    
-    for i, question in enumerate(quiz_questions, 1):
-        email_content += f"""
-        <li>
-            <p>{question['question']}</p>
-            <p>A) {question['options']['A']}</p>
-            <p>B) {question['options']['B']}</p>
-            <p>C) {question['options']['C']}</p>
-            <p>D) {question['options']['D']}</p>
-            <p><strong>正確答案：{question['correct_answer']}</strong></p>
-            <p>解釋：{question['explanation']}</p>
-        </li>
-        """
-    
-    email_content += """
-    </ol>
-    """
-    
-    return email_content 
\ No newline at end of file
+    return render(iter_quiz_html(quiz_questions))
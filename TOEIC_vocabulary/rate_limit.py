@@ -0,0 +1,82 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket 限流器：每秒補充 rate 個 token，最多累積 capacity 個
+
+    短時間的突發流量可以一次用掉累積的 token，長時間的平均速率不會超過 rate。
+    收到對方的限流回應時可以用 pause() 讓所有共用這個 bucket 的呼叫端一起暫停。
+
+    Args:
+        rate: 每秒補充的 token 數
+        capacity: 最多累積的 token 數，預設等於 rate（最多一秒的突發量）
+        clock: 取得目前時間的函式，測試時可替換
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        if rate <= 0:
+            raise ValueError("rate 必須大於 0")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._updated_at = clock()
+        self._paused_until = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self._updated_at
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated_at = now
+
+    def _wait_locked(self, tokens, now):
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._refill(now)
+        if self._tokens >= tokens:
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+    def try_acquire(self, tokens=1) -> bool:
+        """有足夠的 token 就取用並回傳 True，否則不等待直接回傳 False"""
+        with self._lock:
+            now = self._clock()
+            if self._wait_locked(tokens, now) > 0:
+                return False
+            self._tokens -= tokens
+            return True
+
+    def wait_time(self, tokens=1) -> float:
+        """距離可以取得 tokens 個 token 還要等多少秒"""
+        with self._lock:
+            return self._wait_locked(tokens, self._clock())
+
+    def acquire(self, tokens=1, timeout=None) -> bool:
+        """
+        取得 tokens 個 token，不夠時等待補充
+
+        Returns:
+            是否取得；超過 timeout 秒仍無法取得時回傳 False
+        """
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            with self._lock:
+                now = self._clock()
+                wait = self._wait_locked(tokens, now)
+                if wait <= 0:
+                    self._tokens -= tokens
+                    return True
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """暫停發放 token seconds 秒，並清空目前累積的 token"""
+        with self._lock:
+            now = self._clock()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0.0
+            self._updated_at = self._paused_until
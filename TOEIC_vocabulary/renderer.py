@@ -0,0 +1,158 @@
+import html
+import io
+import os
+from typing import Any, Dict, Iterable, Iterator, List
+
+# LINE 單則文字訊息上限 5000 字；每次 reply/push 最多 5 則
+LINE_TEXT_LIMIT = int(os.getenv('LINE_TEXT_LIMIT', '5000'))
+LINE_MESSAGES_PER_CALL = 5
+# Flex carousel 每則最多 12 個 bubble
+FLEX_BUBBLES_PER_CAROUSEL = 12
+
+# 模板在載入模組時建立一次，之後每筆資料只做一次 format
+_EMAIL_HEADER = "<h2>今日 TOEIC 單字學習</h2>\n<p>影片標題：{title}</p>\n"
+_EMAIL_WORDS_OPEN = "<h3>單字列表：</h3>\n<ul>\n"
+_EMAIL_WORD = "<li><strong>{word}</strong> ({part_of_speech}) - {definition}<br>例句：{example_sentence}</li>\n"
+_EMAIL_LIST_CLOSE = "</ul>\n"
+_QUIZ_OPEN = "<h3>練習題：</h3>\n<ol>\n"
+_QUIZ_ITEM = (
+    "<li>\n<p>{question}</p>\n<p>A) {A}</p>\n<p>B) {B}</p>\n<p>C) {C}</p>\n<p>D) {D}</p>\n"
+    "<p><strong>正確答案：{correct_answer}</strong></p>\n<p>解釋：{explanation}</p>\n</li>\n"
+)
+_QUIZ_CLOSE = "</ol>\n"
+
+_LINE_HEADER = "Video URL - {url}\n\n影片標題：{title}\n\n單字列表：\n"
+_LINE_WORD = "\n{index}. {word} ({part_of_speech}) - {definition}\neg. {example_sentence}\n"
+_LINE_EMPTY = "未找到任何單字。"
+
+
+def _escaped(record, fields):
+    return {field: html.escape(str(record.get(field) or '')) for field in fields}
+
+
+def iter_quiz_html(questions: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """逐題產生考題的 HTML 片段；沒有考題時不產生任何內容"""
+    opened = False
+    for question in questions:
+        if not opened:
+            yield _QUIZ_OPEN
+            opened = True
+        options = question.get('options') or {}
+        values = _escaped(question, ('question', 'correct_answer', 'explanation'))
+        values.update(_escaped(options, ('A', 'B', 'C', 'D')))
+        yield _QUIZ_ITEM.format(**values)
+    if opened:
+        yield _QUIZ_CLOSE
+
+
+def iter_email_html(title, words: Iterable[Dict[str, Any]], questions: Iterable[Dict[str, Any]] = ()) -> Iterator[str]:
+    """
+    逐段產生每日單字郵件的 HTML
+
+    以產生器輸出片段，呼叫端可以直接寫入檔案或 socket，不必先組出整封郵件
+    """
+    yield _EMAIL_HEADER.format(title=html.escape(str(title)))
+    yield _EMAIL_WORDS_OPEN
+    for word in words:
+        yield _EMAIL_WORD.format(**_escaped(word, ('word', 'part_of_speech', 'definition', 'example_sentence')))
+    yield _EMAIL_LIST_CLOSE
+    yield from iter_quiz_html(questions)
+
+
+def write_chunks(out, chunks: Iterable[str]) -> int:
+    """
+    把片段依序寫入 out（任何有 write() 的物件）
+
+    Returns:
+        寫入的字元數
+    """
+    written = 0
+    for chunk in chunks:
+        out.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def render(chunks: Iterable[str]) -> str:
+    """把片段寫入記憶體緩衝區並回傳完整字串，總耗時與輸出長度成正比"""
+    buffer = io.StringIO()
+    write_chunks(buffer, chunks)
+    return buffer.getvalue()
+
+
+def iter_line_records(url, title, words: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """LINE 單字列表的每一筆紀錄；第一筆為標題，之後每個單字一筆"""
+    yield _LINE_HEADER.format(url=url, title=title)
+    empty = True
+    for index, word in enumerate(words, 1):
+        empty = False
+        yield _LINE_WORD.format(index=index, word=word.get('word'), part_of_speech=word.get('part_of_speech'),
+                                definition=word.get('definition'), example_sentence=word.get('example_sentence'))
+    if empty:
+        yield _LINE_EMPTY
+
+
+def pack_text(records: Iterable[str], limit=None) -> List[str]:
+    """
+    把紀錄依序裝進最少的訊息，每則不超過 limit 字，只在紀錄之間切開
+
+    單筆紀錄本身超過 limit 時才會在紀錄中間切開
+    """
+    limit = limit or LINE_TEXT_LIMIT
+    messages = []
+    current = []
+    size = 0
+    for record in records:
+        if size + len(record) > limit and current:
+            messages.append(''.join(current))
+            current = []
+            size = 0
+        while len(record) > limit:
+            messages.append(record[:limit])
+            record = record[limit:]
+        if record:
+            current.append(record)
+            size += len(record)
+    if current:
+        messages.append(''.join(current))
+    return messages
+
+
+def _flex_text(text, **style):
+    return {'type': 'text', 'text': str(text or '-'), 'wrap': True, **style}
+
+
+def flex_word_bubble(word: Dict[str, Any]) -> Dict[str, Any]:
+    """單一單字的 Flex bubble"""
+    contents = [
+        _flex_text(word.get('word'), weight='bold', size='xl'),
+        _flex_text(word.get('part_of_speech'), size='sm', color='#888888'),
+        _flex_text(word.get('definition'), margin='md'),
+    ]
+    if word.get('example_sentence'):
+        contents.append(_flex_text(word['example_sentence'], size='sm', color='#555555', margin='md'))
+    return {'type': 'bubble', 'body': {'type': 'box', 'layout': 'vertical', 'contents': contents}}
+
+
+def flex_carousels(words: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    把單字裝進 Flex carousel，每個 carousel 最多 12 個 bubble
+
+    Returns:
+        carousel 的 dict 列表，可以用 FlexContainer.from_dict() 轉成 Flex 訊息內容
+    """
+    carousels = []
+    bubbles = []
+    for word in words:
+        bubbles.append(flex_word_bubble(word))
+        if len(bubbles) == FLEX_BUBBLES_PER_CAROUSEL:
+            carousels.append({'type': 'carousel', 'contents': bubbles})
+            bubbles = []
+    if bubbles:
+        carousels.append({'type': 'carousel', 'contents': bubbles})
+    return carousels
+
+
+def batch_messages(messages: List[Any], size=LINE_MESSAGES_PER_CALL) -> List[List[Any]]:
+    """把訊息切成每次 API 呼叫可送出的批次"""
+    return [messages[i:i + size] for i in range(0, len(messages), size)]
@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+
+class ExtractionCache:
+    """
+    以 SQLite 儲存的單字萃取結果快取，key 為 (video_id, 模型/提示詞版本)
+
+    SQLite 檔案可以被多個 worker process 共用；每個執行緒使用自己的連線。
+    過期的項目在讀取時視為未命中，寫入時順便清除；
+    超過 max_entries 時依最後存取時間淘汰最舊的項目 (LRU)。
+
+    Args:
+        db_path: SQLite 檔案路徑，預設讀取 EXTRACTION_CACHE_DB
+        ttl_seconds: 項目存活時間，預設讀取 EXTRACTION_CACHE_TTL（7 天）
+        max_entries: 最多保留的項目數，預設讀取 EXTRACTION_CACHE_MAX_ENTRIES
+    """
+
+    def __init__(self, db_path=None, ttl_seconds=None, max_entries=None):
+        self.db_path = db_path or os.getenv('EXTRACTION_CACHE_DB', 'extraction_cache.db')
+        self.ttl_seconds = ttl_seconds or int(os.getenv('EXTRACTION_CACHE_TTL', str(7 * 24 * 3600)))
+        self.max_entries = max_entries or int(os.getenv('EXTRACTION_CACHE_MAX_ENTRIES', '5000'))
+        self._local = threading.local()
+        self._hits = metrics.counter('extraction_cache_hits_total', '萃取結果快取命中次數')
+        self._misses = metrics.counter('extraction_cache_misses_total', '萃取結果快取未命中次數')
+        self._init_schema()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS extraction_cache (
+                    video_id TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    title TEXT,
+                    words TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (video_id, version)
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_extraction_cache_last_access ON extraction_cache (last_access)')
+
+    def get(self, video_id, version):
+        """
+        取得快取結果
+
+        Returns:
+            {'title': 影片標題, 'words': 單字列表}；未命中或已過期時回傳 None
+        """
+        try:
+            conn = self._connect()
+            now = time.time()
+            row = conn.execute(
+                'SELECT title, words, created_at FROM extraction_cache WHERE video_id = ? AND version = ?',
+                (video_id, version)
+            ).fetchone()
+            if row is None or now - row[2] > self.ttl_seconds:
+                self._misses.inc()
+                return None
+            with conn:
+                conn.execute(
+                    'UPDATE extraction_cache SET last_access = ? WHERE video_id = ? AND version = ?',
+                    (now, video_id, version)
+                )
+            self._hits.inc()
+            return {'title': row[0], 'words': json.loads(row[1])}
+        except Exception as e:
+            logging.error(f"讀取萃取結果快取時發生錯誤: {e}")
+            return None
+
+    def set(self, video_id, version, title, words):
+        try:
+            conn = self._connect()
+            now = time.time()
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO extraction_cache (video_id, version, title, words, created_at, last_access) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (video_id, version, title, json.dumps(words, ensure_ascii=False), now, now)
+                )
+                self._evict(conn, now)
+        except Exception as e:
+            logging.error(f"寫入萃取結果快取時發生錯誤: {e}")
+
+    def _evict(self, conn, now):
+        conn.execute('DELETE FROM extraction_cache WHERE created_at < ?', (now - self.ttl_seconds,))
+        count = conn.execute('SELECT COUNT(*) FROM extraction_cache').fetchone()[0]
+        if count > self.max_entries:
+            conn.execute(
+                'DELETE FROM extraction_cache WHERE rowid IN '
+                '(SELECT rowid FROM extraction_cache ORDER BY last_access ASC LIMIT ?)',
+                (count - self.max_entries,)
+            )
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_extraction_cache():
+    """取得整個 process 共用的快取實例"""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = ExtractionCache()
+    return _default_cache
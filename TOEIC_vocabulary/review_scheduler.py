@@ -0,0 +1,331 @@
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import metrics
+from lexicon import normalize_pos
+from text_utils import lemmatize
+
+# 每張卡片固定 18 bytes：單字編號、下次複習時間（epoch 秒）、間隔天數、難易度 ×1000、連續答對次數、遺忘次數
+_CARD = struct.Struct('<IIfHHH')
+DAY_SECONDS = 86400
+# SM-2 的起始難易度與下限
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+
+
+def sm2(quality, repetitions, interval_days, ease):
+    """
+    SM-2 排程：依這次回想的品質（0-5）計算新的 (連續答對次數, 間隔天數, 難易度)
+    """
+    if quality < 3:
+        repetitions = 0
+        interval_days = 1.0
+    else:
+        repetitions += 1
+        if repetitions == 1:
+            interval_days = 1.0
+        elif repetitions == 2:
+            interval_days = 6.0
+        else:
+            interval_days = round(interval_days * ease, 1)
+    ease = max(MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return repetitions, interval_days, ease
+
+
+class ReviewScheduler:
+    """
+    每位使用者單字卡的間隔複習（SM-2）排程
+
+    - 每位使用者的卡片以 struct 打包在一個 bytearray 中，不為每張卡建立 dict
+    - 單字內容只存一份，卡片以單字編號參照
+    - 以 heap 記錄每位使用者最早到期的時間，每次檢查只取出到期的使用者，
+      成本為 O(到期人數 · log 使用者數)，不需要掃描所有使用者；過期的 heap 項目在取出時略過
+    - 狀態存在 SQLite（每位使用者一列 BLOB），啟動時載入並重建 heap
+
+    Args:
+        db_path: SQLite 檔案路徑，預設讀取 REVIEW_DB
+        first_delay: 新單字第一次複習前的秒數，預設讀取 REVIEW_FIRST_DELAY（一天）
+        max_cards: 每次推播最多幾張卡，預設讀取 REVIEW_MAX_CARDS
+    """
+
+    def __init__(self, db_path=None, first_delay=None, max_cards=None):
+        self.db_path = db_path or os.getenv('REVIEW_DB', 'review.db')
+        self.first_delay = first_delay if first_delay is not None else int(os.getenv('REVIEW_FIRST_DELAY', str(DAY_SECONDS)))
+        self.max_cards = max_cards or int(os.getenv('REVIEW_MAX_CARDS', '10'))
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._cards: Dict[str, bytearray] = {}
+        self._words: List[Dict[str, str]] = []
+        self._word_ids: Dict[Tuple[str, str], int] = {}
+        self._heap: List[Tuple[int, str]] = []
+        self._next_due: Dict[str, int] = {}
+        self._thread = None
+        self._stop = threading.Event()
+        self._due_gauge = metrics.gauge('review_users_scheduled', '有排程中複習卡片的使用者數')
+        self._init_schema()
+        self._load()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS review_words (
+                    word_id INTEGER PRIMARY KEY,
+                    lemma TEXT NOT NULL,
+                    pos TEXT NOT NULL,
+                    record TEXT NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS review_cards (
+                    user_id TEXT PRIMARY KEY,
+                    cards BLOB NOT NULL
+                )
+            ''')
+
+    def _load(self):
+        conn = self._connect()
+        for word_id, lemma, pos, record in conn.execute('SELECT word_id, lemma, pos, record FROM review_words ORDER BY word_id'):
+            self._words.append(json.loads(record))
+            self._word_ids[(lemma, pos)] = word_id
+        for user_id, cards in conn.execute('SELECT user_id, cards FROM review_cards'):
+            self._cards[user_id] = bytearray(cards)
+            self._reschedule(user_id)
+
+    def _word_id(self, record):
+        key = (lemmatize(record['word']), normalize_pos(record.get('part_of_speech')))
+        word_id = self._word_ids.get(key)
+        if word_id is None:
+            word_id = len(self._words)
+            stored = {field: record.get(field) for field in ('word', 'definition', 'part_of_speech', 'example_sentence')}
+            self._words.append(stored)
+            self._word_ids[key] = word_id
+            conn = self._connect()
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO review_words (word_id, lemma, pos, record) VALUES (?, ?, ?, ?)',
+                             (word_id, key[0], key[1], json.dumps(stored, ensure_ascii=False)))
+        return word_id
+
+    def _save(self, user_id):
+        conn = self._connect()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO review_cards (user_id, cards) VALUES (?, ?)',
+                         (user_id, bytes(self._cards[user_id])))
+
+    def _reschedule(self, user_id):
+        """重新計算使用者最早的到期時間；有變動時推入新的 heap 項目，舊項目留到取出時略過"""
+        cards = self._cards.get(user_id)
+        if not cards:
+            self._next_due.pop(user_id, None)
+            return
+        earliest = min(due for _, due, _, _, _, _ in _CARD.iter_unpack(cards))
+        if self._next_due.get(user_id) != earliest:
+            self._next_due[user_id] = earliest
+            heapq.heappush(self._heap, (earliest, user_id))
+        self._due_gauge.set(len(self._next_due))
+
+    def add_words(self, user_id, words: List[Dict[str, Any]], now=None) -> int:
+        """
+        把萃取出的單字加入使用者的複習清單，已經在清單中的字會略過
+
+        Returns:
+            新增的卡片數
+        """
+        now = int(now if now is not None else time.time())
+        with self._lock:
+            cards = self._cards.setdefault(user_id, bytearray())
+            existing = {word_id for word_id, *_ in _CARD.iter_unpack(cards)}
+            added = 0
+            for record in words:
+                if not record.get('word'):
+                    continue
+                word_id = self._word_id(record)
+                if word_id in existing:
+                    continue
+                existing.add(word_id)
+                cards += _CARD.pack(word_id, now + self.first_delay, 0.0, int(INITIAL_EASE * 1000), 0, 0)
+                added += 1
+            if added:
+                self._save(user_id)
+                self._reschedule(user_id)
+        metrics.counter('review_cards_added_total', '加入複習清單的卡片數').inc(added)
+        return added
+
+    def grade(self, user_id, word, quality, now=None) -> bool:
+        """
+        記錄使用者對某個字的回想品質（0-5），依 SM-2 更新下次複習時間
+
+        Returns:
+            使用者清單中是否有這個字
+        """
+        now = int(now if now is not None else time.time())
+        lemma = lemmatize(word)
+        with self._lock:
+            cards = self._cards.get(user_id)
+            if not cards:
+                return False
+            found = False
+            for offset in range(0, len(cards), _CARD.size):
+                word_id = _CARD.unpack_from(cards, offset)[0]
+                if lemmatize(self._words[word_id]['word']) != lemma:
+                    continue
+                self._grade_at(cards, offset, quality, now)
+                found = True
+            if found:
+                self._save(user_id)
+                self._reschedule(user_id)
+        return found
+
+    def _grade_at(self, cards, offset, quality, now):
+        word_id, _, interval, ease, repetitions, lapses = _CARD.unpack_from(cards, offset)
+        repetitions, interval, new_ease = sm2(quality, repetitions, interval, ease / 1000)
+        if quality < 3:
+            lapses += 1
+        _CARD.pack_into(cards, offset, word_id, now + int(interval * DAY_SECONDS), interval,
+                        int(new_ease * 1000), min(repetitions, 0xFFFF), min(lapses, 0xFFFF))
+
+    def pop_due(self, now=None, limit=None) -> List[Tuple[str, List[Dict[str, str]]]]:
+        """
+        取出所有到期的使用者與各自到期的卡片（每人最多 max_cards 張）
+
+        取出的使用者要等 complete() 或 requeue() 之後才會再次排入 heap
+        """
+        now = int(now if now is not None else time.time())
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+                scheduled, user_id = heapq.heappop(self._heap)
+                if self._next_due.get(user_id) != scheduled:
+                    # 使用者的排程已經改變，這是過期的項目
+                    continue
+                del self._next_due[user_id]
+                cards = [
+                    self._words[word_id]
+                    for word_id, card_due, *_ in _CARD.iter_unpack(self._cards[user_id])
+                    if card_due <= now
+                ][:self.max_cards]
+                if cards:
+                    due.append((user_id, cards))
+                else:
+                    self._reschedule(user_id)
+        return due
+
+    def complete(self, user_id, words, quality=4, now=None):
+        """推播成功後以預設品質更新這些卡片；使用者之後回報忘記的字會再以 grade() 重設"""
+        now = int(now if now is not None else time.time())
+        keys = {lemmatize(w['word']) for w in words}
+        with self._lock:
+            cards = self._cards.get(user_id)
+            if not cards:
+                return
+            for offset in range(0, len(cards), _CARD.size):
+                word_id = _CARD.unpack_from(cards, offset)[0]
+                if lemmatize(self._words[word_id]['word']) in keys:
+                    self._grade_at(cards, offset, quality, now)
+            self._save(user_id)
+            self._reschedule(user_id)
+
+    def requeue(self, user_id, delay=300, now=None):
+        """推播失敗時延後 delay 秒再試"""
+        now = int(now if now is not None else time.time())
+        with self._lock:
+            self._next_due[user_id] = now + delay
+            heapq.heappush(self._heap, (now + delay, user_id))
+
+    def deliver_due(self, send: Callable[[str, List[Dict[str, str]]], None], now=None) -> int:
+        """
+        推播所有到期的複習卡片；每位使用者的卡片合併成一次推播
+
+        Args:
+            send: send(user_id, 單字列表)，失敗時拋出例外
+
+        Returns:
+            成功推播的使用者數
+        """
+        delivered = 0
+        for user_id, words in self.pop_due(now):
+            try:
+                send(user_id, words)
+            except Exception as e:
+                logging.error(f"推播複習卡片給 {user_id} 時發生錯誤: {e}")
+                metrics.counter('review_deliveries_total', '複習推播結果', {'result': 'failed'}).inc()
+                self.requeue(user_id, now=now)
+                continue
+            self.complete(user_id, words, now=now)
+            delivered += 1
+            metrics.counter('review_deliveries_total', '複習推播結果', {'result': 'ok'}).inc()
+        return delivered
+
+    def start(self, send, interval=None):
+        """在背景執行緒每 interval 秒（預設讀取 REVIEW_TICK_SECONDS）推播一次到期的複習"""
+        interval = interval or float(os.getenv('REVIEW_TICK_SECONDS', '60'))
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            def run():
+                while not self._stop.wait(interval):
+                    try:
+                        self.deliver_due(send)
+                    except Exception as e:
+                        logging.error(f"複習排程執行時發生錯誤: {e}")
+
+            self._thread = threading.Thread(target=run, name='review-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._cards),
+                'cards': sum(len(cards) for cards in self._cards.values()) // _CARD.size,
+                'words': len(self._words),
+                'heap_size': len(self._heap),
+                'next_due': min(self._next_due.values(), default=None),
+            }
+
+
+def format_review_message(words) -> str:
+    """將到期的複習卡片整理成一則 LINE 文字訊息"""
+    message = f"今日複習（{len(words)} 個單字）：\n"
+    for i, word in enumerate(words, 1):
+        message += f"\n{i}. {word['word']} ({word['part_of_speech']}) - {word['definition']}\n"
+        if word.get('example_sentence'):
+            message += f"eg. {word['example_sentence']}\n"
+    message += "\n想不起來的單字請回覆「忘了 單字」，例如：忘了 " + words[0]['word']
+    return message
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+def get_review_scheduler() -> Optional[ReviewScheduler]:
+    """取得整個 process 共用的複習排程；REVIEW_ENABLED=0 時回傳 None"""
+    global _default_scheduler
+    if os.getenv('REVIEW_ENABLED', '1') != '1':
+        return None
+    if _default_scheduler is None:
+        with _default_scheduler_lock:
+            if _default_scheduler is None:
+                _default_scheduler = ReviewScheduler()
+    return _default_scheduler
@@ -0,0 +1,66 @@
+import threading
+
+import metrics
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    合併同一個 key 的並行請求：第一個呼叫者實際執行，
+    之後在執行期間進來的呼叫者等待並共用同一份結果（或例外）。
+
+    執行結束後 key 立即移除，之後的呼叫會重新執行。
+    """
+
+    def __init__(self, name='default'):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._shared = metrics.counter('single_flight_shared_total', '共用進行中結果的請求數', {'group': name})
+        self._executed = metrics.counter('single_flight_executed_total', '實際執行的請求數', {'group': name})
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        執行 func(*args, **kwargs)，同一個 key 同時只會執行一次
+
+        Returns:
+            (結果, 是否為共用其他請求的結果)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            self._shared.inc()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        self._executed.inc()
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
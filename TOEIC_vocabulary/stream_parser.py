@@ -0,0 +1,88 @@
+import json
+import logging
+from typing import Any, List
+
+
+class IncrementalJSONArrayParser:
+    """
+    逐段餵入模型的串流輸出，每當頂層 JSON 陣列中的一個物件完整結束就立即解析出來
+
+    第一個 '[' 之前的內容（例如 ```json 標記或前言）會被略過；
+    字串中的括號與跳脫字元會正確處理。
+
+    用法:
+        parser = IncrementalJSONArrayParser()
+        for chunk in stream:
+            for obj in parser.feed(chunk):
+                ...
+    """
+
+    def __init__(self):
+        self._buffer = []
+        self._started = False
+        self._finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.items: List[Any] = []
+
+    @property
+    def finished(self):
+        """頂層陣列是否已經結束"""
+        return self._finished
+
+    def feed(self, text) -> List[Any]:
+        """
+        餵入一段新文字
+
+        Returns:
+            這段文字中新完成的物件列表（可能為空）
+        """
+        completed = []
+        for ch in text:
+            if self._finished:
+                break
+            if not self._started:
+                if ch == '[':
+                    self._started = True
+                continue
+
+            if self._depth > 0:
+                self._buffer.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                if self._depth == 0:
+                    self._buffer = [ch]
+                self._depth += 1
+            elif ch in '}]':
+                if self._depth == 0:
+                    # 頂層陣列結束
+                    self._finished = True
+                    continue
+                self._depth -= 1
+                if self._depth == 0:
+                    item = self._parse_buffer()
+                    if item is not None:
+                        completed.append(item)
+                        self.items.append(item)
+        return completed
+
+    def _parse_buffer(self):
+        text = ''.join(self._buffer)
+        self._buffer = []
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
+            logging.warning(f"串流中的 JSON 物件無法解析，已略過: {e}")
+            return None
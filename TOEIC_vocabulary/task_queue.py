@@ -0,0 +1,239 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+from rate_limit import TokenBucket
+
+
+# FairWorkerPool.submit() 拒絕工作的原因
+REJECTED_QUEUE_FULL = 'queue_full'
+REJECTED_USER_QUEUE_FULL = 'user_queue_full'
+REJECTED_RATE_LIMITED = 'rate_limited'
+
+
+class FairWorkerPool:
+    """
+    依使用者公平分配的背景工作池
+
+    每位使用者有自己的子佇列，執行緒以 deficit round-robin 輪流從各子佇列取工作：
+    每輪每位使用者累積 quantum 點額度，工作的 cost 不超過額度才會執行，
+    一位使用者一次丟進 30 個連結也只會輪到自己的那一份，其他使用者不必排在他後面。
+    另外限制每位使用者同時執行的工作數、排隊中的工作數，以及每分鐘可以送出的工作數。
+
+    Args:
+        num_workers: 背景執行緒數量，預設讀取 WORKER_POOL_SIZE
+        max_queue_size: 所有使用者合計的佇列上限，預設讀取 JOB_QUEUE_MAX_SIZE
+        max_inflight_per_user: 每位使用者同時執行的工作上限，預設讀取 JOB_USER_MAX_INFLIGHT
+        max_queued_per_user: 每位使用者排隊中的工作上限，預設讀取 JOB_USER_MAX_QUEUED
+        rate_per_minute: 每位使用者每分鐘可送出的工作數，預設讀取 JOB_USER_RATE_PER_MINUTE；0 代表不限制
+        burst: 每位使用者短時間內最多可連續送出的工作數，預設讀取 JOB_USER_BURST
+        quantum: 每輪累積的額度，預設讀取 JOB_USER_QUANTUM
+        name: 指標與執行緒名稱前綴
+    """
+
+    def __init__(self, num_workers=None, max_queue_size=None, max_inflight_per_user=None, max_queued_per_user=None,
+                 rate_per_minute=None, burst=None, quantum=None, name='worker'):
+        self.num_workers = num_workers or int(os.getenv('WORKER_POOL_SIZE', '4'))
+        self.max_queue_size = max_queue_size or int(os.getenv('JOB_QUEUE_MAX_SIZE', '100'))
+        self.max_inflight_per_user = max_inflight_per_user or int(os.getenv('JOB_USER_MAX_INFLIGHT', '1'))
+        self.max_queued_per_user = max_queued_per_user or int(os.getenv('JOB_USER_MAX_QUEUED', '10'))
+        self.rate_per_minute = (rate_per_minute if rate_per_minute is not None
+                                else float(os.getenv('JOB_USER_RATE_PER_MINUTE', '10')))
+        self.burst = burst or float(os.getenv('JOB_USER_BURST', '5'))
+        self.quantum = quantum or float(os.getenv('JOB_USER_QUANTUM', '1'))
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._queues = {}
+        self._ring = deque()
+        self._deficit = {}
+        self._inflight = {}
+        self._buckets = {}
+        self._depth_value = 0
+        self._threads = []
+        self._started = False
+        self._stopping = False
+
+        labels = {'pool': name}
+        self._depth = metrics.gauge('job_queue_depth', '等待中的工作數', labels)
+        self._busy = metrics.gauge('job_workers_busy', '執行中的工作數', labels)
+        self._users = metrics.gauge('job_queue_users', '有工作在排隊的使用者數', labels)
+        self._accepted = metrics.counter('job_accepted_total', '已接受的工作數', labels)
+        self._rejected = {
+            reason: metrics.counter('job_rejected_total', '被拒絕的工作數', {'pool': name, 'reason': reason})
+            for reason in (REJECTED_QUEUE_FULL, REJECTED_USER_QUEUE_FULL, REJECTED_RATE_LIMITED)
+        }
+        self._failed = metrics.counter('job_failed_total', '執行時拋出例外的工作數', labels)
+        self._wait_time = metrics.histogram('job_wait_seconds', '工作在佇列中等待的時間', labels)
+        self._service_time = metrics.histogram('job_service_seconds', '工作實際執行的時間', labels)
+
+    def start(self):
+        with self._cond:
+            if self._started:
+                return
+            self._stopping = False
+            for i in range(self.num_workers):
+                thread = threading.Thread(target=self._worker_loop, name=f'{self.name}-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+            logging.info(f"已啟動 {self.num_workers} 個背景執行緒，佇列上限 {self.max_queue_size}，"
+                         f"每位使用者同時執行 {self.max_inflight_per_user} 個")
+
+    def queue_depth(self):
+        return self._depth_value
+
+    def _bucket(self, user_id, now):
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                # 閒置到額度補滿的使用者不需要保留
+                idle = self.burst / (self.rate_per_minute / 60)
+                self._buckets = {key: value for key, value in self._buckets.items() if now - value[1] < idle}
+            bucket = (TokenBucket(self.rate_per_minute / 60, self.burst), now)
+        self._buckets[user_id] = (bucket[0], now)
+        return bucket[0]
+
+    def _position(self, user_id):
+        """依輪流順序估算這個工作前面還有幾個工作（包含自己）"""
+        mine = len(self._queues[user_id])
+        return sum(min(len(q), mine) for key, q in self._queues.items() if key != user_id) + mine
+
+    def submit(self, user_id, func, *args, cost=1, **kwargs):
+        """
+        將使用者的工作放入他的子佇列
+
+        Args:
+            cost: 工作的相對成本，例如播放清單可以設成影片數；每輪可以執行的成本由 quantum 決定
+
+        Returns:
+            (位置, None)：位置為估計的排隊順位（1 代表下一個就會被執行）
+            (None, 原因)：被拒絕，原因為 REJECTED_QUEUE_FULL / REJECTED_USER_QUEUE_FULL / REJECTED_RATE_LIMITED
+        """
+        self.start()
+        with self._cond:
+            reason = None
+            queued = self._queues.get(user_id)
+            if self._depth_value >= self.max_queue_size:
+                reason = REJECTED_QUEUE_FULL
+            elif queued is not None and len(queued) >= self.max_queued_per_user:
+                reason = REJECTED_USER_QUEUE_FULL
+            elif self.rate_per_minute > 0 and not self._bucket(user_id, time.monotonic()).try_acquire():
+                reason = REJECTED_RATE_LIMITED
+            if reason is not None:
+                self._rejected[reason].inc()
+                logging.warning(f"拒絕使用者 {user_id} 的工作: {reason}")
+                return None, reason
+
+            if queued is None:
+                queued = self._queues[user_id] = deque()
+                self._ring.append(user_id)
+                self._deficit.setdefault(user_id, 0.0)
+            queued.append((time.monotonic(), cost, func, args, kwargs))
+            self._depth_value += 1
+            self._depth.set(self._depth_value)
+            self._users.set(len(self._queues))
+            self._accepted.inc()
+            position = self._position(user_id)
+            self._cond.notify()
+        return max(position - self._idle_workers(), 1), None
+
+    def _idle_workers(self):
+        return max(self.num_workers - int(self._busy.value), 0)
+
+    def _eligible(self):
+        return any(self._inflight.get(user_id, 0) < self.max_inflight_per_user for user_id in self._ring)
+
+    def _next_job(self):
+        """以 deficit round-robin 選出下一個工作；沒有可執行的工作時回傳 None"""
+        if not self._eligible():
+            return None
+        while True:
+            user_id = self._ring[0]
+            queued = self._queues[user_id]
+            if self._inflight.get(user_id, 0) >= self.max_inflight_per_user:
+                self._ring.rotate(-1)
+                continue
+            cost = queued[0][1]
+            if self._deficit[user_id] < cost:
+                self._deficit[user_id] += self.quantum
+                if self._deficit[user_id] < cost:
+                    self._ring.rotate(-1)
+                    continue
+            job = queued.popleft()
+            self._deficit[user_id] -= cost
+            self._inflight[user_id] = self._inflight.get(user_id, 0) + 1
+            if not queued:
+                # 子佇列清空後離開輪替，剩下的額度不保留
+                self._ring.popleft()
+                del self._queues[user_id]
+                del self._deficit[user_id]
+            elif self._deficit[user_id] < queued[0][1]:
+                self._ring.rotate(-1)
+            self._depth_value -= 1
+            return user_id, job
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                picked = self._next_job()
+                while picked is None:
+                    if self._stopping and not self._queues:
+                        return
+                    self._cond.wait()
+                    picked = self._next_job()
+                self._depth.set(self._depth_value)
+                self._users.set(len(self._queues))
+            user_id, (enqueued_at, _, func, args, kwargs) = picked
+            started_at = time.monotonic()
+            self._wait_time.observe(started_at - enqueued_at)
+            self._busy.inc()
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                self._failed.inc()
+                logging.error(f"背景工作執行失敗: {e}")
+            finally:
+                self._busy.dec()
+                self._service_time.observe(time.monotonic() - started_at)
+                with self._cond:
+                    self._inflight[user_id] -= 1
+                    if not self._inflight[user_id]:
+                        del self._inflight[user_id]
+                    self._cond.notify_all()
+
+    def stats(self):
+        """回傳佇列深度、使用者數、等待時間與執行時間的摘要"""
+        with self._cond:
+            users = len(self._queues)
+            running_users = len(self._inflight)
+        return {
+            'workers': self.num_workers,
+            'max_queue_size': self.max_queue_size,
+            'queue_depth': self._depth_value,
+            'queued_users': users,
+            'running_users': running_users,
+            'busy_workers': self._busy.value,
+            'accepted': self._accepted.value,
+            'rejected': {reason: counter.value for reason, counter in self._rejected.items()},
+            'failed': self._failed.value,
+            'wait_seconds': self._wait_time.snapshot(),
+            'service_seconds': self._service_time.snapshot(),
+        }
+
+    def shutdown(self, wait=True):
+        """送出停止訊號給所有執行緒；已在佇列中的工作會先執行完"""
+        with self._cond:
+            if not self._started:
+                return
+            self._stopping = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        with self._cond:
+            self._threads = []
+            self._started = False
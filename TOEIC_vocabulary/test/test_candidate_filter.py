@@ -0,0 +1,35 @@
+from candidate_filter import select_candidates, format_candidates
+
+def test_select_candidates_drops_common_words_and_boosts_keywords():
+    transcript = (
+        "So yeah we actually really need to think about the budget. "
+        "The budgets for marketing are tight and the deadline is next week. "
+        "Honestly the photographer took amazing photographs, amazing photographs."
+    )
+    candidates = select_candidates(transcript, keywords=['marketing'], top_n=5)
+    words = [c['word'] for c in candidates]
+
+    assert 'yeah' not in words and 'really' not in words
+    # budget 出現兩次（含複數）且是商務詞彙，應排在最前面
+    assert words[0] == 'budget'
+    assert candidates[0]['count'] == 2
+    # 送給模型的是字幕中的寫法，原形只用來合併
+    assert 'marketing' in words
+    assert candidates[0]['lemma'] == 'budget'
+    assert len(words) == 5
+    assert all(c['contexts'] for c in candidates)
+
+def test_format_candidates_is_one_line_per_word():
+    text = format_candidates([{'word': 'budget', 'count': 2, 'contexts': ['the budget is', 'tight budgets for']}])
+    assert text == "- budget: the budget is | tight budgets for"
+
+def test_candidates_use_most_frequent_surface_form():
+    transcript = "The board decided to expand. They decided quickly, and the manager decides budgets. Proposed changes."
+    candidates = select_candidates(transcript, top_n=10)
+    by_lemma = {c['lemma']: c for c in candidates}
+    assert by_lemma['decide']['word'] == 'decided'
+    assert by_lemma['decide']['count'] == 3
+    assert by_lemma['propose']['word'] == 'proposed'
+    text = format_candidates(candidates, {'decide': {'example_sentence': 'We decide today.'}})
+    assert '- decided [known]:' in text
+    assert 'decid ' not in text and 'propos ' not in text
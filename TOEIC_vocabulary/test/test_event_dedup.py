@@ -0,0 +1,47 @@
+from unittest.mock import patch
+from event_dedup import EventDeduplicator
+
+def test_duplicates_within_window_are_detected():
+    dedup = EventDeduplicator(window_seconds=60, max_entries=10)
+    assert not dedup.seen_before('evt-1')
+    assert dedup.seen_before('evt-1')
+    assert not dedup.seen_before('evt-2')
+
+def test_event_ids_expire_after_window():
+    dedup = EventDeduplicator(window_seconds=60, max_entries=10)
+    with patch('event_dedup.time.time', return_value=1000.0):
+        assert not dedup.seen_before('evt-1')
+    with patch('event_dedup.time.time', return_value=1059.0):
+        assert dedup.seen_before('evt-1')
+    with patch('event_dedup.time.time', return_value=1061.0):
+        assert not dedup.seen_before('evt-1')
+
+def test_oldest_entries_are_evicted_at_max_entries():
+    dedup = EventDeduplicator(window_seconds=60, max_entries=2)
+    for event_id in ('evt-1', 'evt-2', 'evt-3'):
+        assert not dedup.seen_before(event_id)
+    # evt-1 被擠出，evt-3 仍在
+    assert dedup.seen_before('evt-3')
+    assert not dedup.seen_before('evt-1')
+
+def test_forget_allows_reprocessing():
+    dedup = EventDeduplicator(window_seconds=60, max_entries=10)
+    assert not dedup.seen_before('evt-1')
+    dedup.forget('evt-1')
+    assert not dedup.seen_before('evt-1')
+    assert dedup.seen_before('evt-1')
+
+def test_missing_event_id_is_never_a_duplicate():
+    dedup = EventDeduplicator(window_seconds=60, max_entries=10)
+    assert not dedup.seen_before(None)
+    assert not dedup.seen_before(None)
+    dedup.forget(None)
+
+def test_sqlite_mode_shares_records(tmp_path):
+    db_path = str(tmp_path / 'events.db')
+    first = EventDeduplicator(window_seconds=60, db_path=db_path)
+    second = EventDeduplicator(window_seconds=60, db_path=db_path)
+    assert not first.seen_before('evt-1')
+    assert second.seen_before('evt-1')
+    second.forget('evt-1')
+    assert not first.seen_before('evt-1')
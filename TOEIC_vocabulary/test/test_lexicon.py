@@ -0,0 +1,28 @@
+from lexicon import Lexicon
+
+def test_seed_and_lookup_by_lemma_and_pos(tmp_path):
+    seed = tmp_path / 'seed.tsv'
+    seed.write_text("# comment\nbudget\tn.\ta plan for spending\nestimate\tverb\tto guess a value\n"
+                    "estimate\tnoun\tan approximate cost\tThe estimate was high.\n", encoding='utf-8')
+    lexicon = Lexicon(db_path=str(tmp_path / 'lexicon.db'), seed_path=str(seed))
+
+    assert lexicon.size() == 3
+    assert lexicon.lookup('budgets')['part_of_speech'] == 'noun'
+    assert lexicon.lookup('estimate', 'noun')['example_sentence'] == 'The estimate was high.'
+    assert lexicon.lookup('estimated', 'verb')['definition'] == 'to guess a value'
+    assert lexicon.lookup('invoice') is None
+
+def test_record_keeps_definition_and_fills_missing_fields(tmp_path):
+    lexicon = Lexicon(db_path=str(tmp_path / 'lexicon.db'), seed_path=str(tmp_path / 'missing.tsv'))
+    lexicon.record([{"word": "deadline", "definition": "a time limit", "part_of_speech": "noun", "example_sentence": None}])
+    lexicon.record([{"word": "deadlines", "definition": "another wording", "part_of_speech": "Noun",
+                     "example_sentence": "Deadlines matter."}])
+
+    entry = lexicon.lookup('deadline')
+    assert entry['definition'] == 'a time limit'
+    assert entry['example_sentence'] == 'Deadlines matter.'
+
+    item = {"word": "deadline", "example_sentence": "The deadline is Friday."}
+    assert lexicon.fill(item)
+    assert item == {"word": "deadline", "example_sentence": "The deadline is Friday.",
+                    "definition": "a time limit", "part_of_speech": "noun"}
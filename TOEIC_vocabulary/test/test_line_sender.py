@@ -0,0 +1,85 @@
+import threading
+import pytest
+from unittest.mock import MagicMock
+from line_sender import LineSender
+from rate_limit import TokenBucket
+
+class ApiError(Exception):
+    def __init__(self, status, headers=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.headers = headers or {}
+
+FACTORY = (lambda token, messages: ('reply', token, list(messages)),
+           lambda to, messages: ('push', to, list(messages)))
+
+def _sender(api, **kwargs):
+    kwargs.setdefault('backoff', 0.001)
+    return LineSender(api, rate=1000, request_factory=FACTORY, **kwargs)
+
+def test_token_bucket_refills_and_pauses():
+    now = [0.0]
+    bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0])
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert bucket.wait_time() == 0.5
+    now[0] = 0.5
+    assert bucket.try_acquire()
+    bucket.pause(3)
+    now[0] = 3.0
+    assert not bucket.try_acquire()
+    now[0] = 5.0
+    assert bucket.try_acquire() and bucket.try_acquire() and not bucket.try_acquire()
+
+def test_reply_then_push_in_full_batches():
+    api = MagicMock()
+    _sender(api).deliver('U1', list(range(12)), reply_token='R')
+    assert api.reply_message.call_args.args[0] == ('reply', 'R', [0, 1, 2, 3, 4])
+    assert [c.args[0] for c in api.push_message.call_args_list] == [('push', 'U1', [5, 6, 7, 8, 9]), ('push', 'U1', [10, 11])]
+
+def test_expired_reply_token_falls_back_to_push():
+    api = MagicMock()
+    api.reply_message.side_effect = ApiError(400)
+    _sender(api).deliver('U1', ['a', 'b'], reply_token='R')
+    assert api.push_message.call_args.args[0] == ('push', 'U1', ['a', 'b'])
+
+def test_transient_errors_retry_with_same_retry_key():
+    api = MagicMock()
+    api.push_message.side_effect = [ApiError(500), ApiError(429, {'Retry-After': '0.01'}), None]
+    _sender(api).deliver('U1', ['a'])
+    keys = {c.kwargs['x_line_retry_key'] for c in api.push_message.call_args_list}
+    assert api.push_message.call_count == 3 and len(keys) == 1
+
+    api = MagicMock()
+    api.push_message.side_effect = ApiError(403)
+    with pytest.raises(ApiError):
+        _sender(api).deliver('U1', ['a'])
+    assert api.push_message.call_count == 1
+
+def test_only_connection_errors_are_retried_without_status():
+    api = MagicMock()
+    api.push_message.side_effect = [ConnectionResetError('reset'), TimeoutError('slow'), None]
+    _sender(api).deliver('U1', ['a'])
+    assert api.push_message.call_count == 3
+
+    api = MagicMock()
+    api.push_message.side_effect = TypeError('bad argument')
+    with pytest.raises(TypeError):
+        _sender(api).deliver('U1', ['a'])
+    assert api.push_message.call_count == 1
+
+def test_pending_messages_for_a_user_are_coalesced():
+    api = MagicMock()
+    started, gate = threading.Event(), threading.Event()
+    api.push_message.side_effect = lambda *args, **kwargs: (started.set(), gate.wait(5))
+    sender = _sender(api, num_workers=1)
+    sender.send('U1', ['first'])
+    assert started.wait(5)
+    # 第一批送出期間排入的訊息會合併成同一次呼叫
+    for i in range(6):
+        sender.send('U1', [f'm{i}'])
+    gate.set()
+    assert sender.flush(timeout=5)
+    batches = [c.args[0][2] for c in api.push_message.call_args_list]
+    assert batches[0] == ['first']
+    assert batches[1:] == [['m0', 'm1', 'm2', 'm3', 'm4'], ['m5']]
@@ -0,0 +1,84 @@
+import os
+from unittest.mock import patch
+from llm_backends import LLMBackend, OllamaBackend, StubBackend, get_backend, register_backend
+
+class FlakyBackend(LLMBackend):
+    name = 'flaky'
+
+    def __init__(self, failures, error):
+        super().__init__(default_model='flaky', max_concurrency=1, max_retries=2)
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def _chat(self, model, messages, options, format, keep_alive):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return {'content': 'ok', 'model': model, 'raw': None}
+
+def test_transient_errors_are_retried():
+    backend = FlakyBackend(failures=2, error=ConnectionError('refused'))
+    with patch('llm_backends.time.sleep') as sleep:
+        assert backend.chat([{"role": "user", "content": "hi"}])['content'] == 'ok'
+    assert backend.calls == 3
+    assert sleep.call_count == 2
+
+def test_non_transient_errors_are_not_retried():
+    backend = FlakyBackend(failures=1, error=ValueError('bad request'))
+    try:
+        backend.chat([{"role": "user", "content": "hi"}])
+        assert False, 'should raise'
+    except ValueError:
+        pass
+    assert backend.calls == 1
+
+def test_registered_stub_backend_is_shared():
+    stub = StubBackend(responder=lambda messages: messages[-1]['content'].upper())
+    register_backend('bench', stub)
+    assert get_backend('bench') is stub
+    assert get_backend('bench').chat([{"role": "user", "content": "ping"}])['content'] == 'PING'
+
+def test_ollama_usage_and_num_ctx_sizing():
+    backend = OllamaBackend(default_model='usage-test', max_retries=0)
+    backend.min_ctx, backend.max_ctx, backend.output_token_budget = 2048, 8192, 1024
+    response = {
+        'message': {'content': '[]'},
+        'prompt_eval_count': 1800, 'eval_count': 200,
+        'prompt_eval_duration': 2 * 10 ** 9, 'eval_duration': 4 * 10 ** 9,
+    }
+    long_prompt = [{"role": "system", "content": "word " * 2000}]
+    with patch('ollama.Client.chat', return_value=response) as chat:
+        result = backend.chat(long_prompt)
+    # 約 2600 tokens 的提示詞加 1024 輸出預算 → 4096
+    assert chat.call_args.kwargs['options']['num_ctx'] == 4096
+    assert result['usage']['prompt_tokens'] == 1800
+    assert result['usage']['tokens_per_second'] == 50
+
+    # 呼叫端指定的 num_ctx 不會被覆寫
+    with patch('ollama.Client.chat', return_value=response) as chat:
+        backend.chat([{"role": "user", "content": "hi"}], options={'num_ctx': 1024})
+    assert chat.call_args.kwargs['options']['num_ctx'] == 1024
+    assert backend.num_ctx_for([{"role": "user", "content": "hi"}]) == 2048
+
+def test_ollama_requests_have_a_default_timeout():
+    env = {key: value for key, value in os.environ.items() if key != 'OLLAMA_TIMEOUT'}
+    with patch.dict('os.environ', env, clear=True), patch('ollama.Client') as client:
+        backend = OllamaBackend(default_model='timeout-test')
+    assert backend.timeout == 300
+    assert client.call_args.kwargs['timeout'] == 300
+    assert backend._api() is client.return_value
+
+def test_preload_uses_the_same_num_ctx_as_requests():
+    backend = OllamaBackend(default_model='preload-ctx', max_retries=0)
+    backend.min_ctx, backend.max_ctx, backend.output_token_budget = 2048, 8192, 1024
+    with patch('ollama.Client.generate', return_value={'load_duration': 0}) as generate:
+        backend.preload()
+    assert generate.call_args.kwargs['options'] == {'num_ctx': 2048}
+
+    response = {'message': {'content': '[]'}}
+    with patch('ollama.Client.chat', return_value=response) as chat, \
+         patch('ollama.Client.generate', return_value={'load_duration': 0}) as generate:
+        backend.chat([{"role": "system", "content": "word " * 2000}])
+        backend.preload()
+    assert generate.call_args.kwargs['options']['num_ctx'] == chat.call_args.kwargs['options']['num_ctx'] == 4096
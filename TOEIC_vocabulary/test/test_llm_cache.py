@@ -0,0 +1,27 @@
+from llm_cache import LLMResponseCache, make_cache_key
+
+WORDS = [{"word": "budget", "definition": "an amount of money available", "part_of_speech": "noun"}]
+
+def test_memory_cache_returns_copies():
+    cache = LLMResponseCache(max_entries=10)
+    key = make_cache_key('gemma3', [{'role': 'user', 'content': 'hi'}], {'temperature': 0})
+    words = [dict(w) for w in WORDS]
+    cache.set(key, 'raw', words)
+    # 寫入後修改原本的列表不影響快取
+    words[0]['word'] = 'changed'
+
+    cached = cache.get(key)
+    assert cached['parsed'] == WORDS
+    # 修改讀出的結果也不影響下一次讀取
+    cached['parsed'][0]['word'] = 'changed'
+    cached['parsed'].append({'word': 'extra'})
+    assert cache.get(key)['parsed'] == WORDS
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = LLMResponseCache(max_entries=2)
+    cache.set('a', 'A')
+    cache.set('b', 'B')
+    assert cache.get('a') is not None
+    cache.set('c', 'C')
+    assert cache.get('b') is None
+    assert cache.get('a')['raw'] == 'A' and cache.get('c')['raw'] == 'C'
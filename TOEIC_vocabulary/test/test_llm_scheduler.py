@@ -0,0 +1,40 @@
+import threading
+import time
+from llm_scheduler import LLMScheduler, INTERACTIVE, BATCH
+
+def test_batch_waits_while_interactive_is_queued():
+    scheduler = LLMScheduler(2, name='test_priority')
+    order = []
+
+    # 佔滿兩個名額
+    assert scheduler.acquire(INTERACTIVE)
+    assert scheduler.acquire(INTERACTIVE)
+
+    def run(priority):
+        with scheduler.slot(priority):
+            order.append(priority)
+
+    batch = threading.Thread(target=run, args=(BATCH,))
+    batch.start()
+    while scheduler.stats()[BATCH]['waiting'] < 1:
+        time.sleep(0.001)
+    interactive = threading.Thread(target=run, args=(INTERACTIVE,))
+    interactive.start()
+    while scheduler.stats()[INTERACTIVE]['waiting'] < 1:
+        time.sleep(0.001)
+
+    # 釋放一個名額：即使批次先到，也應該先放行互動請求
+    scheduler.release(INTERACTIVE)
+    interactive.join(timeout=5)
+    assert order == [INTERACTIVE]
+
+    scheduler.release(INTERACTIVE)
+    batch.join(timeout=5)
+    assert order == [INTERACTIVE, BATCH]
+
+def test_batch_limit_keeps_a_slot_for_interactive():
+    scheduler = LLMScheduler(3, class_limits={BATCH: 2}, name='test_limit')
+    assert scheduler.acquire(BATCH)
+    assert scheduler.acquire(BATCH)
+    assert not scheduler.acquire(BATCH, timeout=0.01)
+    assert scheduler.acquire(INTERACTIVE, timeout=0.01)
@@ -0,0 +1,79 @@
+from unittest.mock import patch
+import metrics
+from llm_backends import OllamaBackend
+from model_lifecycle import ModelLifecycleManager, get_model_lifecycle
+
+class FakeOllama:
+    name = 'ollama'
+    default_model = 'gemma3'
+    keep_alive = '30m'
+
+    def __init__(self):
+        self.loaded = {}
+        self.preloads = []
+        self.last_request_at = None
+
+    def preload(self, model, keep_alive=None):
+        self.preloads.append((model, keep_alive))
+        cold = model not in self.loaded
+        self.loaded[model + ':latest'] = 'soon'
+        return 12.0 if cold else 0.0
+
+    def running_models(self):
+        return dict(self.loaded)
+
+def test_preload_then_refresh_only_while_traffic_is_active():
+    backend = FakeOllama()
+    manager = ModelLifecycleManager(backend=backend, refresh_interval=60, active_window=60, reload_when_idle=False)
+    manager.preload_all()
+    assert manager.probe()['models']['gemma3']['resident']
+    assert backend.preloads == [('gemma3', '30m')]
+
+    # 沒有流量：不刷新 keep_alive
+    manager.refresh()
+    assert len(backend.preloads) == 1
+
+    # 有流量：刷新 keep_alive
+    backend.last_request_at = 10 ** 12
+    manager.refresh()
+    assert len(backend.preloads) == 2
+
+def test_evicted_model_is_reloaded_when_idle():
+    backend = FakeOllama()
+    manager = ModelLifecycleManager(backend=backend, refresh_interval=60, active_window=60, reload_when_idle=True)
+    manager.refresh()
+    assert backend.preloads == [('gemma3', '30m')]
+    assert manager.health()['models']['gemma3']['last_load_seconds'] == 12.0
+
+def test_health_before_first_probe_and_for_other_backends():
+    backend = FakeOllama()
+    manager = ModelLifecycleManager(backend=backend, refresh_interval=60)
+    # 還沒檢查過不算失敗
+    assert manager.health()['healthy']
+
+    def unreachable():
+        raise ConnectionError('refused')
+
+    backend.running_models = unreachable
+    assert not manager.probe()['healthy']
+
+    # 單字萃取不使用 Ollama 時不建立生命週期管理器，/health 也不檢查 Ollama
+    with patch.dict('os.environ', {'OLLAMA_PRELOAD': '1', 'EXTRACTION_LLM_BACKEND': 'gemini'}):
+        assert get_model_lifecycle() is None
+    with patch.dict('os.environ', {'OLLAMA_PRELOAD': '1', 'EXTRACTION_LLM_BACKEND': '', 'LLM_BACKEND': 'gemini'}):
+        assert get_model_lifecycle() is None
+
+def test_ollama_backend_records_cold_and_warm_requests():
+    backend = OllamaBackend(default_model='lifecycle-test', max_retries=0, keep_alive='10m')
+    responses = iter([
+        {'message': {'content': 'a'}, 'load_duration': 15 * 10 ** 9},
+        {'message': {'content': 'b'}, 'load_duration': 1000},
+    ])
+    with patch('ollama.Client.chat', side_effect=lambda **kwargs: next(responses)) as chat:
+        backend.chat([{"role": "user", "content": "hi"}])
+        backend.chat([{"role": "user", "content": "hi"}])
+    assert chat.call_args.kwargs['keep_alive'] == '10m'
+    labels = {'backend': 'ollama', 'model': 'lifecycle-test'}
+    assert metrics.histogram('llm_model_request_seconds', labels={**labels, 'load': 'cold'}).count == 1
+    assert metrics.histogram('llm_model_request_seconds', labels={**labels, 'load': 'warm'}).count == 1
+    assert metrics.counter('llm_model_cold_starts_total', labels=labels).value == 1
@@ -0,0 +1,26 @@
+from model_router import ModelRoute, ModelRouter
+
+def _router():
+    return ModelRouter([
+        ModelRoute('small', max_input_tokens=1000, p95_budget=10),
+        ModelRoute('large', max_input_tokens=8000, p95_budget=30),
+    ], window=10, min_samples=3, cooldown=60, name='test')
+
+def test_routes_by_input_size():
+    router = _router()
+    assert router.candidates(300) == ['small', 'large']
+    assert router.candidates(5000) == ['large']
+    # 超過所有上限時仍交給最大的模型
+    assert router.candidates(50000) == ['large']
+
+def test_falls_back_when_p95_exceeds_budget():
+    router = _router()
+    for _ in range(3):
+        router.record('small', 25.0)
+    assert router.choose(300) == 'large'
+    assert router.stats()['small']['demoted']
+
+    # 兩個模型都超過預算時選 p95 較低的
+    for _ in range(3):
+        router.record('large', 40.0)
+    assert router.choose(300) == 'small'
@@ -1,7 +1,24 @@
 import pytest
 import json
-from unittest.mock import patch
-from model_utils import extract_toeic_words_with_ollama
+from unittest.mock import MagicMock, patch
+from model_utils import (extract_toeic_words_with_ollama, extract_toeic_words_chunked, parse_words_response,
+                         stream_toeic_words_with_ollama, StreamIncompleteError)
+from lexicon import Lexicon
+
+@pytest.fixture(autouse=True)
+def no_shared_lexicon(request):
+    # 不讓測試讀寫工作目錄下的 lexicon.db；需要單字庫的測試自行建立
+    if 'lexicon' in request.fixturenames:
+        yield
+        return
+    with patch('model_utils.get_lexicon', return_value=None):
+        yield
+
+@pytest.fixture
+def lexicon(tmp_path):
+    store = Lexicon(db_path=str(tmp_path / 'lexicon.db'), seed_path=str(tmp_path / 'missing.tsv'))
+    with patch('model_utils.get_lexicon', return_value=store):
+        yield store
 
 def test_extract_toeic_words_with_ollama():
     # 準備 mock 的 ollama.chat 回傳內容
@@ -25,11 +42,194 @@ def test_extract_toeic_words_with_ollama():
         }
     }
 
-    with patch('ollama.chat', return_value=mock_response):
+    with patch('ollama.Client.chat', return_value=mock_response):
         transcript = "This is a test transcript for TOEIC vocabulary extraction."
         words = extract_toeic_words_with_ollama(transcript)
         assert isinstance(words, list)
         assert len(words) == 2
         assert words[0]['word'] == "iteration"
         assert words[1]['word'] == "sandbox"
-        assert 'example_sentence' in words[0] 
\ No newline at end of file
+        assert 'example_sentence' in words[0] 
+
+def test_extract_toeic_words_chunked_merges_by_lemma():
+    # 每一段回傳的候選單字，其中 budgets / budget 應合併為同一個字
+    chunk_responses = [
+        [{"word": "budget", "definition": "a plan for spending", "part_of_speech": "noun", "example_sentence": "We set a budget."}],
+        [{"word": "budgets", "definition": "plans for spending", "part_of_speech": "noun", "example_sentence": "Budgets are tight."},
+         {"word": "deadline", "definition": "a time limit", "part_of_speech": "noun", "example_sentence": "The deadline is Friday."}],
+    ]
+    responses = iter(chunk_responses)
+
+    def fake_chat(model, messages, options, **kwargs):
+        return {'message': {'content': json.dumps(next(responses, []))}}
+
+    transcript = "The budget was approved. " + "We missed the deadline again and again. " * 3
+    with patch('model_utils._chunk_executor.submit', side_effect=lambda fn, *args: _Done(fn(*args))), \
+         patch('ollama.Client.chat', side_effect=fake_chat):
+        words = extract_toeic_words_chunked(transcript, num_words=5, chunk_tokens=10)
+
+    assert [w['word'] for w in words] == ["budget", "deadline"]
+
+
+def test_long_transcript_is_chunked_with_prefiltered_candidates():
+    responses = iter([
+        [{"word": "invoice", "definition": "a bill", "part_of_speech": "noun", "example_sentence": "Send the invoice."}],
+        [{"word": "invoices", "definition": "bills", "part_of_speech": "noun", "example_sentence": "Invoices are due."},
+         {"word": "warehouse", "definition": "a storage building", "part_of_speech": "noun",
+          "example_sentence": "The warehouse is full."}],
+    ])
+    prompts = []
+
+    def fake_chat(model, messages, options, **kwargs):
+        prompts.append(messages[0]['content'])
+        return {'message': {'content': json.dumps(next(responses, []))}}
+
+    transcript = "Please send the invoice to accounting. " * 3 + "The warehouse shipment arrived late. " * 3
+    with patch('model_utils.CHUNK_TOKENS', 30), \
+         patch('model_utils._chunk_executor.submit', side_effect=lambda fn, *args: _Done(fn(*args))), \
+         patch('ollama.Client.chat', side_effect=fake_chat):
+        words = extract_toeic_words_with_ollama(transcript, num_words=5)
+
+    # 預設開啟預先過濾時，長字幕仍走分段流程，每段只送候選單字
+    assert len(prompts) >= 2
+    assert all('candidate words' in prompt and transcript not in prompt for prompt in prompts)
+    assert [w['word'] for w in words] == ["invoice", "warehouse"]
+
+
+class _Done:
+    """同步執行的 future，讓測試中各段的呼叫順序固定"""
+    def __init__(self, value):
+        self._value = value
+
+    def result(self):
+        return self._value
+
+
+def test_identical_calls_hit_llm_cache():
+    mock_json = [{"word": "invoice", "definition": "a bill", "part_of_speech": "noun", "example_sentence": "Please send the invoice."}]
+    mock_response = {'message': {'content': json.dumps(mock_json)}}
+    transcript = "The supplier sent the invoice late, so the invoice was paid late."
+
+    with patch('ollama.Client.chat', return_value=mock_response) as chat:
+        first = extract_toeic_words_with_ollama(transcript)
+        second = extract_toeic_words_with_ollama(transcript)
+
+    assert first == second == mock_json
+    assert chat.call_count == 1
+
+
+def test_parse_words_response_repairs_prose_and_trailing_commas():
+    text = 'Here are your words:\n```json\n[{"word": "Budget", "definition": "a plan", "part_of_speech": "Noun", "example_sentence": "Fine.",},]\n```'
+    words, error, repaired = parse_words_response(text)
+    assert error is None and repaired
+    assert words == [{"word": "Budget", "definition": "a plan", "part_of_speech": "noun", "example_sentence": "Fine."}]
+
+
+def test_truncated_output_is_salvaged_and_missing_words_are_reasked():
+    first = '[{"word": "audit", "definition": "an inspection", "part_of_speech": "noun", "example_sentence": "The audit ended."}, {"word": "lea'
+    second = json.dumps([{"word": "lease", "definition": "a rental contract", "part_of_speech": "noun", "example_sentence": "We signed a lease."}])
+    responses = iter([first, second])
+
+    with patch('ollama.Client.chat', side_effect=lambda **kwargs: {'message': {'content': next(responses)}}) as chat:
+        words = extract_toeic_words_with_ollama("The annual audit covered the office lease agreement.", num_words=2)
+
+    assert [w['word'] for w in words] == ["audit", "lease"]
+    assert chat.call_count == 2
+
+def test_known_words_are_filled_from_lexicon(lexicon):
+    lexicon.record([{"word": "budget", "definition": "a plan for spending", "part_of_speech": "noun",
+                     "example_sentence": "We set a budget."}])
+    # 單字庫已有 budget，模型只回傳字本身；reimburse 則需要完整欄位
+    mock_json = [
+        {"word": "budget"},
+        {"word": "reimburse", "definition": "to pay back", "part_of_speech": "verb",
+         "example_sentence": "We will reimburse your costs."},
+    ]
+    transcript = "The budget covers travel. We reimburse the budget overruns. The budget is tight."
+    with patch('ollama.Client.chat', return_value={'message': {'content': json.dumps(mock_json)}}) as chat:
+        words = extract_toeic_words_with_ollama(transcript, num_words=2, prefilter=True)
+
+    prompt = chat.call_args.kwargs['messages'][0]['content']
+    assert '- budget [known]' in prompt
+    assert chat.call_args.kwargs['format']['items']['required'] == ['word']
+    assert words[0] == {"word": "budget", "definition": "a plan for spending", "part_of_speech": "noun",
+                        "example_sentence": "We set a budget."}
+    # 新的字寫回單字庫
+    assert lexicon.lookup('reimburse')['definition'] == "to pay back"
+
+def _stream_chunks(*parts, error=None):
+    def chat(**kwargs):
+        assert kwargs['stream'] is True
+        for part in parts:
+            yield {'message': {'content': part}}
+        if error is not None:
+            raise error
+    return chat
+
+def test_interrupted_stream_raises_and_is_not_cached():
+    first = json.dumps({"word": "tariff", "definition": "a tax on imports", "part_of_speech": "noun",
+                        "example_sentence": "The tariff rose."})
+    transcript = "The new tariff on imported steel raised the tariff burden."
+    received = []
+    with patch('ollama.Client.chat', side_effect=_stream_chunks('[' + first + ',', error=ConnectionError("reset"))):
+        with pytest.raises(StreamIncompleteError):
+            for word in stream_toeic_words_with_ollama(transcript, prefilter=False):
+                received.append(word)
+    assert [w['word'] for w in received] == ["tariff"]
+
+    # 中斷的結果沒有寫入快取，下一次會重新呼叫模型
+    complete = json.dumps([json.loads(first)])
+    with patch('ollama.Client.chat', side_effect=_stream_chunks(complete)) as chat:
+        words = list(stream_toeic_words_with_ollama(transcript, prefilter=False))
+    assert chat.call_count == 1 and [w['word'] for w in words] == ["tariff"]
+
+def test_stream_cut_short_without_error_is_incomplete():
+    partial = '[{"word": "quota", "definition": "a fixed share", "part_of_speech": "noun", "example_sentence": "We met the quota."}'
+    with patch('ollama.Client.chat', side_effect=_stream_chunks(partial)):
+        with pytest.raises(StreamIncompleteError):
+            list(stream_toeic_words_with_ollama("Sales met the quarterly quota.", prefilter=False))
+
+def test_streamed_known_words_are_filled_before_caching(lexicon):
+    lexicon.record([{"word": "budget", "definition": "a plan for spending", "part_of_speech": "noun",
+                     "example_sentence": "We set a budget."}])
+    mock_json = json.dumps([
+        {"word": "budget"},
+        {"word": "reimburse", "definition": "to pay back", "part_of_speech": "verb",
+         "example_sentence": "We will reimburse your costs."},
+    ])
+    transcript = "The budget covers travel costs. We reimburse travel from the budget. The budget is tight."
+    cache = MagicMock()
+    cache.get.return_value = None
+    with patch('ollama.Client.chat', side_effect=_stream_chunks(mock_json)), \
+         patch('model_utils.get_llm_cache', return_value=cache):
+        streamed = list(stream_toeic_words_with_ollama(transcript, num_words=2, prefilter=True))
+    # 快取存的是實際送出、已由單字庫補齊欄位的單字
+    cached_words = cache.set.call_args.args[2]
+    assert cached_words == streamed
+    assert [w['word'] for w in streamed] == ["budget", "reimburse"]
+    assert streamed[0]['definition'] == "a plan for spending"
+
+def test_fallback_model_response_is_cached_under_its_own_model(tmp_path):
+    from llm_cache import LLMResponseCache
+    mock_json = [{"word": "invoice", "definition": "a bill", "part_of_speech": "noun",
+                  "example_sentence": "Send the invoice."}]
+    failing = {'primary'}
+
+    def chat(**kwargs):
+        if kwargs['model'] in failing:
+            raise ValueError(f"{kwargs['model']} failed")
+        return {'message': {'content': json.dumps(mock_json)}}
+
+    def extract(models):
+        with patch('model_utils._route_models', return_value=(MagicMock(), models)), \
+             patch('ollama.Client.chat', side_effect=chat) as mocked:
+            words = extract_toeic_words_with_ollama("Please send the invoice today.", prefilter=False)
+        assert [w['word'] for w in words] == ["invoice"]
+        return [call.kwargs['model'] for call in mocked.call_args_list]
+
+    with patch('model_utils.get_llm_cache', return_value=LLMResponseCache(max_entries=10)):
+        assert extract(['primary', 'fallback']) == ['primary', 'fallback']
+        # 備用模型的回答不會被當成首選模型的快取結果
+        failing.clear()
+        assert extract(['primary', 'fallback']) == ['primary']
+        assert extract(['fallback', 'primary']) == []
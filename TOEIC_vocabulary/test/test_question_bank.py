@@ -0,0 +1,87 @@
+import json
+from unittest.mock import patch
+from llm_backends import StubBackend
+from question_bank import QuestionBank
+from quiz_generator import generate_toeic_quiz
+
+def _question(text, word='budget'):
+    return {"question": text, "options": {"A": "a", "B": "b", "C": "c", "D": "d"},
+            "correct_answer": "A", "explanation": "x", "word": word, "part_of_speech": "noun"}
+
+def test_dedup_and_per_user_usage(tmp_path):
+    bank = QuestionBank(db_path=str(tmp_path / 'bank.db'))
+    assert bank.add([_question("We are over _____."), _question("We  are over _____. ")]) == 1
+    bank.add([_question("Set a _____ first.")])
+    assert bank.size() == 2
+
+    first = bank.draw('budgets', 'n.', limit=1, user_id='U1')
+    bank.mark_served(first, 'U1')
+    second = bank.draw('budget', 'noun', limit=5, user_id='U1')
+    assert [q['question'] for q in second] != [q['question'] for q in first]
+    assert len(second) == 1
+    # 其他使用者仍然可以拿到所有題目，較少使用的題目排在前面
+    assert [q['question'] for q in bank.draw('budget', limit=5, user_id='U2')][0] == second[0]['question']
+
+def test_quiz_is_assembled_from_bank_before_generating(tmp_path):
+    bank = QuestionBank(db_path=str(tmp_path / 'bank.db'))
+    bank.add([_question(f"Budget question {i}") for i in range(2)])
+    bank.add([_question(f"Deadline question {i}", word='deadline') for i in range(2)])
+    words = [{"word": w, "definition": "d", "part_of_speech": "noun", "example_sentence": "e"}
+             for w in ("budget", "deadline")]
+
+    def responder(messages):
+        raise AssertionError('covered words should not reach the model')
+
+    with patch('quiz_generator.get_question_bank', return_value=bank):
+        quiz = generate_toeic_quiz(StubBackend(responder=responder), words, num_questions=4, user_id='U1')
+        assert len(quiz) == 4
+        # 同一位使用者下一次不會再拿到看過的題目，只能改由模型出題（這裡模型失敗，結果為空）
+        assert generate_toeic_quiz(StubBackend(responder=responder), words, num_questions=4, user_id='U1',
+                                   mode='llm') == []
+
+def test_local_and_cached_questions_are_not_repeated_for_a_user(tmp_path):
+    bank = QuestionBank(db_path=str(tmp_path / 'bank.db'))
+    sentences = {"budget": "We are over the budget.", "deadline": "The deadline is Friday.",
+                 "invoice": "Please send the invoice.", "contract": "They signed the contract."}
+    words = [{"word": w, "definition": "d", "part_of_speech": "noun", "example_sentence": sentence}
+             for w, sentence in sentences.items()]
+
+    with patch('quiz_generator.get_question_bank', return_value=bank), \
+         patch('quiz_generator.get_lexicon', return_value=None):
+        first = generate_toeic_quiz(None, words, num_questions=4, user_id='U1', mode='local')
+        assert len(first) == 4
+        # 本地填空題每次都一樣，同一位使用者不會再拿到，其他使用者仍然可以
+        assert generate_toeic_quiz(None, words, num_questions=4, user_id='U1', mode='local') == []
+        assert len(generate_toeic_quiz(None, words, num_questions=4, user_id='U2', mode='local')) == 4
+
+        calls = []
+
+        def responder(messages):
+            calls.append(messages)
+            return json.dumps([
+                {"question": f"Round {len(calls)} question {i} _____.", "options": {"A": "a", "B": "b", "C": "c", "D": "d"},
+                 "correct_answer": "A", "explanation": "x", "word": "budget"}
+                for i in range(2)
+            ])
+
+        backend = StubBackend(responder=responder)
+        llm_first = generate_toeic_quiz(backend, words[:1], num_questions=2, shards=1, user_id='U3', mode='llm')
+        # 第二次命中快取的題目使用者都看過，略過快取重新生成
+        llm_second = generate_toeic_quiz(backend, words[:1], num_questions=2, shards=1, user_id='U3', mode='llm')
+    assert len(calls) == 2
+    assert len(llm_second) == 2
+    assert not {q['question'] for q in llm_first} & {q['question'] for q in llm_second}
+
+def test_question_limit_is_applied_after_excluding_seen_questions(tmp_path):
+    bank = QuestionBank(db_path=str(tmp_path / 'bank.db'))
+    sentences = {"budget": "We are over the budget.", "deadline": "The deadline is Friday.",
+                 "invoice": "Please send the invoice.", "contract": "They signed the contract."}
+    words = [{"word": w, "definition": "d", "part_of_speech": "noun", "example_sentence": sentence}
+             for w, sentence in sentences.items()]
+
+    with patch('quiz_generator.get_question_bank', return_value=bank), \
+         patch('quiz_generator.get_lexicon', return_value=None):
+        first = generate_toeic_quiz(None, words, num_questions=2, user_id='U1', mode='local')
+        second = generate_toeic_quiz(None, words, num_questions=2, user_id='U1', mode='local')
+    assert len(first) == 2 and len(second) == 2
+    assert not {q['question'] for q in first} & {q['question'] for q in second}
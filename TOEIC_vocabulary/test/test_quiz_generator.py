@@ -0,0 +1,126 @@
+import json
+import re
+from unittest.mock import patch
+import pytest
+from llm_backends import StubBackend
+from lexicon import Lexicon
+from quiz_generator import generate_cloze_questions, generate_toeic_quiz, parse_quiz_response, _resolve_backend
+
+@pytest.fixture(autouse=True)
+def no_shared_question_bank():
+    # 不讓測試讀寫工作目錄下的 question_bank.db
+    with patch('quiz_generator.get_question_bank', return_value=None):
+        yield
+
+WORDS = [{"word": w, "definition": "d", "part_of_speech": "noun", "example_sentence": "e"}
+         for w in ("budget", "deadline", "invoice", "supplier")]
+
+def _question(text):
+    return {"question": text, "options": {"A": "a", "B": "b", "C": "c", "D": "d"},
+            "correct_answer": "A", "explanation": "x"}
+
+def test_failed_shards_are_retried_and_results_merged():
+    calls = []
+
+    def responder(messages):
+        prompt = messages[-1]['content']
+        shard_words = re.findall(r'"word":"(\w+)"', prompt)
+        calls.append(shard_words)
+        if 'invoice' in shard_words and sum('invoice' in c for c in calls) == 1:
+            return 'not json'
+        # 每個分片都出一題重複的題目，合併後應只留下一題
+        return json.dumps({"questions": [_question(f"About {w}") for w in shard_words] + [_question("Shared  question")]})
+
+    with patch('quiz_generator.get_llm_cache', return_value=None):
+        quiz = generate_toeic_quiz(StubBackend(responder=responder), WORDS, num_questions=6, shards=2, mode='llm')
+
+    # 兩個分片各呼叫一次，失敗的分片重試一次
+    assert len(calls) == 3
+    texts = [q['question'] for q in quiz]
+    assert len(texts) == 5
+    assert texts.count("Shared  question") == 1
+    assert {"About budget", "About invoice", "About deadline", "About supplier"} <= set(texts)
+
+def test_partial_quiz_when_a_shard_keeps_failing():
+    def responder(messages):
+        prompt = messages[-1]['content']
+        if '"invoice"' in prompt:
+            raise ValueError('model error')
+        return json.dumps({"questions": [_question("About budget")]})
+
+    with patch('quiz_generator.get_llm_cache', return_value=None):
+        quiz = generate_toeic_quiz(StubBackend(responder=responder), WORDS, num_questions=4, shards=2, mode='llm')
+    assert [q['question'] for q in quiz] == ["About budget"]
+
+def test_truncated_quiz_response_keeps_complete_questions():
+    text = '```json\n{"questions": [' + json.dumps(_question("Q1")) + ', {"question": "Q2", "opt'
+    assert [q['question'] for q in parse_quiz_response(text)] == ["Q1"]
+
+CLOZE_WORDS = [
+    {"word": "budget", "definition": "a plan for spending", "part_of_speech": "noun", "example_sentence": "We are over budget."},
+    {"word": "approve", "definition": "to officially accept", "part_of_speech": "verb", "example_sentence": "The manager approved the plan."},
+    {"word": "deadline", "definition": "a time limit", "part_of_speech": "noun", "example_sentence": "The deadline is Friday."},
+]
+
+def _lexicon(tmp_path, entries):
+    lexicon = Lexicon(db_path=str(tmp_path / 'lexicon.db'), seed_path=str(tmp_path / 'missing.tsv'))
+    lexicon.record([{"word": w, "definition": "d", "part_of_speech": pos} for w, pos in entries])
+    return lexicon
+
+def test_cloze_questions_use_pos_matched_distractors(tmp_path):
+    lexicon = _lexicon(tmp_path, [("review", "verb"), ("complete", "verb"), ("supply", "verb"), ("submit", "verb"),
+                                  ("invoice", "noun"), ("contract", "noun")])
+    questions = generate_cloze_questions(CLOZE_WORDS, lexicon=lexicon)
+    # 同樣的輸入得到同樣的題目
+    assert questions == generate_cloze_questions(CLOZE_WORDS, lexicon=lexicon)
+
+    by_answer = {q['options'][q['correct_answer']]: q for q in questions}
+    assert set(by_answer) == {'budget', 'approved', 'deadline'}
+    verb = by_answer['approved']
+    assert verb['question'] == "The manager _____ the plan."
+    # 干擾選項與答案同為過去式；submit 需要重複字尾子音，不列入
+    assert set(verb['options'].values()) == {'approved', 'reviewed', 'completed', 'supplied'}
+    assert set(by_answer['budget']['options'].values()) == {'budget', 'deadline', 'invoice', 'contract'}
+
+def test_local_mode_skips_the_model(tmp_path):
+    lexicon = _lexicon(tmp_path, [("invoice", "noun"), ("contract", "noun")])
+
+    def responder(messages):
+        raise AssertionError('local mode should not call the model')
+
+    with patch('quiz_generator.get_lexicon', return_value=lexicon):
+        quiz = generate_toeic_quiz(StubBackend(responder=responder), CLOZE_WORDS, mode='local')
+    assert [q['type'] for q in quiz] == ['cloze', 'cloze']
+
+def test_hybrid_mode_only_sends_words_without_local_questions_to_the_model(tmp_path):
+    lexicon = _lexicon(tmp_path, [("invoice", "noun"), ("contract", "noun")])
+    words = CLOZE_WORDS + [{"word": "supplier", "definition": "a company that provides goods",
+                            "part_of_speech": "noun", "example_sentence": "No usable sentence here."}]
+    prompts = []
+
+    def responder(messages):
+        prompts.append(messages[-1]['content'])
+        return json.dumps([dict(_question("Which company provides goods?"), word="supplier")])
+
+    with patch('quiz_generator.get_lexicon', return_value=lexicon), \
+         patch('quiz_generator.get_llm_cache', return_value=None):
+        quiz = generate_toeic_quiz(StubBackend(responder=responder), words, num_questions=50, shards=1)
+        assert [q.get('type') for q in quiz] == ['cloze', 'cloze', None]
+        # 只有本地出不了題的字（沒有同詞性干擾選項的 approve、例句沒有目標字的 supplier）交給模型，
+        # 而且不要求模型補滿 50 題
+        assert len(prompts) == 1 and '"supplier"' in prompts[0] and '"approve"' in prompts[0]
+        assert '"budget"' not in prompts[0]
+
+        # 每個字都能在本地出題時完全不呼叫模型
+        prompts.clear()
+        quiz = generate_toeic_quiz(StubBackend(responder=responder), [CLOZE_WORDS[0], CLOZE_WORDS[2]], num_questions=50)
+    assert prompts == [] and len(quiz) == 2
+
+def test_gemini_model_object_reuses_one_backend():
+    class FakeModel:
+        model_name = 'fake-gemini'
+
+    model = FakeModel()
+    backend = _resolve_backend(model)
+    assert _resolve_backend(model) is backend
+    assert _resolve_backend(FakeModel()) is not backend
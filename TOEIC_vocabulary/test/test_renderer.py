@@ -0,0 +1,36 @@
+import io
+from renderer import (iter_email_html, iter_line_records, pack_text, render, write_chunks, flex_carousels,
+                      batch_messages)
+from quiz_generator import format_quiz_for_email
+
+WORDS = [{"word": f"word{i}", "definition": f"定義 {i}", "part_of_speech": "noun",
+          "example_sentence": f"Example {i} <b>"} for i in range(30)]
+QUESTIONS = [{"question": "Pick _____.", "options": {"A": "a", "B": "b", "C": "c", "D": "d"},
+              "correct_answer": "A", "explanation": "x"}]
+
+def test_email_renders_words_and_quiz_escaped():
+    content = render(iter_email_html("Title & more", WORDS[:2], QUESTIONS))
+    assert "Title &amp; more" in content
+    assert "<strong>word1</strong> (noun) - 定義 1<br>例句：Example 1 &lt;b&gt;" in content
+    assert "<h3>練習題：</h3>" in content and "<p>D) d</p>" in content
+    assert format_quiz_for_email([]) == ""
+
+    out = io.StringIO()
+    assert write_chunks(out, iter_email_html("t", WORDS, QUESTIONS)) == len(out.getvalue())
+
+def test_line_text_splits_on_record_boundaries():
+    records = list(iter_line_records("https://youtu.be/x", "t", WORDS))
+    messages = pack_text(records, limit=200)
+    assert ''.join(messages) == ''.join(records)
+    assert all(len(m) <= 200 for m in messages)
+    # 每則訊息都由完整的紀錄組成
+    for message in messages:
+        assert message.startswith("Video URL") or message.startswith("\n")
+    assert pack_text(["x" * 450], limit=200) == ["x" * 200, "x" * 200, "x" * 50]
+    assert pack_text(iter_line_records("u", "t", []))[0].endswith("未找到任何單字。")
+
+def test_flex_carousels_and_batches():
+    carousels = flex_carousels(WORDS)
+    assert [len(c['contents']) for c in carousels] == [12, 12, 6]
+    assert carousels[0]['contents'][0]['body']['contents'][0]['text'] == 'word0'
+    assert [len(b) for b in batch_messages(list(range(11)))] == [5, 5, 1]
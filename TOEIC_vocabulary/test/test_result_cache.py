@@ -0,0 +1,34 @@
+import time
+from result_cache import ExtractionCache
+
+WORDS = [{"word": "budget", "definition": "an amount of money available", "part_of_speech": "noun", "example_sentence": "We are over budget."}]
+
+def test_cache_hit_and_version_isolation(tmp_path):
+    cache = ExtractionCache(db_path=str(tmp_path / 'cache.db'))
+    cache.set('abcdefghijk', 'gemma3:v1', 'Title', WORDS)
+
+    cached = cache.get('abcdefghijk', 'gemma3:v1')
+    assert cached == {'title': 'Title', 'words': WORDS}
+    assert cache.get('abcdefghijk', 'gemma3:v2') is None
+
+def test_cache_ttl_expiry(tmp_path):
+    cache = ExtractionCache(db_path=str(tmp_path / 'cache.db'), ttl_seconds=1)
+    cache.set('abcdefghijk', 'v1', 'Title', WORDS)
+    cache.ttl_seconds = 0.01
+    time.sleep(0.05)
+    assert cache.get('abcdefghijk', 'v1') is None
+
+def test_cache_lru_eviction(tmp_path):
+    cache = ExtractionCache(db_path=str(tmp_path / 'cache.db'), max_entries=2)
+    cache.set('video000001', 'v1', 'A', WORDS)
+    time.sleep(0.01)
+    cache.set('video000002', 'v1', 'B', WORDS)
+    time.sleep(0.01)
+    # 讀取第一部影片，使第二部成為最久未使用的項目
+    assert cache.get('video000001', 'v1') is not None
+    time.sleep(0.01)
+    cache.set('video000003', 'v1', 'C', WORDS)
+
+    assert cache.get('video000001', 'v1') is not None
+    assert cache.get('video000002', 'v1') is None
+    assert cache.get('video000003', 'v1') is not None
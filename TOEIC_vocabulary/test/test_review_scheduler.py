@@ -0,0 +1,49 @@
+from review_scheduler import ReviewScheduler, sm2, DAY_SECONDS
+
+def _word(word, pos='noun'):
+    return {"word": word, "definition": f"{word} 的定義", "part_of_speech": pos, "example_sentence": f"The {word}."}
+
+def test_sm2_intervals_and_lapse():
+    reps, interval, ease = sm2(4, 0, 0.0, 2.5)
+    assert (reps, interval) == (1, 1.0)
+    reps, interval, ease = sm2(4, reps, interval, ease)
+    assert (reps, interval) == (2, 6.0)
+    previous_ease = ease
+    reps, interval, ease = sm2(5, reps, interval, ease)
+    assert reps == 3 and interval == round(6.0 * previous_ease, 1)
+    reps, interval, lapsed_ease = sm2(1, reps, interval, ease)
+    assert (reps, interval) == (0, 1.0)
+    assert lapsed_ease < ease
+
+def test_due_users_in_order_and_persisted(tmp_path):
+    db = str(tmp_path / 'review.db')
+    scheduler = ReviewScheduler(db_path=db, first_delay=DAY_SECONDS)
+    assert scheduler.add_words('U1', [_word('budget'), _word('budgets'), _word('deadline')], now=0) == 2
+    scheduler.add_words('U2', [_word('budget')], now=100)
+    assert scheduler.stats()['words'] == 2
+    assert scheduler.pop_due(now=DAY_SECONDS - 1) == []
+
+    sent = []
+    assert scheduler.deliver_due(lambda user, words: sent.append((user, [w['word'] for w in words])),
+                                 now=DAY_SECONDS + 100) == 2
+    assert sent == [('U1', ['budget', 'deadline']), ('U2', ['budget'])]
+    # 推播後以預設品質排到下一次（SM-2 第二次間隔 1 天）
+    assert scheduler.pop_due(now=DAY_SECONDS + 200) == []
+
+    # 使用者回報忘記後重新載入，狀態仍保留
+    assert scheduler.grade('U1', 'Budget', 1, now=DAY_SECONDS + 300)
+    assert not scheduler.grade('U1', 'invoice', 1)
+    reloaded = ReviewScheduler(db_path=db)
+    due = reloaded.pop_due(now=2 * DAY_SECONDS + 250)
+    assert [(user, [w['word'] for w in words]) for user, words in due] == [('U1', ['deadline']), ('U2', ['budget'])]
+
+def test_failed_delivery_is_retried(tmp_path):
+    scheduler = ReviewScheduler(db_path=str(tmp_path / 'review.db'), first_delay=0)
+    scheduler.add_words('U1', [_word('invoice')], now=0)
+
+    def fail(user, words):
+        raise RuntimeError("push failed")
+
+    assert scheduler.deliver_due(fail, now=10) == 0
+    assert scheduler.pop_due(now=20) == []
+    assert [user for user, _ in scheduler.pop_due(now=400)] == ['U1']
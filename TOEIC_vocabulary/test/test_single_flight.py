@@ -0,0 +1,50 @@
+import threading
+import time
+from single_flight import SingleFlight
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight('test')
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def slow_extract(video_id):
+        calls.append(video_id)
+        started.set()
+        release.wait(timeout=5)
+        return {'video_id': video_id}
+
+    def worker():
+        results.append(flights.do('abc', slow_extract, 'abc'))
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    threads[0].start()
+    assert started.wait(timeout=5)
+    for thread in threads[1:]:
+        thread.start()
+    # 等其餘四個請求都掛到進行中的呼叫上
+    while flights._calls['abc'].waiters < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert calls == ['abc']
+    assert len(results) == 5
+    assert all(result == {'video_id': 'abc'} for result, _ in results)
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+
+def test_errors_propagate_to_waiters_and_key_is_released():
+    flights = SingleFlight('test_error')
+
+    def failing():
+        raise RuntimeError('boom')
+
+    try:
+        flights.do('key', failing)
+        assert False, 'should raise'
+    except RuntimeError:
+        pass
+    assert flights.in_flight() == 0
+    assert flights.do('key', lambda: 42) == (42, False)
@@ -0,0 +1,28 @@
+import json
+from stream_parser import IncrementalJSONArrayParser
+
+def test_objects_are_emitted_as_soon_as_they_close():
+    words = [
+        {"word": "budget", "definition": "a plan {with braces}", "part_of_speech": "noun", "example_sentence": "He said \"fine\"]."},
+        {"word": "deadline", "definition": "a time limit", "part_of_speech": "noun", "example_sentence": "Friday."},
+    ]
+    text = "Sure! ```json\n" + json.dumps(words, indent=2) + "\n```"
+    parser = IncrementalJSONArrayParser()
+
+    emitted = []
+    first_emitted_at = None
+    # 模擬模型每次只吐出幾個字元
+    for i in range(0, len(text), 7):
+        new_items = parser.feed(text[i:i + 7])
+        if new_items and first_emitted_at is None:
+            first_emitted_at = i
+        emitted.extend(new_items)
+
+    assert emitted == words
+    assert parser.finished
+    assert first_emitted_at < text.index('deadline')
+
+def test_malformed_object_is_skipped():
+    parser = IncrementalJSONArrayParser()
+    items = parser.feed('[{"word": "a",}, {"word": "b"}]')
+    assert items == [{"word": "b"}]
@@ -0,0 +1,91 @@
+import threading
+from task_queue import FairWorkerPool, REJECTED_QUEUE_FULL, REJECTED_USER_QUEUE_FULL, REJECTED_RATE_LIMITED
+
+def test_pool_rejects_when_queue_full():
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocking_job():
+        started.set()
+        release.wait(timeout=5)
+
+    pool = FairWorkerPool(num_workers=1, max_queue_size=2, max_queued_per_user=10, rate_per_minute=0,
+                          name='test_full')
+    try:
+        assert pool.submit('U1', blocking_job)[1] is None
+        assert started.wait(timeout=5)
+        # worker 被佔住，接下來兩個工作會排在佇列中
+        assert pool.submit('U1', blocking_job) == (1, None)
+        assert pool.submit('U1', blocking_job) == (2, None)
+        assert pool.submit('U2', blocking_job) == (None, REJECTED_QUEUE_FULL)
+        assert pool.stats()['rejected'][REJECTED_QUEUE_FULL] == 1
+    finally:
+        release.set()
+        pool.shutdown()
+
+def test_pool_records_timings():
+    done = []
+    pool = FairWorkerPool(num_workers=2, max_queue_size=10, max_inflight_per_user=2, rate_per_minute=0,
+                          name='test_timings')
+    for i in range(5):
+        pool.submit(f'U{i % 2}', done.append, i)
+    pool.shutdown()
+
+    stats = pool.stats()
+    assert sorted(done) == [0, 1, 2, 3, 4]
+    assert stats['accepted'] == 5
+    assert stats['wait_seconds']['count'] == 5
+    assert stats['service_seconds']['count'] == 5
+
+def test_fair_pool_serves_light_user_before_heavy_backlog():
+    release = threading.Event()
+    order = []
+
+    def job(user, i):
+        release.wait(timeout=5)
+        order.append((user, i))
+
+    pool = FairWorkerPool(num_workers=1, max_queue_size=50, max_inflight_per_user=1, max_queued_per_user=20,
+                          rate_per_minute=0, name='test_fair')
+    for i in range(10):
+        assert pool.submit('heavy', job, 'heavy', i)[1] is None
+    position, rejected = pool.submit('light', job, 'light', 0)
+    assert rejected is None and position <= 3
+    release.set()
+    pool.shutdown()
+
+    # 輕度使用者的工作在重度使用者的第二個工作之後就會執行，而不是排在 10 個之後
+    assert order.index(('light', 0)) <= 2
+    assert [i for user, i in order if user == 'heavy'] == list(range(10))
+
+def test_fair_pool_per_user_limits():
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocking_job():
+        started.set()
+        release.wait(timeout=5)
+
+    pool = FairWorkerPool(num_workers=2, max_queue_size=50, max_inflight_per_user=1, max_queued_per_user=2,
+                          rate_per_minute=0, name='test_fair_limits')
+    try:
+        assert pool.submit('U1', blocking_job)[1] is None
+        assert started.wait(timeout=5)
+        assert pool.submit('U1', blocking_job)[1] is None
+        assert pool.submit('U1', blocking_job)[1] is None
+        # 一個在執行、兩個在排隊，第三個排隊的工作被拒絕；另一個執行緒不會被同一位使用者佔用
+        assert pool.submit('U1', blocking_job) == (None, REJECTED_USER_QUEUE_FULL)
+        stats = pool.stats()
+        assert stats['running_users'] == 1 and stats['queue_depth'] == 2
+    finally:
+        release.set()
+        pool.shutdown()
+
+    pool = FairWorkerPool(num_workers=1, max_queue_size=50, rate_per_minute=60, burst=3, name='test_fair_rate')
+    try:
+        for _ in range(3):
+            assert pool.submit('U2', lambda: None)[1] is None
+        assert pool.submit('U2', lambda: None) == (None, REJECTED_RATE_LIMITED)
+        assert pool.submit('U3', lambda: None)[1] is None
+    finally:
+        pool.shutdown()
@@ -0,0 +1,28 @@
+from text_utils import lemmatize
+
+def test_lemmatize_restores_silent_e():
+    for word, lemma in [('changed', 'change'), ('proposed', 'propose'), ('decided', 'decide'),
+                        ('caused', 'cause'), ('reimbursed', 'reimburse'), ('required', 'require'),
+                        ('scheduled', 'schedule'), ('managing', 'manage'), ('hoped', 'hope'),
+                        ('completed', 'complete'), ('agreed', 'agree'), ('negotiated', 'negotiate'),
+                        ('invited', 'invite'), ('excited', 'excite'), ('valued', 'value'), ('argued', 'argue'),
+                        ('issuing', 'issue'), ('continuing', 'continue'), ('guided', 'guide'),
+                        ('determined', 'determine'), ('making', 'make'), ('created', 'create')]:
+        assert lemmatize(word) == lemma, word
+    # 原本就沒有 e 的字不補
+    for word, lemma in [('treated', 'treat'), ('avoided', 'avoid'), ('budgeted', 'budget'),
+                        ('focused', 'focus'), ('belonged', 'belong'), ('visited', 'visit'), ('waited', 'wait'),
+                        ('edited', 'edit'), ('maintained', 'maintain'), ('loaded', 'load')]:
+        assert lemmatize(word) == lemma, word
+
+def test_lemmatize_double_consonants():
+    for word, lemma in [('running', 'run'), ('planned', 'plan'), ('submitted', 'submit'),
+                        ('cancelled', 'cancel'), ('added', 'add'), ('called', 'call'), ('staffed', 'staff')]:
+        assert lemmatize(word) == lemma, word
+
+def test_lemmatize_leaves_base_forms_alone():
+    for word in ['negotiate', 'estimate', 'morning', 'during', 'speed', 'indeed', 'hundred', 'perhaps', 'something',
+                 'nothing', 'bring', 'proceed', 'logistics', 'business']:
+        assert lemmatize(word) == word, word
+    assert lemmatize('budgets') == 'budget'
+    assert lemmatize('companies') == 'company'
@@ -0,0 +1,53 @@
+import json
+import logging
+import threading
+import metrics
+from tracing import request_context, span, current_request_id, log_event, log_trace
+
+def test_spans_are_collected_per_request_and_recorded():
+    before = metrics.histogram('pipeline_stage_seconds', labels={'stage': 'test_stage'}).count
+    with request_context('req-1') as trace:
+        assert current_request_id() == 'req-1'
+        with span('test_stage'):
+            pass
+        try:
+            with span('test_stage'):
+                raise ValueError("boom")
+        except ValueError:
+            pass
+    assert current_request_id() is None
+    assert [stage for stage, _ in trace['spans']] == ['test_stage', 'test_stage']
+    assert metrics.histogram('pipeline_stage_seconds', labels={'stage': 'test_stage'}).count == before + 2
+    assert metrics.counter('pipeline_stage_errors_total', labels={'stage': 'test_stage'}).value >= 1
+
+    # 其他執行緒不會繼承 request ID
+    seen = []
+    with request_context('req-2'):
+        thread = threading.Thread(target=lambda: seen.append(current_request_id()))
+        thread.start()
+        thread.join()
+    assert seen == [None]
+
+def test_structured_logs_are_sampled(caplog):
+    caplog.set_level(logging.INFO)
+    with request_context('req-3') as trace:
+        with span('sampled_stage'):
+            pass
+        assert not log_event('skipped', sample_rate=0)
+        assert log_event('always', level=logging.WARNING, sample_rate=0, size=3)
+        assert log_trace(trace, event='done', sample_rate=1)
+    records = [json.loads(r.getMessage()) for r in caplog.records]
+    assert records[0] == {'event': 'always', 'request_id': 'req-3', 'size': 3}
+    assert records[1]['event'] == 'done' and 'sampled_stage' in records[1]['spans']
+
+def test_prometheus_rendering():
+    metrics.counter('test_render_total', 'a "quoted" counter', {'path': 'a"b'}).inc(2)
+    metrics.histogram('test_render_seconds', 'latency', buckets=(0.1, 1)).observe(0.5)
+    text = metrics.render_prometheus()
+    assert '# TYPE test_render_total counter' in text
+    assert 'test_render_total{path="a\\"b"} 2.0' in text
+    assert 'test_render_seconds_bucket{le="0.1"} 0' in text
+    assert 'test_render_seconds_bucket{le="1.0"} 1' in text
+    assert 'test_render_seconds_bucket{le="+Inf"} 1' in text
+    assert 'test_render_seconds_count 1' in text
+    assert text.endswith('\n')
@@ -0,0 +1,192 @@
+import json
+import re
+from typing import Dict, List
+
+_WORD_RE = re.compile(r"[A-Za-z]+(?:['’-][A-Za-z]+)*")
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+# 中日文字元通常一個字就是一個以上的 token，不能和英文單字一樣整段算一個字
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+# 每則對話訊息的角色標記與分隔符號大約佔用的 token
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 常見的不規則變化，其餘以字尾規則處理
+_IRREGULAR_LEMMAS = {
+    'was': 'be', 'were': 'be', 'is': 'be', 'are': 'be', 'been': 'be', 'am': 'be',
+    'has': 'have', 'had': 'have', 'did': 'do', 'does': 'do', 'done': 'do',
+    'went': 'go', 'gone': 'go', 'made': 'make', 'got': 'get', 'gotten': 'get',
+    'took': 'take', 'taken': 'take', 'gave': 'give', 'given': 'give',
+    'bought': 'buy', 'sold': 'sell', 'paid': 'pay', 'spent': 'spend', 'built': 'build',
+    'sent': 'send', 'met': 'meet', 'held': 'hold', 'kept': 'keep', 'left': 'leave',
+    'brought': 'bring', 'thought': 'think', 'found': 'find', 'told': 'tell', 'said': 'say',
+    'began': 'begin', 'begun': 'begin', 'chose': 'choose', 'chosen': 'choose',
+    'wrote': 'write', 'written': 'write', 'ran': 'run', 'came': 'come', 'became': 'become',
+    'people': 'person', 'children': 'child', 'men': 'man', 'women': 'woman',
+    'analyses': 'analysis', 'criteria': 'criterion', 'data': 'data', 'news': 'news',
+    'business': 'business', 'series': 'series',
+    'used': 'use', 'using': 'use',
+}
+_VOWELS = set('aeiou')
+# 字尾看起來像變化形式、其實本身就是原形的字
+_BASE_FORMS = {
+    'morning', 'evening', 'during', 'ceiling', 'wedding', 'pudding',
+    'hundred', 'kindred', 'sacred', 'naked', 'wicked', 'hatred', 'rugged',
+    'perhaps', 'always', 'towards', 'afterwards', 'whereas', 'besides', 'nowadays', 'species',
+}
+# 以 -eed 結尾的字大多是原形（speed, need, proceed），只有這些是 -ee 動詞加 -d
+_EED_VERBS = {'agree', 'disagree', 'free', 'guarantee', 'decree', 'referee'}
+# 去掉 -ed/-ing 後通常需要補回 e 的字尾
+_SILENT_E_STEMS = ('v', 'z', 'c', 'u', 'dg', 'rg', 'ul', 'ag', 'ud', 'ys', 'eng')
+# 字尾規則判斷不了、去掉 -ed/-ing 後要補回 e 的字幹（invited -> invite；visited, edited 不補）
+_SILENT_E_WORDS = {
+    'creat', 'invit', 'excit', 'unit', 'cit', 'recit', 'ignit', 'expedit', 'writ', 'compet', 'quot', 'devot',
+    'stor', 'scor', 'ignor', 'explor', 'restor', 'postpon', 'phon', 'welcom', 'overcom',
+}
+# 以母音 + s 結尾、不需要補 e 的字（focused -> focus）
+_NO_SILENT_E = {'focus', 'bias', 'bonus', 'canvas', 'census', 'consensus', 'virus', 'alias', 'atlas'}
+
+
+def tokenize(text) -> List[str]:
+    """取出英文單字（保留縮寫與連字號），全部轉成小寫"""
+    return [match.group(0).lower() for match in _WORD_RE.finditer(text or '')]
+
+
+def estimate_tokens(text) -> int:
+    """粗估文字的 token 數：英文單字平均約 1.3 個 token，中文字與標點各算 1 個"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    if cjk:
+        text = _CJK_RE.sub(' ', text)
+    pieces = _TOKEN_RE.findall(text)
+    words = sum(1 for piece in pieces if piece[0].isalnum())
+    return int(words * 1.3) + (len(pieces) - words) + cjk
+
+
+def estimate_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """粗估一組對話訊息送進模型時佔用的 token 數"""
+    return sum(estimate_tokens(message.get('content', '')) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def compact_json(data) -> str:
+    """放進提示詞用的精簡 JSON：不縮排、不加多餘空白，保留中文原字"""
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def _needs_silent_e(stem) -> bool:
+    """判斷去掉 -ed/-ing 後的字幹是否要補回 e（changed -> change, negotiated -> negotiate）"""
+    if stem in _NO_SILENT_E:
+        return False
+    if stem in _SILENT_E_WORDS:
+        return True
+    last, before = stem[-1], stem[-2]
+    before_consonant = stem[-3] not in _VOWELS
+    if stem.endswith(_SILENT_E_STEMS):
+        # valued, argued, continuing 也在這裡
+        return True
+    if stem.endswith('ang') and len(stem) > 4:
+        # changed, arranged；hanged, banged 不補
+        return True
+    if last == 's':
+        # proposed, caused, increased, reversed, collapsed
+        return before in _VOWELS or before in 'rpnl'
+    if stem.endswith('il'):
+        # compiled, smiled；detailed, failed 不補
+        return before_consonant
+    if last == 'l':
+        # handled, settled, enabled
+        return before not in _VOWELS and before not in 'lrw'
+    if stem.endswith('at'):
+        # located, negotiated, evaluated；treated, floated, waited 不補
+        return not stem.endswith(('eat', 'oat', 'ait'))
+    if stem.endswith(('id', 'ad')):
+        # decided, guided, traded, persuaded；avoided, loaded, headed 不補
+        return stem[-3] not in 'aeo'
+    if stem.endswith(('ir', 'ur', 'ar', 'ut', 'in', 'am', 'ak', 'ik', 'ok', 'ap', 'od')):
+        # required, secured, compared, executed, determined, blamed, liked, invoked, escaped, exploded；
+        # repaired, shouted, maintained, claimed, booked 不補
+        return before_consonant or stem.endswith('quir')
+    if stem.endswith(('let', 'mot')) and len(stem) > 4:
+        # completed, deleted, promoted
+        return True
+    # hoped, noted, voted：子音 + 母音 + 子音的短字幹
+    return (len(stem) == 3 and last not in _VOWELS and before in _VOWELS
+            and before_consonant and last not in 'wxy')
+
+
+def lemmatize(word) -> str:
+    """
+    以字尾規則將單字還原成原形，只用於合併同一個字的不同變化形式，不求語言學上完全正確；
+    規則無法處理的常見字列在 _IRREGULAR_LEMMAS 與 _BASE_FORMS
+    """
+    word = (word or '').lower().strip()
+    if word in _IRREGULAR_LEMMAS:
+        return _IRREGULAR_LEMMAS[word]
+    if len(word) <= 3 or not word.isalpha() or word in _BASE_FORMS:
+        return word
+    if word.endswith('ies') and len(word) > 4:
+        return word[:-3] + 'y'
+    if word.endswith(('sses', 'shes', 'ches', 'xes', 'zes')):
+        return word[:-2]
+    if word.endswith('s'):
+        if word.endswith(('ss', 'us', 'is', 'ics')):
+            return word
+        return word[:-1]
+    if word.endswith('eed'):
+        return word[:-1] if word[:-1] in _EED_VERBS else word
+    # nothing, something, anything
+    if word.endswith('thing'):
+        return word
+    for suffix in ('ing', 'ed'):
+        if not word.endswith(suffix):
+            continue
+        stem = word[:-len(suffix)]
+        # 字幹太短或沒有母音時不是變化形式（bring, string, shed）
+        if len(stem) < 3 or not any(c in _VOWELS or c == 'y' for c in stem):
+            return word
+        # running -> run, planned -> plan, cancelled -> cancel；added, called, staffed 不變
+        if stem[-1] == stem[-2] and stem[-1] not in _VOWELS:
+            if stem[-1] not in 'lszf' and not (len(stem) == 3 and stem[0] in _VOWELS):
+                return stem[:-1]
+            if stem.endswith('ell') and len(stem) >= 6:
+                return stem[:-1]
+            return stem
+        if suffix == 'ed' and stem.endswith('i'):
+            return stem[:-1] + 'y'
+        # scheduled -> schedule, managing -> manage, hoped -> hope
+        if _needs_silent_e(stem):
+            return stem + 'e'
+        return stem
+    return word
+
+
+def split_sentences(text, max_words=40) -> List[str]:
+    """
+    依句點等標點切句；自動字幕常常沒有標點，過長的句子再以 max_words 個單字為單位切開
+    """
+    sentences = []
+    for sentence in _SENTENCE_RE.split((text or '').strip()):
+        words = sentence.split()
+        for i in range(0, len(words), max_words):
+            sentences.append(' '.join(words[i:i + max_words]))
+    return [sentence for sentence in sentences if sentence]
+
+
+def chunk_text(text, max_tokens) -> List[str]:
+    """
+    將長文字切成每段不超過 max_tokens（估計值）的片段，盡量在句子邊界切開
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    for sentence in split_sentences(text):
+        sentence_tokens = estimate_tokens(sentence)
+        if current and current_tokens + sentence_tokens > max_tokens:
+            chunks.append(' '.join(current))
+            current = []
+            current_tokens = 0
+        current.append(sentence)
+        current_tokens += sentence_tokens
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
@@ -1,13 +1,83 @@
+import contextvars
 import os
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from youtube_transcript_api import YouTubeTranscriptApi
 # import google.generativeai as genai
 from googleapiclient.discovery import build
 # from email_utils import create_email_content, send_email
-from youtube_utils import search_youtube_videos, simple_get_video_transcript, get_video_title, get_video_info_by_url
-from model_utils import extract_toeic_words_with_ollama
-from quiz_generator import generate_toeic_quiz, format_quiz_for_email
+from youtube_utils import search_youtube_videos, simple_get_video_transcript, get_video_title, get_video_info_by_url, parse_video_id, get_youtube_client
+from model_utils import (extract_toeic_words_with_ollama, stream_toeic_words_with_ollama, extraction_cache_version,
+                         StreamIncompleteError)
+from result_cache import get_extraction_cache
+from quiz_generator import generate_toeic_quiz
+from renderer import iter_email_html, iter_line_records, pack_text, render
+from llm_scheduler import BATCH
+from single_flight import SingleFlight
+from tracing import log_event, span
+
+# 以 video_id 合併並行中的萃取請求，整個 process 共用
+_video_flights = SingleFlight('video_extraction')
+# 影片資訊與字幕的網路請求使用的執行緒池
+_fetch_executor = ThreadPoolExecutor(max_workers=int(os.getenv('FETCH_POOL_SIZE', '8')), thread_name_prefix='fetch')
+
+
+class _PartialWords:
+    """
+    把串流中的單字轉發給同一部影片所有等待中的請求，包含被 SingleFlight 合併、不自己執行萃取的請求；
+    晚加入的請求會先收到目前為止的單字
+
+    回呼在串流執行緒中呼叫，不應該阻塞（例如只把訊息排進 LineSender）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._latest = {}
+
+    def subscribe(self, video_id, callback):
+        with self._lock:
+            self._subscribers.setdefault(video_id, []).append(callback)
+            latest = self._latest.get(video_id)
+        if latest:
+            self._notify(callback, latest)
+
+    def unsubscribe(self, video_id, callback):
+        with self._lock:
+            callbacks = self._subscribers.get(video_id, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self._subscribers.pop(video_id, None)
+                self._latest.pop(video_id, None)
+
+    def publish(self, video_id, words):
+        with self._lock:
+            self._latest[video_id] = list(words)
+            callbacks = list(self._subscribers.get(video_id, []))
+        for callback in callbacks:
+            self._notify(callback, words)
+
+    @staticmethod
+    def _notify(callback, words):
+        try:
+            callback(list(words))
+        except Exception as e:
+            logging.error(f"處理串流單字回呼時發生錯誤: {e}")
+
+
+_partial_words = _PartialWords()
+
+def _timed_stage(timings, stage, func, *args, **kwargs):
+    """執行單一階段並記錄耗時（秒）"""
+    result = {}
+    try:
+        with span(stage) as result:
+            return func(*args, **kwargs)
+    finally:
+        timings[stage] = result.get('seconds')
 
 class TOEICWordExtractor:
     def __init__(self):
@@ -16,7 +86,7 @@ class TOEICWordExtractor:
         self.sender_email = os.getenv('SENDER_EMAIL')
         self.sender_password = os.getenv('SENDER_PASSWORD')
         self.recipient_email = os.getenv('RECIPIENT_EMAIL')
-        self.youtube = build('youtube', 'v3', developerKey=self.youtube_api_key)
+        self.youtube = get_youtube_client()
         # genai.configure(api_key=self.gemini_api_key)
         self.url = None
         # self.gemini_model = genai.GenerativeModel('gemini-2.5-flash-preview-05-20')
@@ -27,41 +97,57 @@ class TOEICWordExtractor:
             'technology', 'innovation', 'development', 'research', 'analysis'
         ]
 
-    def word_extraction_specific_video(self):
+    def word_extraction_specific_video(self, on_partial_words=None):
+        """
+        萃取 self.url 影片的單字並組成 LINE 訊息
+
+        Args:
+            on_partial_words: 選用的回呼函式；設定時改用串流萃取，
+                每產生一個新單字就以目前為止的單字列表呼叫一次；共用其他請求的萃取時同樣會收到。
+                在串流執行緒中呼叫，不應該阻塞
+        """
         logging.info("開始處理指定影片...")
         try:
-            # 获取视频信息
-            video_info = get_video_info_by_url(self.youtube, self.url)
-            if not video_info:
-                logging.error("無法獲取影片信息")
-                return False
-
-            # 获取视频字幕
-            transcript = simple_get_video_transcript(video_info['video_id'])
-            if not transcript:
-                logging.error("無法獲取影片字幕")
-                return False
-
-            # 提取单词
-            words = extract_toeic_words_with_ollama(transcript)
-            
-            # 准备 LINE 消息内容
-            # current_date = datetime.now().strftime("%Y-%m-%d")
-            message_content = f"Video URL - {self.url}\n\n"
-            message_content += f"影片標題：{video_info['title']}\n\n"
-            message_content += "單字列表：\n"
-            
-            if not words:
-                message_content += "未找到任何單字。"
-            else:
-                words_to_show = words[:10]
-                for i, word in enumerate(words_to_show, 1):
-                    message_content += f"\n{i}. {word['word']} ({word['part_of_speech']}) - {word['definition']}\n"
-                    message_content += f"eg. {word['example_sentence']}\n"
+            video_id = parse_video_id(self.url)
+            if not video_id:
+                logging.error("無法解析 YouTube 影片 ID")
+                return {
+                    'success': False,
+                    'message': "無法解析 YouTube 影片連結，請確認網址是否正確。"
+                }
+
+            # 同一部影片在相同模型/提示詞版本下直接使用快取結果
+            cache = get_extraction_cache()
+            cache_version = extraction_cache_version()
+            cached = cache.get(video_id, cache_version)
+            if cached:
+                logging.info(f"使用快取結果: {video_id}")
+                return {
+                    'success': True,
+                    'message': self._format_words_message(cached['title'], cached['words']),
+                    'messages': self._format_words_messages(cached['title'], cached['words']),
+                    'words': cached['words']
+                }
+
+            # 同一部影片的並行請求只跑一次完整流程，其餘請求共用結果（包含串流中的單字）
+            if on_partial_words:
+                _partial_words.subscribe(video_id, on_partial_words)
+            try:
+                outcome, shared = _video_flights.do(video_id, self._extract_video, video_id, cache_version,
+                                                    bool(on_partial_words))
+            finally:
+                if on_partial_words:
+                    _partial_words.unsubscribe(video_id, on_partial_words)
+            if shared:
+                logging.info(f"共用進行中的萃取結果: {video_id}")
+            if not outcome['success']:
+                return outcome
 
             return {
                 'success': True,
-                'message': message_content
+                'message': self._format_words_message(outcome['title'], outcome['words']),
+                'messages': self._format_words_messages(outcome['title'], outcome['words']),
+                'words': outcome['words']
             }
 
         except Exception as e:
@@ -71,7 +157,119 @@ class TOEICWordExtractor:
                 'message': f"處理影片時發生錯誤: {str(e)}"
             }
 
-    def daily_word_extraction_with_quiz(self, video_url):
+    def _extract_video(self, video_id, cache_version, stream=False):
+        """
+        取得影片資訊、字幕並萃取單字，成功時寫入快取；stream 為 True 時以串流萃取，
+        並把目前為止的單字轉發給這部影片的所有等待中的請求
+
+        Returns:
+            成功: {'success': True, 'title': 影片標題, 'words': 單字列表, 'timings': 各階段秒數}
+            失敗: {'success': False, 'message': 錯誤訊息}
+        """
+        # 前一個 flight 可能在這次查快取之後、取得 flight 之前剛寫入快取，成為 leader 後再查一次
+        cached = get_extraction_cache().get(video_id, cache_version)
+        if cached:
+            logging.info(f"使用快取結果: {video_id}")
+            return {'success': True, 'title': cached['title'], 'words': cached['words'], 'timings': {}}
+
+        timings = {}
+        try:
+            # total 和其他階段一樣記錄到 pipeline_stage_seconds
+            outcome = _timed_stage(timings, 'total', self._run_pipeline, video_id, cache_version, stream, timings)
+        finally:
+            log_event('pipeline_timings', video_id=video_id,
+                      timings={k: round(v, 3) for k, v in timings.items() if v is not None})
+        if outcome['success']:
+            outcome['timings'] = timings
+        return outcome
+
+    def _run_pipeline(self, video_id, cache_version, stream, timings):
+        """_extract_video 的各個階段，耗時寫入 timings"""
+        # 影片資訊與字幕只共用 video_id，兩個網路請求同時送出
+        # 以 copy_context() 把 request ID 帶進執行緒，兩個階段的耗時都記在同一個 request 底下
+        info_future = _fetch_executor.submit(contextvars.copy_context().run, _timed_stage, timings, 'metadata',
+                                             get_video_info_by_url, self.youtube, self.url)
+        transcript_future = _fetch_executor.submit(contextvars.copy_context().run, _timed_stage, timings, 'transcript',
+                                                   simple_get_video_transcript, video_id)
+
+        # 获取视频字幕
+        transcript = transcript_future.result()
+        if not transcript:
+            logging.error("無法獲取影片字幕")
+            return {
+                'success': False,
+                'message': "無法獲取影片字幕。"
+            }
+
+        # 影片資訊已經確定失敗就不必再跑 LLM
+        if info_future.done() and not info_future.result():
+            logging.error("無法獲取影片信息")
+            return {
+                'success': False,
+                'message': "無法獲取影片資訊。"
+            }
+
+        # 字幕一到就開始提取单词，影片資訊可能仍在取得中
+        if stream:
+            words, complete = _timed_stage(timings, 'llm', self._stream_words, transcript,
+                                           lambda partial: _partial_words.publish(video_id, partial))
+        else:
+            words = _timed_stage(timings, 'llm', extract_toeic_words_with_ollama, transcript, keywords=self.toeic_keywords)
+            complete = True
+
+        # 获取视频信息
+        video_info = info_future.result()
+        if not video_info:
+            logging.error("無法獲取影片信息")
+            return {
+                'success': False,
+                'message': "無法獲取影片資訊。"
+            }
+
+        # 不完整的結果只回給這次的使用者，不寫入快取
+        if words and complete:
+            get_extraction_cache().set(video_id, cache_version, video_info['title'], words)
+
+        return {
+            'success': True,
+            'title': video_info['title'],
+            'words': words,
+        }
+
+    def _stream_words(self, transcript, on_partial_words):
+        """
+        以串流方式萃取單字，每收到一個單字就通知呼叫端
+
+        串流中斷時改用一般萃取（會依序嘗試路由器給的其他模型）重新取得完整結果
+
+        Returns:
+            (單字列表, 是否為完整結果)
+        """
+        words = []
+        try:
+            for word in stream_toeic_words_with_ollama(transcript, keywords=self.toeic_keywords):
+                words.append(word)
+                on_partial_words(list(words))
+        except StreamIncompleteError as e:
+            logging.warning(f"{e}，改用一般萃取")
+            retried = extract_toeic_words_with_ollama(transcript, keywords=self.toeic_keywords)
+            if retried:
+                return retried, True
+            return words, False
+        return words, True
+
+    def _format_words_message(self, title, words):
+        """准备 LINE 消息内容"""
+        return ''.join(iter_line_records(self.url, title, words[:10]))
+
+    def _format_words_messages(self, title, words):
+        """LINE 訊息內容，依單字邊界切成不超過單則上限的訊息"""
+        return pack_text(iter_line_records(self.url, title, words[:10]))
+
+    def daily_word_extraction_with_quiz(self, video_url, user_id=None):
+        """
+        每日單字與考題郵件的內容；user_id（例如收件人信箱）用於避免同一位使用者重複拿到題庫中的同一題
+        """
         try:
             # 獲取影片標題
             video_title = get_video_title(video_url)
@@ -80,46 +278,25 @@ class TOEICWordExtractor:
                 return None
 
             # 獲取影片字幕
-            transcript_text = simple_get_video_transcript(video_url)
+            transcript_text = simple_get_video_transcript(parse_video_id(video_url) or video_url)
             if not transcript_text:
                 logging.error("無法獲取影片字幕")
                 return None
 
-            # 使用 Gemini 提取單字
-            words = extract_toeic_words_with_ollama(self.gemini_model, transcript_text, video_title)
+            # 使用 LLM 後端提取單字
+            words = extract_toeic_words_with_ollama(transcript_text, keywords=self.toeic_keywords, priority=BATCH)
             if not words:
                 logging.error("無法提取單字")
                 return None
 
             # 生成考題
-            quiz_questions = generate_toeic_quiz(self.gemini_model, words)
+            quiz_questions = generate_toeic_quiz(None, words, priority=BATCH, user_id=user_id)
             if not quiz_questions:
                 logging.error("無法生成考題")
                 return None
 
             # 準備郵件內容
-            email_content = f"""
-            <h2>今日 TOEIC 單字學習</h2>
-            <p>影片標題：{video_title}</p>
-            
-            <h3>單字列表：</h3>
-            <ul>
-            """
-            
-            for word in words:
-                email_content += f"""
-                <li>
-                    <strong>{word['word']}</strong> ({word['part_of_speech']}) - {word['chinese']}<br>
-                    例句：{word['example']}
-                </li>
-                """
-            
-            email_content += """
-            </ul>
-            """
-            
-            # 加入考題內容
-            email_content += format_quiz_for_email(quiz_questions)
+            email_content = render(iter_email_html(video_title, words, quiz_questions))
 
             return {
                 'subject': f'TOEIC 單字學習 - {video_title}',
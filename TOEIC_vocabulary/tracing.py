@@ -0,0 +1,104 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+
+import metrics
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+_spans = contextvars.ContextVar('spans', default=None)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+@contextmanager
+def request_context(request_id=None):
+    """
+    在這個區塊內設定 request ID 並收集各階段耗時；背景執行緒不會繼承 context，
+    需要把 request ID 當參數傳過去再重新進入 request_context()
+
+    Yields:
+        {'request_id', 'spans': [(階段, 秒數)]}
+    """
+    request_id = request_id or new_request_id()
+    trace = {'request_id': request_id, 'spans': []}
+    id_token = _request_id.set(request_id)
+    spans_token = _spans.set(trace['spans'])
+    try:
+        yield trace
+    finally:
+        _spans.reset(spans_token)
+        _request_id.reset(id_token)
+
+
+@contextmanager
+def span(stage):
+    """
+    記錄一個階段的耗時到 pipeline_stage_seconds{stage}，並附加到目前 request 的 spans
+
+    Yields:
+        dict，結束後 'seconds' 為耗時
+    """
+    result = {'stage': stage}
+    start = time.perf_counter()
+    try:
+        yield result
+    except Exception:
+        metrics.counter('pipeline_stage_errors_total', '萃取流程各階段拋出例外的次數', {'stage': stage}).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        result['seconds'] = elapsed
+        metrics.histogram('pipeline_stage_seconds', '萃取流程各階段耗時', {'stage': stage}).observe(elapsed)
+        spans = _spans.get()
+        if spans is not None:
+            spans.append((stage, round(elapsed, 6)))
+
+
+def log_event(event, level=logging.INFO, sample_rate=None, **fields):
+    """
+    以一行 JSON 記錄事件，自動帶上 request ID；低於 WARNING 的事件依 sample_rate 抽樣，
+    預設讀取 LOG_SAMPLE_RATE（0.01）；WARNING 以上一律記錄
+
+    Returns:
+        是否有寫出記錄
+    """
+    rate = float(os.getenv('LOG_SAMPLE_RATE', '0.01')) if sample_rate is None else sample_rate
+    if level < logging.WARNING and random.random() >= rate:
+        return False
+    record = {'event': event, 'request_id': current_request_id(), **fields}
+    logging.log(level, json.dumps(record, ensure_ascii=False, default=str))
+    return True
+
+
+def log_trace(trace, event='request_completed', level=logging.INFO, **fields):
+    """把 request_context() 收集的各階段耗時（同一階段多次時加總）抽樣記錄成一行 JSON"""
+    spans = {}
+    for stage, seconds in trace['spans']:
+        spans[stage] = round(spans.get(stage, 0.0) + seconds, 6)
+    return log_event(event, level=level, spans=spans, **fields)
+
+
+class RequestIdFilter(logging.Filter):
+    """讓 log format 可以使用 %(request_id)s"""
+
+    def filter(self, record):
+        record.request_id = current_request_id() or '-'
+        return True
+
+
+def configure_logging(level=logging.INFO):
+    """設定 root logger 的格式，每一行都帶上 request ID"""
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s')
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(RequestIdFilter())
@@ -1,14 +1,58 @@
 import logging
 from youtube_transcript_api import YouTubeTranscriptApi
 import re
+import threading
+import time
+import httplib2
 from googleapiclient.discovery import build
 import os
 import json
 from youtube_transcript_api.formatters import TextFormatter
+import metrics
+
+_youtube_client = None
+_youtube_client_lock = threading.Lock()
+# httplib2.Http 不是 thread-safe，每個執行緒保留自己的連線物件以重複使用 keep-alive 連線
+_thread_local = threading.local()
+
+def get_youtube_client():
+    """
+    取得整個 process 共用的 YouTube Data API 客戶端
+
+    第一次呼叫時使用 google-api-python-client 內建的靜態 discovery 文件建立，
+    之後直接重用，不會每個請求都重新解析 discovery 文件。
+    執行請求時請搭配 execute_request()，讓每個執行緒使用各自的 HTTP 連線。
+    """
+    global _youtube_client
+    if _youtube_client is None:
+        with _youtube_client_lock:
+            if _youtube_client is None:
+                start = time.perf_counter()
+                _youtube_client = build(
+                    'youtube', 'v3',
+                    developerKey=os.getenv('YOUTUBE_API_KEY'),
+                    static_discovery=True,
+                    cache_discovery=False
+                )
+                elapsed = time.perf_counter() - start
+                metrics.gauge('startup_youtube_client_build_seconds', 'YouTube 客戶端建立時間').set(elapsed)
+                logging.info(f"YouTube 客戶端建立完成，耗時 {elapsed * 1000:.1f} ms")
+    return _youtube_client
+
+def _thread_http():
+    http = getattr(_thread_local, 'http', None)
+    if http is None:
+        http = httplib2.Http(timeout=int(os.getenv('YOUTUBE_HTTP_TIMEOUT', '30')))
+        _thread_local.http = http
+    return http
+
+def execute_request(api_request):
+    """以目前執行緒專屬的 HTTP 連線執行 YouTube API 請求"""
+    return api_request.execute(http=_thread_http())
 
 def search_youtube_videos(youtube, query="AI artificial intelligence", max_results=5):
     try:
-        search_response = youtube.search().list(
+        search_response = execute_request(youtube.search().list(
             q=query,
             part='id,snippet',
             maxResults=max_results,
@@ -16,7 +60,7 @@ def search_youtube_videos(youtube, query="AI artificial intelligence", max_resul
             type='video',
             videoDuration='medium',
             relevanceLanguage='en'
-        ).execute()
+        ))
         videos = []
         for item in search_response['items']:
             video_info = {
@@ -32,19 +76,25 @@ def search_youtube_videos(youtube, query="AI artificial intelligence", max_resul
         logging.error(f"搜尋 YouTube 影片時發生錯誤: {e}")
         return []
 
-def get_video_info_by_url(youtube, url):
-    """透過 YouTube 連結取得 video_info 字典"""
+def parse_video_id(url):
+    """從 YouTube 連結解析出 11 碼的影片 ID，失敗時回傳 None"""
     # 支援多種 YouTube 連結格式
-    match = re.search(r"(?:v=|youtu.be/)([\w-]{11})", url)
+    match = re.search(r"(?:v=|youtu.be/)([\w-]{11})", url or '')
     if not match:
+        return None
+    return match.group(1)
+
+def get_video_info_by_url(youtube, url):
+    """透過 YouTube 連結取得 video_info 字典"""
+    video_id = parse_video_id(url)
+    if not video_id:
         logging.error("無法解析 YouTube 影片 ID")
         return None
-    video_id = match.group(1)
     try:
-        response = youtube.videos().list(
+        response = execute_request(youtube.videos().list(
             part="snippet",
             id=video_id
-        ).execute()
+        ))
         if not response['items']:
             logging.error("找不到該影片資訊")
             return None
@@ -88,15 +138,15 @@ def get_video_title(video_url):
         # 從 URL 中提取影片 ID
         video_id = video_url.split('v=')[-1]
         
-        # 建立 YouTube API 客戶端
-        youtube = build('youtube', 'v3', developerKey=os.getenv('YOUTUBE_API_KEY'))
+        # 使用共用的 YouTube API 客戶端
+        youtube = get_youtube_client()
         
         # 獲取影片資訊
         request = youtube.videos().list(
             part='snippet',
             id=video_id
         )
-        response = request.execute()
+        response = execute_request(request)
         
         if response['items']:
             return response['items'][0]['snippet']['title']
@@ -109,7 +159,7 @@ def get_video_title(video_url):
         return None
 
 if __name__ == "__main__":
-    youtube = build('youtube', 'v3', developerKey=os.getenv('YOUTUBE_API_KEY'))
+    youtube = get_youtube_client()
     video_info = get_video_info_by_url(youtube, 'https://www.youtube.com/watch?v=YJ3Z9XhlF5w') # 有字幕
     # video_info = get_video_info_by_url(youtube, 'https://www.youtube.com/watch?v=HzhRqVUHJ5Q!') # 沒字幕
     print(video_info)